@@ -0,0 +1,177 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import os
+import re
+import sys
+
+
+CSI = "\x1b["
+
+# Private modes queried by the terminal probe
+MODE_BRACKETED_PASTE = 2004
+MODE_SYNCHRONIZED_OUTPUT = 2026
+
+SYNC_START = CSI + "?2026h"
+SYNC_END = CSI + "?2026l"
+
+# Terminals known to be dumb, without any cursor control
+DUMB_TERMS = ("", "dumb", "unknown")
+
+# Terminal families supporting bracketed paste, for the terminfo entries
+# not listing it
+BRACKETED_PASTE_TERMS = (
+    "xterm", "screen", "tmux", "rxvt", "alacritty", "kitty", "foot", "wezterm",
+    "vte", "gnome", "konsole", "st", "iterm", "iterm2", "contour", "mintty",
+)
+
+# DECRPM, the reply to a DECRQM private mode query
+_MODE_REPORT = re.compile(r"\x1b\[\?(\d+);(\d)\$y")
+
+
+class TerminalCapabilities():
+    """
+    Control sequences the line renderer can use on the terminal
+    """
+
+    def __init__(self, cursor_movement=True, erase_line=True, insert_delete=True,
+                 bracketed_paste=True, synchronized_output=False, name=""):
+        self.cursor_movement = cursor_movement
+        self.erase_line = erase_line
+        self.insert_delete = insert_delete
+        self.bracketed_paste = bracketed_paste
+        self.synchronized_output = synchronized_output
+        self.name = name
+
+    def copy(self, **kwargs):
+        values = dict(vars(self))
+        values.update(kwargs)
+        return TerminalCapabilities(**values)
+
+    def __repr__(self):
+        return "TerminalCapabilities({})".format(
+            ", ".join("{}={!r}".format(name, value) for name, value in vars(self).items())
+        )
+
+
+ANSI_CAPABILITIES = TerminalCapabilities()
+DUMB_CAPABILITIES = TerminalCapabilities(
+    cursor_movement=False, erase_line=False, insert_delete=False, bracketed_paste=False
+)
+
+
+_capabilities_cache = {}
+
+# curses loads the terminfo entry only once per process, the entry of the
+# first terminal looked up
+_terminfo_term = None
+
+
+def _load_terminfo(term):
+    # Returns a lookup for the string capabilities of the terminfo entry,
+    # None if curses or the entry is not available
+    global _terminfo_term
+    if _terminfo_term is not None and _terminfo_term != term:
+        return None
+    try:
+        import curses
+    except ImportError:
+        return None
+
+    try:
+        fd = os.open(os.devnull, os.O_WRONLY)
+    except OSError:
+        return None
+    try:
+        curses.setupterm(term, fd)
+    except Exception:
+        return None
+    finally:
+        os.close(fd)
+    _terminfo_term = term
+
+    def lookup(name):
+        try:
+            return curses.tigetstr(name)
+        except Exception:
+            return None
+
+    return lookup
+
+
+def _detect(term):
+    if term in DUMB_TERMS:
+        return DUMB_CAPABILITIES
+
+    family = term.split("-", 1)[0]
+    terminfo = _load_terminfo(term)
+    if terminfo is None:
+        # No terminfo, the terminal is taken to be ANSI like nearly all are
+        return ANSI_CAPABILITIES.copy(name=term)
+
+    cursor_movement = bool(terminfo("cub") and terminfo("cuf"))
+    return TerminalCapabilities(
+        cursor_movement=cursor_movement,
+        erase_line=bool(terminfo("el")),
+        insert_delete=bool(terminfo("ich") and terminfo("dch")),
+        bracketed_paste=bool(terminfo("BE")) or (cursor_movement and family in BRACKETED_PASTE_TERMS),
+        synchronized_output=bool(terminfo("Sync")),
+        name=term,
+    )
+
+
+def detect_capabilities(term=None):
+    """
+    Returns the capabilities of the terminal named by term, $TERM by
+    default. Detection looks up the terminfo entry when curses is
+    available and runs once per terminal name in the process.
+    """
+    if sys.platform in ("win32", "cygwin"):
+        return DUMB_CAPABILITIES
+
+    if term is None:
+        term = os.environ.get("TERM", "")
+    capabilities = _capabilities_cache.get(term)
+    if capabilities is None:
+        capabilities = _capabilities_cache[term] = _detect(term)
+    return capabilities
+
+
+def mode_query(mode):
+    """
+    DECRQM query for a private mode, the terminal replies with DECRPM
+    """
+    return CSI + "?{}$p".format(mode)
+
+
+def parse_mode_report(sequence):
+    """
+    Returns (mode, status) of a DECRPM reply, None for other sequences.
+    Status 1 or 2 is set or reset, 3 or 4 permanently set or reset and
+    0 is an unknown mode.
+    """
+    if not isinstance(sequence, str):
+        return None
+    match = _MODE_REPORT.fullmatch(sequence)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def apply_mode_reports(capabilities, reports):
+    """
+    Returns the capabilities updated with the mode support reported to
+    the probe
+    """
+    updates = {}
+    if MODE_SYNCHRONIZED_OUTPUT in reports:
+        updates["synchronized_output"] = reports[MODE_SYNCHRONIZED_OUTPUT] in (1, 2, 3)
+    if MODE_BRACKETED_PASTE in reports:
+        updates["bracketed_paste"] = reports[MODE_BRACKETED_PASTE] in (1, 2, 3)
+    if not updates:
+        return capabilities
+    return capabilities.copy(**updates)
@@ -0,0 +1,271 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import nessaid_readline.key as key
+
+
+# Time to wait for the rest of an escape sequence before a lone ESC is
+# reported as the ESC key
+ESCAPE_TIMEOUT = 0.05
+
+# Escape sequences longer than this are cut and reported as they are
+MAX_SEQUENCE_LENGTH = 64
+
+
+_LEAF = None
+
+# Character classes for the CSI/SS3 grammar
+_PARAM = 0
+_INTERMEDIATE = 1
+_FINAL = 2
+_OTHER = 3
+
+_CHAR_CLASS = [_OTHER] * 0x20 + [_INTERMEDIATE] * 0x10 + [_PARAM] * 0x10 + [_FINAL] * 0x3F + [_OTHER]
+
+# Grammar states
+_ESCAPE = 0
+_CSI = 1
+_CSI_INTERMEDIATE = 2
+_SS3 = 3
+_DONE = 4
+_ABORT = 5
+
+# state: [next state for each char class]
+_TRANSITIONS = {
+    _ESCAPE: [_DONE, _DONE, _DONE, _DONE],
+    _CSI: [_CSI, _CSI_INTERMEDIATE, _DONE, _ABORT],
+    _CSI_INTERMEDIATE: [_ABORT, _CSI_INTERMEDIATE, _DONE, _ABORT],
+    _SS3: [_SS3, _ABORT, _DONE, _ABORT],
+}
+
+_INTRODUCERS = {
+    "[": _CSI,
+    "O": _SS3,
+}
+
+
+class PasteEvent(str):
+    """
+    Text pasted in bracketed paste mode, reported as a single key
+    """
+    pass
+
+
+_PASTE_TRANSLATION = {code: None for code in list(range(0x20)) + [0x7F]}
+_PASTE_TRANSLATION.update({ord("\t"): " ", ord("\n"): " ", ord("\r"): " "})
+
+_MULTILINE_PASTE_TRANSLATION = dict(_PASTE_TRANSLATION)
+_MULTILINE_PASTE_TRANSLATION.update({ord("\n"): "\n", ord("\r"): "\n"})
+
+
+def sanitize_paste(text, newlines=False):
+    """
+    Neutralises the control characters in pasted text, tabs become spaces
+    and the rest are dropped. Line breaks become spaces, or newlines when
+    newlines is set.
+    """
+    translation = _MULTILINE_PASTE_TRANSLATION if newlines else _PASTE_TRANSLATION
+    return text.replace("\r\n", "\n").translate(translation)
+
+
+def _default_sequences():
+    sequences = {}
+    for name in dir(key):
+        value = getattr(key, name)
+        if name.isupper() and isinstance(value, str) and len(value) > 1 and value.startswith(key.ESC):
+            sequences[value] = value
+    sequences.update(key.KEY_SEQUENCE_ALIASES)
+    return sequences
+
+
+def _trie_insert(trie, sequence, value):
+    node = trie
+    for ch in sequence:
+        node = node.setdefault(ch, {})
+    node[_LEAF] = value
+
+
+def _trie_copy(node):
+    return {ch: (child if ch is _LEAF else _trie_copy(child)) for ch, child in node.items()}
+
+
+_default_trie = None
+
+
+def _get_default_trie():
+    global _default_trie
+    if _default_trie is None:
+        trie = {}
+        for sequence, value in _default_sequences().items():
+            _trie_insert(trie, sequence, value)
+        _default_trie = trie
+    return _default_trie
+
+
+class KeyDecoder():
+    """
+    Stateful decoder splitting the terminal input into keys.
+
+    Escape sequences are matched against a trie of the known sequences
+    from key.py and the registered ones, and delimited by the CSI/SS3
+    grammar. A sequence is reported as the key it maps to, sequences not
+    in the trie are reported as one opaque key holding the raw sequence.
+    An escape sequence split across reads is kept pending and completed
+    by the next feed.
+    """
+
+    def __init__(self):
+        self._trie = _get_default_trie()
+        self._own_trie = False
+        self._partial = ""
+        self._paste = None
+
+    @property
+    def pending(self):
+        # A partial paste end marker waits for the rest of the paste,
+        # not for ESCAPE_TIMEOUT
+        return bool(self._partial) and self._paste is None
+
+    @property
+    def pasting(self):
+        return self._paste is not None
+
+    def reset(self):
+        self._partial = ""
+        self._paste = None
+
+    def register_sequence(self, sequence, value=None):
+        if not sequence or not sequence.startswith(key.ESC) or len(sequence) < 2:
+            raise ValueError("Key sequence should be an escape sequence: {}".format(repr(sequence)))
+        if not self._own_trie:
+            self._trie = _trie_copy(self._trie)
+            self._own_trie = True
+        _trie_insert(self._trie, sequence, value or sequence)
+
+    def flush(self):
+        """
+        Reports the pending partial sequence. Called when no more
+        input arrived within ESCAPE_TIMEOUT.
+        """
+        return self._decode("", final=True)
+
+    def feed(self, chars):
+        return self._decode(chars)
+
+    def _decode(self, chars, final=False):
+        if self._partial:
+            chars = self._partial + chars
+            self._partial = ""
+
+        sequence = []
+        esc = key.ESC
+        length = len(chars)
+        i = 0
+
+        while i < length:
+            if self._paste is not None:
+                i = self._collect_paste(chars, i, sequence, final)
+                continue
+
+            j = chars.find(esc, i)
+            if j < 0:
+                sequence.extend(chars[i:])
+                break
+            if j > i:
+                sequence.extend(chars[i:j])
+
+            end, value = self._match(chars, j, final)
+            if end is None:
+                self._partial = chars[j:]
+                break
+            if value == key.PASTE_START:
+                self._paste = []
+            else:
+                sequence.append(value)
+            i = end
+
+        if final and self._paste is not None:
+            sequence.append(PasteEvent("".join(self._paste)))
+            self._paste = None
+        return sequence
+
+    def _collect_paste(self, chars, start, sequence, final=False):
+        # Collects the pasted text up to PASTE_END. The longest end of the
+        # input that can start PASTE_END is kept pending for the next feed.
+        end = chars.find(key.PASTE_END, start)
+        if end >= 0:
+            self._paste.append(chars[start:end])
+            sequence.append(PasteEvent("".join(self._paste)))
+            self._paste = None
+            return end + len(key.PASTE_END)
+
+        length = len(chars)
+        keep = length
+        if not final:
+            for count in range(min(len(key.PASTE_END) - 1, length - start), 0, -1):
+                if key.PASTE_END.startswith(chars[length - count:]):
+                    keep = length - count
+                    break
+        self._paste.append(chars[start:keep])
+        self._partial = chars[keep:]
+        return length
+
+    def _match(self, chars, start, final):
+        # Walks the trie and the grammar together from the ESC at start.
+        # Returns the end of the key and the key, or None if more input
+        # is needed to decide.
+        node = self._trie[key.ESC]
+        match_end = match_value = None
+        if _LEAF in node:
+            match_end, match_value = start + 1, node[_LEAF]
+
+        state = _ESCAPE
+        grammar_end = None
+        length = len(chars)
+        limit = min(length, start + MAX_SEQUENCE_LENGTH)
+        i = start + 1
+
+        while i < limit:
+            ch = chars[i]
+
+            if node is not None:
+                node = node.get(ch)
+                if node is not None and _LEAF in node:
+                    match_end, match_value = i + 1, node[_LEAF]
+
+            if grammar_end is None:
+                if state == _ESCAPE and ch in _INTRODUCERS:
+                    state = _INTRODUCERS[ch]
+                else:
+                    code = ord(ch)
+                    state = _TRANSITIONS[state][_CHAR_CLASS[code] if code < 0x80 else _OTHER]
+                    if state == _DONE:
+                        grammar_end = i + 1
+                    elif state == _ABORT:
+                        grammar_end = i
+
+            i += 1
+
+            if grammar_end is not None and (node is None or len(node) == (1 if _LEAF in node else 0)):
+                break
+        else:
+            if i < length:
+                final = True
+            if not final:
+                return None, None
+
+        if grammar_end is None:
+            grammar_end = i
+        if match_end is not None and match_end >= grammar_end:
+            return match_end, match_value
+
+        return grammar_end, chars[start:grammar_end]
+
+
+def decode(chars):
+    decoder = KeyDecoder()
+    return decoder.feed(chars) + decoder.flush()
@@ -0,0 +1,701 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import os
+import re
+import mmap
+import time
+import atexit
+import asyncio
+import tempfile
+import threading
+
+
+# Records indexed from the history file at a time, when it is opened and
+# whenever the navigation reaches the oldest entry indexed
+HISTORY_INDEX_STEP = 1000
+
+# The history file is compacted, as it is opened or closed, when the
+# records older than the history size take more than the ones kept, and
+# at least this many bytes
+HISTORY_COMPACT_SIZE = 64 * 1024
+
+# Durability of the history file writes. With none the batches written
+# are left to the system to sync, with batched each batch is synced and
+# with entry each entry is written and synced before it is accepted.
+HISTORY_DURABILITY_NONE = "none"
+HISTORY_DURABILITY_BATCHED = "batched"
+HISTORY_DURABILITY_ENTRY = "entry"
+HISTORY_DURABILITY_MODES = (HISTORY_DURABILITY_NONE, HISTORY_DURABILITY_BATCHED, HISTORY_DURABILITY_ENTRY)
+
+# The history writers write the entries added within this many seconds in
+# one batch, or sooner when this many are pending
+HISTORY_FLUSH_INTERVAL = 1.0
+HISTORY_FLUSH_SIZE = 100
+
+_RECORD_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+
+
+class HistoryRing():
+    """
+    The history entries, the oldest first, kept in a ring of slots.
+
+    The slots list grows with the appends until it holds capacity
+    entries, from then on an append overwrites the oldest slot, so adding
+    and evicting an entry are O(1) and memory follows the entries held
+    rather than the capacity. Indexing maps onto the slots in O(1).
+    Resizing copies only the entries kept.
+    """
+
+    def __init__(self, capacity):
+        self._capacity = max(0, capacity)
+        self._slots = []
+        self._start = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __getitem__(self, index):
+        count = len(self._slots)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("history index out of range")
+        index += self._start
+        if index >= count:
+            index -= count
+        return self._slots[index]
+
+    def __iter__(self):
+        slots = self._slots
+        start = self._start
+        for index in range(start, len(slots)):
+            yield slots[index]
+        for index in range(start):
+            yield slots[index]
+
+    def append(self, entry):
+        """
+        Adds the entry as the latest, evicting the oldest one when full
+        """
+        if len(self._slots) < self._capacity:
+            self._slots.append(entry)
+        elif self._capacity:
+            self._slots[self._start] = entry
+            self._start += 1
+            if self._start == self._capacity:
+                self._start = 0
+
+    def clear(self):
+        self._slots = []
+        self._start = 0
+
+    def resize(self, capacity):
+        """
+        Sets the capacity, keeping the latest entries fitting in it
+        """
+        capacity = max(0, capacity)
+        count = len(self._slots)
+        keep = min(count, capacity)
+        if self._start or keep < count:
+            self._slots = [self[index] for index in range(count - keep, count)]
+            self._start = 0
+        self._capacity = capacity
+
+
+def encode_record(entry):
+    """
+    Returns the history file record of an entry, one line with the
+    backslashes and the newlines escaped
+    """
+    return (entry.replace("\\", "\\\\").replace("\n", "\\n") + "\n").encode("utf-8", errors="replace")
+
+
+def decode_record(data):
+    text = data.decode("utf-8", errors="replace")
+    if "\\" not in text:
+        return text
+    return _RECORD_ESCAPE.sub(lambda match: "\n" if match.group(1) == "n" else match.group(1), text)
+
+
+class HistoryFile():
+    """
+    History file of one record per entry, the accepted lines are appended
+    to it and it is never rewritten except for compaction.
+
+    The file is memory mapped and indexed backwards from its end, only
+    the records asked for, so opening it costs the same however long it
+    is and an entry is decoded only when it is read.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._fd = None
+        self._map = None
+        # Record starts found so far, the newest first
+        self._starts = []
+        self._scan = 0
+        self._tail = 0
+        self._size = 0
+        self._base_size = 0
+        self._partial = False
+        self._open()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def indexed(self):
+        """
+        Count of the records indexed, from the newest one back
+        """
+        return len(self._starts)
+
+    @property
+    def exhausted(self):
+        return not self._scan
+
+    def _map_file(self):
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            size = os.fstat(fd).st_size
+            mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ) if size else None
+        except (OSError, ValueError):
+            os.close(fd)
+            raise
+        return fd, mapped, size
+
+    def _open(self):
+        self._fd, self._map, size = self._map_file()
+        self._size = self._base_size = size
+        # A record cut short by a crash is left out, and closed by the next
+        # append
+        self._tail = self._scan = self._map.rfind(b"\n") + 1 if size else 0
+        self._partial = self._tail != size
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def index(self, count=None):
+        """
+        Indexes up to count more records, all the rest when count is None.
+        Returns the count indexed.
+        """
+        mapped = self._map
+        starts = self._starts
+        pos = self._scan
+        indexed = len(starts)
+        while pos and (count is None or len(starts) - indexed < count):
+            pos = mapped.rfind(b"\n", 0, pos - 1) + 1
+            starts.append(pos)
+        self._scan = pos
+        return len(starts) - indexed
+
+    def entry(self, index):
+        """
+        Returns the entry of an indexed record, counted back from the
+        newest one
+        """
+        end = self._starts[index - 1] if index else self._tail
+        return decode_record(self._map[self._starts[index]:end - 1])
+
+    def append(self, entries):
+        """
+        Appends the records of the entries with one write
+        """
+        data = b"".join(encode_record(entry) for entry in entries)
+        if not data:
+            return
+        if self._partial:
+            data = b"\n" + data
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        self._partial = False
+        self._size += len(data)
+
+    def sync(self):
+        os.fsync(self._fd)
+
+    def compaction_due(self, capacity):
+        """
+        Tells if the records older than the latest capacity ones take more
+        space than those, judged by the records indexed and by the growth
+        of the file since it was opened or compacted
+        """
+        if self._size < HISTORY_COMPACT_SIZE:
+            return False
+        if capacity and len(self._starts) >= capacity:
+            cut = self._starts[capacity - 1]
+            if cut > self._size - cut:
+                return True
+        return self._size > 2 * self._base_size
+
+    def compact(self, capacity, lock):
+        """
+        Rewrites the file with only the latest capacity records, through a
+        new file replacing it. The records are copied from a map of their
+        own, the lock the readers take is held only to swap in the new map
+        and index.
+        """
+        fd = os.open(self._path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            mapped = mmap.mmap(fd, size, access=mmap.ACCESS_READ) if size else None
+        finally:
+            os.close(fd)
+
+        cut = 0
+        if mapped is not None:
+            try:
+                end = mapped.rfind(b"\n") + 1
+                pos = end
+                for _ in range(capacity):
+                    if not pos:
+                        break
+                    pos = mapped.rfind(b"\n", 0, pos - 1) + 1
+                cut = pos if capacity else end
+                if cut:
+                    directory = os.path.dirname(os.path.abspath(self._path))
+                    temp_fd, temp_path = tempfile.mkstemp(prefix=".history-", dir=directory)
+                    try:
+                        with os.fdopen(temp_fd, "wb") as temp_file:
+                            temp_file.write(mapped[cut:])
+                            temp_file.flush()
+                            os.fsync(temp_file.fileno())
+                        os.replace(temp_path, self._path)
+                    except BaseException:
+                        try:
+                            os.unlink(temp_path)
+                        except OSError:
+                            pass
+                        raise
+            finally:
+                mapped.close()
+
+        fd, mapped, size = self._map_file()
+        with lock:
+            old_fd, old_map = self._fd, self._map
+            self._fd, self._map = fd, mapped
+            self._size = self._base_size = size
+            self._partial = bool(size) and mapped[size - 1:] != b"\n"
+            self._starts = [start - cut for start in self._starts if start >= cut]
+            self._scan = max(self._scan, cut) - cut
+            self._tail = max(self._tail - cut, 0)
+        if old_map is not None:
+            old_map.close()
+        os.close(old_fd)
+
+
+class History():
+    """
+    The history of a readline, the entries of the history file followed by
+    the ones added in the session, up to capacity entries.
+
+    The session entries are kept in a HistoryRing. The file entries are
+    indexed a step at a time when they are reached, with load_older,
+    which puts them before the entries loaded so far and so shifts the
+    indices by the count loaded.
+
+    The entries added are written to the file by the history writer when
+    one is set, otherwise at once. As the writer works from its own
+    thread, the file is read under a lock and written under another one,
+    so reading the history does not wait on a sync or a compaction. The
+    file is compacted only when it is opened or closed, never under a
+    navigation.
+    """
+
+    def __init__(self, capacity):
+        self._capacity = max(0, capacity)
+        self._ring = HistoryRing(self._capacity)
+        self._file = None
+        self._writer = None
+        # Count of the latest entries added with no file open
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def file(self):
+        return self._file
+
+    def _loaded(self):
+        if self._file is None:
+            return 0
+        return max(0, min(self._file.indexed, self._capacity - len(self._ring)))
+
+    @property
+    def writer(self):
+        return self._writer
+
+    def __len__(self):
+        with self._lock:
+            return self._loaded() + len(self._ring)
+
+    def __getitem__(self, index):
+        with self._lock:
+            loaded = self._loaded()
+            count = loaded + len(self._ring)
+            if index < 0:
+                index += count
+            if not 0 <= index < count:
+                raise IndexError("history index out of range")
+            if index < loaded:
+                return self._file.entry(loaded - 1 - index)
+            return self._ring[index - loaded]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, entry):
+        with self._lock:
+            self._ring.append(entry)
+            if self._file is None or not self._capacity:
+                self._unsaved = min(self._unsaved + 1, len(self._ring))
+                return
+        if self._writer is not None:
+            self._writer.add(entry)
+        else:
+            self.write([entry])
+
+    def write(self, entries, sync=False):
+        """
+        Appends the entries to the history file, syncing it with sync
+        """
+        with self._io_lock:
+            history_file = self._file
+            if history_file is None:
+                return
+            history_file.append(entries)
+            if sync:
+                history_file.sync()
+
+    def _compact(self):
+        # Compaction drops the records older than the capacity, which can
+        # take loaded entries along when another session appended to the
+        # file and shift the indices the navigation holds. It is done only
+        # when the file is opened or closed.
+        history_file = self._file
+        if history_file is None or not history_file.compaction_due(self._capacity):
+            return
+        try:
+            history_file.compact(self._capacity, self._lock)
+        except OSError:
+            # The file is left as it is
+            pass
+
+    def flush(self):
+        """
+        Writes the entries pending in the history writer
+        """
+        if self._writer is not None:
+            self._writer.flush()
+
+    def set_writer(self, writer):
+        """
+        Sets the history writer writing the entries added to the file,
+        None to write them at once. The writer replaced is closed.
+        """
+        if self._writer is not None and self._writer is not writer:
+            self._writer.close()
+        self._writer = writer
+
+    def load_older(self, count=HISTORY_INDEX_STEP):
+        """
+        Loads up to count entries older than the ones loaded, all of them
+        fitting in the capacity when count is None. Returns the count
+        loaded, by which the indices of the loaded entries shift.
+        """
+        with self._lock:
+            if self._file is None:
+                return 0
+            loaded = self._loaded()
+            room = self._capacity - len(self._ring) - self._file.indexed
+            if room > 0:
+                self._file.index(room if count is None else min(count, room))
+            return self._loaded() - loaded
+
+    def resize(self, capacity):
+        capacity = max(0, capacity)
+        grown = capacity > self._capacity
+        with self._lock:
+            self._capacity = capacity
+            self._ring.resize(capacity)
+            self._unsaved = min(self._unsaved, len(self._ring))
+        if grown and self._file is not None:
+            # The entries evicted from the ring are in the file, it is
+            # indexed again to load them
+            self.open(self._file.path)
+
+    def clear(self):
+        with self._lock:
+            self._ring.clear()
+            self._unsaved = 0
+
+    def open(self, path):
+        """
+        Loads the history from the file at path, indexing its latest
+        records, and appends the entries added to it from then on. The
+        entries added with no file open come after the file's and are
+        written to it.
+        """
+        self.close()
+        history_file = HistoryFile(path)
+        with self._io_lock, self._lock:
+            # The entries written to a file are read from it, the ones added
+            # with no file open are kept
+            count = len(self._ring)
+            entries = [self._ring[index] for index in range(count - self._unsaved, count)]
+            self._ring.clear()
+            for entry in entries:
+                self._ring.append(entry)
+            self._unsaved = 0
+            self._file = history_file
+            history_file.index(min(self._capacity, HISTORY_INDEX_STEP))
+        if entries:
+            self.write(entries)
+        with self._io_lock:
+            self._compact()
+
+    def close(self):
+        """
+        Stops using the history file, after writing the entries pending
+        and compacting the file when it is due
+        """
+        self.flush()
+        with self._io_lock:
+            self._compact()
+            with self._lock:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+
+
+class HistoryWriter():
+    """
+    Writes the entries added to a History to its file from a thread, so
+    the input doesn't wait on the disk.
+
+    The entries are written in batches, once the flush interval passes
+    from the first one pending or as soon as size entries are pending,
+    and the ones left are written at exit. A crash loses at most the
+    entries of one interval, and with the none durability the writes not
+    yet synced by the system. With the entry durability each entry is
+    written and synced in the calling thread before add returns.
+    """
+
+    def __init__(self, history, durability=HISTORY_DURABILITY_BATCHED,
+                 interval=HISTORY_FLUSH_INTERVAL, size=HISTORY_FLUSH_SIZE):
+        if durability not in HISTORY_DURABILITY_MODES:
+            raise ValueError("Unknown history durability: {}".format(durability))
+        self._history = history
+        self._durability = durability
+        self._interval = max(0, interval)
+        self._size = max(1, size)
+        self._pending = []
+        self._deadline = 0
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._error = None
+
+    @property
+    def durability(self):
+        return self._durability
+
+    @property
+    def error(self):
+        """
+        The last error writing the history file, None if none
+        """
+        return self._error
+
+    def add(self, entry):
+        if self._durability == HISTORY_DURABILITY_ENTRY:
+            # The entry is on the disk before the line is returned
+            with self._cond:
+                self._pending.append(entry)
+            self._flush_safely()
+            return
+        with self._cond:
+            self._pending.append(entry)
+            if len(self._pending) == 1:
+                self._deadline = time.monotonic() + self._interval
+            self._start()
+            if len(self._pending) == 1 or self._due():
+                self._wake()
+
+    def flush(self):
+        """
+        Writes the entries pending now, in the calling thread
+        """
+        with self._write_lock:
+            with self._cond:
+                entries = self._pending
+                self._pending = []
+            if not entries:
+                return
+            if self._durability == HISTORY_DURABILITY_ENTRY:
+                for entry in entries:
+                    self._history.write([entry], sync=True)
+            else:
+                self._history.write(entries, sync=self._durability == HISTORY_DURABILITY_BATCHED)
+
+    def close(self):
+        """
+        Stops the writer, writing the entries pending
+        """
+        with self._cond:
+            thread = self._thread
+            self._thread = None
+            self._running = False
+            self._cond.notify()
+        if thread is not None:
+            atexit.unregister(self.close)
+            thread.join()
+        self.flush()
+
+    def _due(self):
+        return bool(self._pending) and (len(self._pending) >= self._size or time.monotonic() >= self._deadline)
+
+    def _wait_time(self):
+        if not self._pending:
+            return None
+        return max(0, self._deadline - time.monotonic())
+
+    def _flush_safely(self):
+        try:
+            self.flush()
+        except (OSError, ValueError) as e:
+            self._error = e
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="nessaid-readline-history", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _wake(self):
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._due():
+                    self._cond.wait(self._wait_time())
+                if not self._running:
+                    return
+            self._flush_safely()
+
+
+class AsyncHistoryWriter(HistoryWriter):
+    """
+    HistoryWriter running as a task on the event loop of an
+    NessaidAsyncReadline, the batches are written in the executor so the
+    loop doesn't wait on the disk either
+    """
+
+    def __init__(self, history, loop, executor=None, durability=HISTORY_DURABILITY_BATCHED,
+                 interval=HISTORY_FLUSH_INTERVAL, size=HISTORY_FLUSH_SIZE):
+        HistoryWriter.__init__(self, history, durability=durability, interval=interval, size=size)
+        self._loop = loop
+        self._executor = executor
+        self._task = None
+        self._wakeup = None
+
+    def close(self):
+        """
+        Stops the writer. On the loop the entries pending are written in
+        the executor, aclose waits for them, elsewhere they are written at
+        once.
+        """
+        self._stop()
+        if self._on_loop():
+            try:
+                self._loop.run_in_executor(self._executor, self._flush_safely)
+                return
+            except RuntimeError:
+                # The executor is shut down
+                pass
+        self.flush()
+
+    async def aclose(self):
+        """
+        Stops the writer, writing the entries pending in the executor
+        """
+        self._stop()
+        await self._loop.run_in_executor(self._executor, self._flush_safely)
+
+    def _stop(self):
+        task = self._task
+        self._task = None
+        if task is not None:
+            atexit.unregister(self.flush)
+            if not task.done():
+                task.cancel()
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _start(self):
+        if self._task is not None:
+            return
+        self._task = self._loop.create_task(self._run())
+        atexit.register(self.flush)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        # The event is made here, on the loop it is waited on
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                with self._cond:
+                    due = self._due()
+                    wait_time = self._wait_time()
+                if due:
+                    await self._loop.run_in_executor(self._executor, self._flush_safely)
+                    continue
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait_time)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # The loop is shutting down or the writer is closed, the entries
+            # pending are written without holding the loop where it can be
+            try:
+                await self._loop.run_in_executor(self._executor, self._flush_safely)
+            except RuntimeError:
+                self._flush_safely()
+            raise
+        finally:
+            self._wakeup = None
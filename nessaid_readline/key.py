@@ -25,6 +25,46 @@ DOWN = "\x1b\x5b\x42"
 LEFT = "\x1b\x5b\x44"
 RIGHT = "\x1b\x5b\x43"
 
+# modified cursors, xterm style CSI 1;<modifier> sequences
+SHIFT_UP = "\x1b[1;2A"
+SHIFT_DOWN = "\x1b[1;2B"
+SHIFT_RIGHT = "\x1b[1;2C"
+SHIFT_LEFT = "\x1b[1;2D"
+SHIFT_HOME = "\x1b[1;2H"
+SHIFT_END = "\x1b[1;2F"
+SHIFT_TAB = "\x1b[Z"
+ALT_UP = "\x1b[1;3A"
+ALT_DOWN = "\x1b[1;3B"
+ALT_RIGHT = "\x1b[1;3C"
+ALT_LEFT = "\x1b[1;3D"
+ALT_HOME = "\x1b[1;3H"
+ALT_END = "\x1b[1;3F"
+CTRL_UP = "\x1b[1;5A"
+CTRL_DOWN = "\x1b[1;5B"
+CTRL_RIGHT = "\x1b[1;5C"
+CTRL_LEFT = "\x1b[1;5D"
+CTRL_HOME = "\x1b[1;5H"
+CTRL_END = "\x1b[1;5F"
+CTRL_DELETE = "\x1b[3;5~"
+
+# function keys
+F1 = "\x1bOP"
+F2 = "\x1bOQ"
+F3 = "\x1bOR"
+F4 = "\x1bOS"
+F5 = "\x1b[15~"
+F6 = "\x1b[17~"
+F7 = "\x1b[18~"
+F8 = "\x1b[19~"
+F9 = "\x1b[20~"
+F10 = "\x1b[21~"
+F11 = "\x1b[23~"
+F12 = "\x1b[24~"
+
+# bracketed paste markers
+PASTE_START = "\x1b[200~"
+PASTE_END = "\x1b[201~"
+
 # CTRL
 CTRL_A = '\x01'
 CTRL_B = '\x02'
@@ -52,6 +92,7 @@ CTRL_W = '\x17'
 CTRL_X = '\x18'
 CTRL_Y = '\x19'
 CTRL_Z = '\x1a'
+CTRL_UNDERSCORE = '\x1f'
 
 # ALT
 ALT_A = "\x1b" + 'a'
@@ -80,6 +121,7 @@ ALT_W = "\x1b" + 'w'
 ALT_X = "\x1b" + 'x'
 ALT_Y = "\x1b" + 'y'
 ALT_Z = "\x1b" + 'z'
+ALT_BACKSPACE = "\x1b" + BACKSPACE
 
 # CTRL + ALT
 CTRL_ALT_A = "\x1b" + CTRL_A
@@ -112,6 +154,37 @@ CTRL_ALT_Z = "\x1b" + CTRL_Z
 CTRL_ALT_DELETE = "\x1b\x5b\x33\x5e"
 
 
+# Alternate sequences sent by terminals for the same key,
+# the decoder reports them as the key in the value
+KEY_SEQUENCE_ALIASES = {
+    "\x1bOA": UP,
+    "\x1bOB": DOWN,
+    "\x1bOC": RIGHT,
+    "\x1bOD": LEFT,
+    "\x1bOH": HOME,
+    "\x1bOF": END,
+    "\x1b[1~": HOME,
+    "\x1b[7~": HOME,
+    "\x1b[4~": END,
+    "\x1b[8~": END,
+    "\x1b[11~": F1,
+    "\x1b[12~": F2,
+    "\x1b[13~": F3,
+    "\x1b[14~": F4,
+    "\x1b[[A": F1,
+    "\x1b[[B": F2,
+    "\x1b[[C": F3,
+    "\x1b[[D": F4,
+    "\x1b[[E": F5,
+    "\x1b[1;5P": F1,
+    "\x1bO5P": F1,
+    "\x1b\x1b[A": ALT_UP,
+    "\x1b\x1b[B": ALT_DOWN,
+    "\x1b\x1b[C": ALT_RIGHT,
+    "\x1b\x1b[D": ALT_LEFT,
+}
+
+
 KEY_NAME_MAP = {
     "cr": CR,
     "lf": LF,
@@ -127,6 +200,38 @@ KEY_NAME_MAP = {
     "right": RIGHT,
     "up": UP,
     "down": DOWN,
+    "shift-up": SHIFT_UP,
+    "shift-down": SHIFT_DOWN,
+    "shift-left": SHIFT_LEFT,
+    "shift-right": SHIFT_RIGHT,
+    "shift-home": SHIFT_HOME,
+    "shift-end": SHIFT_END,
+    "shift-tab": SHIFT_TAB,
+    "alt-up": ALT_UP,
+    "alt-down": ALT_DOWN,
+    "alt-left": ALT_LEFT,
+    "alt-right": ALT_RIGHT,
+    "alt-home": ALT_HOME,
+    "alt-end": ALT_END,
+    "ctrl-up": CTRL_UP,
+    "ctrl-down": CTRL_DOWN,
+    "ctrl-left": CTRL_LEFT,
+    "ctrl-right": CTRL_RIGHT,
+    "ctrl-home": CTRL_HOME,
+    "ctrl-end": CTRL_END,
+    "ctrl-delete": CTRL_DELETE,
+    "f1": F1,
+    "f2": F2,
+    "f3": F3,
+    "f4": F4,
+    "f5": F5,
+    "f6": F6,
+    "f7": F7,
+    "f8": F8,
+    "f9": F9,
+    "f10": F10,
+    "f11": F11,
+    "f12": F12,
     "esc": ESC,
     "escape": ESC,
     "ctrl-a": CTRL_A,
@@ -151,6 +256,7 @@ KEY_NAME_MAP = {
     "ctrl-x": CTRL_X,
     "ctrl-y": CTRL_Y,
     "ctrl-z": CTRL_Z,
+    "ctrl-_": CTRL_UNDERSCORE,
     "alt-a": ALT_A,
     "alt-b": ALT_B,
     "alt-c": ALT_C,
@@ -177,6 +283,7 @@ KEY_NAME_MAP = {
     "alt-x": ALT_X,
     "alt-y": ALT_Y,
     "alt-z": ALT_Z,
+    "alt-backspace": ALT_BACKSPACE,
     "ctrl-alt-a": CTRL_ALT_A,
     "ctrl-alt-b": CTRL_ALT_B,
     "ctrl-alt-c": CTRL_ALT_C,
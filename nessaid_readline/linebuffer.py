@@ -0,0 +1,498 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import re
+import bisect
+import collections
+
+from nessaid_readline.charwidth import char_width
+
+
+# Size the undo records of a line are kept within, counted in characters
+# of the recorded text plus RECORD_SIZE for each record
+UNDO_LIMIT = 64 * 1024
+RECORD_SIZE = 16
+
+# Killed texts kept for yanking
+KILL_RING_SIZE = 16
+
+# Words for the word motions, and the whitespace delimited words of
+# unix-word-rubout
+WORD_PATTERN = re.compile(r"\w+")
+BLANK_WORD_PATTERN = re.compile(r"\S+")
+
+
+class UndoLog():
+    """
+    Undo and redo records of the edits made to a LineBuffer.
+
+    An edit is recorded as (pos, deleted, inserted), the text removed and
+    the text put in its place at pos. The edits of one undo step are kept
+    together in an entry, made by a group or by a run of typed characters
+    coalesced into one insert. Outside a group the run is broken where a
+    whitespace character is typed after a non-space one, so a word and
+    the spaces before it are undone together. The oldest entries are
+    dropped when the records outgrow the limit.
+    """
+
+    def __init__(self, limit=UNDO_LIMIT):
+        self._undo = collections.deque()
+        self._redo = []
+        self._size = 0
+        self._limit = limit
+        self._depth = 0
+        self._group_start = 0
+        self._typing = False
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def set_limit(self, limit):
+        self._limit = max(0, limit)
+        self._trim()
+
+    def clear(self):
+        self._undo.clear()
+        self._redo = []
+        self._size = 0
+        self._typing = False
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def record(self, pos, deleted, inserted):
+        if self._redo:
+            for entry in self._redo:
+                self._size -= _entry_size(entry)
+            self._redo = []
+
+        if self._typing and not deleted and len(inserted) == 1:
+            entry = self._undo[-1]
+            last_pos, last_deleted, last_inserted = entry[-1]
+            if (
+                not last_deleted and pos == last_pos + len(last_inserted) and
+                (self._depth or not inserted.isspace() or last_inserted[-1].isspace())
+            ):
+                entry[-1] = (last_pos, last_deleted, last_inserted + inserted)
+                self._size += 1
+                return
+
+        self._undo.append([(pos, deleted, inserted)])
+        self._size += len(deleted) + len(inserted) + RECORD_SIZE
+        self._typing = not deleted and len(inserted) == 1
+        if not self._depth:
+            self._trim()
+
+    def begin_group(self):
+        """
+        Starts a group of edits undone together, groups can be nested
+        """
+        if not self._depth:
+            self._group_start = len(self._undo)
+            self._typing = False
+        self._depth += 1
+
+    def end_group(self):
+        if not self._depth:
+            return
+        self._depth -= 1
+        if self._depth:
+            return
+        if len(self._undo) - self._group_start > 1:
+            merged = []
+            while len(self._undo) > self._group_start:
+                merged[:0] = self._undo.pop()
+            self._undo.append(merged)
+        self._typing = False
+        self._trim()
+
+    def pop_undo(self):
+        """
+        Returns the edits of the last step for undoing, None if none left
+        """
+        self._typing = False
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._redo.append(entry)
+        if self._depth:
+            self._group_start = min(self._group_start, len(self._undo))
+        return entry
+
+    def pop_redo(self):
+        self._typing = False
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        return entry
+
+    def _trim(self):
+        while self._size > self._limit and (self._undo or self._redo):
+            entry = self._undo.popleft() if self._undo else self._redo.pop(0)
+            self._size -= _entry_size(entry)
+        if not self._undo:
+            self._typing = False
+
+
+def _entry_size(entry):
+    return sum(len(deleted) + len(inserted) + RECORD_SIZE for pos, deleted, inserted in entry)
+
+
+class KillRing():
+    """
+    The texts killed from the line, the latest on top. Kills made one after
+    another are joined into one text, yank-pop rotates through the older
+    ones.
+    """
+
+    def __init__(self, size=KILL_RING_SIZE):
+        self._ring = collections.deque(maxlen=size)
+        self._index = 0
+
+    def __len__(self):
+        return len(self._ring)
+
+    def add(self, text, append=False, before=False):
+        """
+        Puts the text on top, with append it is joined to the top text,
+        before it when before is set
+        """
+        if append and self._ring:
+            top = self._ring[-1]
+            self._ring[-1] = text + top if before else top + text
+        else:
+            self._ring.append(text)
+        self._index = 0
+
+    def yank(self):
+        """
+        Returns the top text, None when the ring is empty
+        """
+        self._index = 0
+        return self._ring[-1] if self._ring else None
+
+    def rotate(self):
+        """
+        Returns the text below the one yanked last, wrapping to the top
+        """
+        if not self._ring:
+            return None
+        self._index = (self._index + 1) % len(self._ring)
+        return self._ring[-1 - self._index]
+
+
+class LineBuffer():
+    """
+    Gap buffer holding the line being edited.
+
+    The characters before the gap are kept in one list and the ones after
+    it in another, in reverse order, so inserting and deleting at the gap
+    are list appends and pops. The gap follows the edits, moving it costs
+    the distance moved, so editing at the caret is amortized O(1) however
+    long the line is. The line is joined into a string only when asked
+    for, and the string is kept until the next edit.
+
+    With an UndoLog, the edits are recorded for undo and redo.
+    """
+
+    def __init__(self, text="", undo_log=None):
+        self._before = list(text)
+        self._after = []
+        self._text = text
+        self._revision = 0
+        self._log = undo_log
+        self._words = {}
+        self._words_revision = -1
+        self._newlines = text.count("\n")
+        self._row_starts = [0]
+        self._rows_revision = -1
+
+    @property
+    def undo_log(self):
+        return self._log
+
+    @property
+    def revision(self):
+        """
+        Count of the edits made, it changes whenever the text changes
+        """
+        return self._revision
+
+    def __len__(self):
+        return len(self._before) + len(self._after)
+
+    def __str__(self):
+        if self._text is None:
+            self._text = "".join(self._before) + "".join(reversed(self._after))
+        return self._text
+
+    def __repr__(self):
+        return "LineBuffer({!r})".format(str(self))
+
+    def __getitem__(self, index):
+        if self._text is not None:
+            return self._text[index]
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return str(self)[index]
+            gap = len(self._before)
+            after = len(self._after)
+            parts = []
+            if start < gap:
+                parts.append("".join(self._before[start:min(stop, gap)]))
+            if stop > gap:
+                first = max(start, gap) - gap
+                parts.append("".join(reversed(self._after[after - (stop - gap):after - first])))
+            return "".join(parts)
+
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("LineBuffer index out of range")
+        gap = len(self._before)
+        if index < gap:
+            return self._before[index]
+        return self._after[len(self._after) - 1 - (index - gap)]
+
+    def word_bounds(self, pattern=WORD_PATTERN):
+        """
+        Returns the start and the end positions of the words matched by the
+        pattern, each taking in the zero width characters that follow it.
+        They are found once for each revision of the text, so repeated word
+        motions don't scan the line again.
+        """
+        if self._words_revision != self._revision:
+            self._words = {}
+            self._words_revision = self._revision
+        bounds = self._words.get(pattern)
+        if bounds is None:
+            starts, ends = [], []
+            text = str(self)
+            length = len(text)
+            for match in pattern.finditer(text):
+                start, end = match.span()
+                while end < length and not char_width(text[end]):
+                    end += 1
+                if ends and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            bounds = self._words[pattern] = (starts, ends)
+        return bounds
+
+    def word_start(self, pos, pattern=WORD_PATTERN):
+        """
+        Returns the start of the word before pos, 0 when there is none
+        """
+        starts = self.word_bounds(pattern)[0]
+        index = bisect.bisect_left(starts, pos) - 1
+        return starts[index] if index >= 0 else 0
+
+    def word_end(self, pos, pattern=WORD_PATTERN):
+        """
+        Returns the end of the word after pos, the line end when there is
+        none
+        """
+        ends = self.word_bounds(pattern)[1]
+        index = bisect.bisect_right(ends, pos)
+        return ends[index] if index < len(ends) else len(self)
+
+    def cluster_start(self, pos):
+        """
+        Returns the start of the character before pos along with the zero
+        width characters on it
+        """
+        if pos > 0:
+            pos -= 1
+            while pos and not char_width(self[pos]):
+                pos -= 1
+        return pos
+
+    def cluster_end(self, pos):
+        """
+        Returns the end of the character at pos along with the zero width
+        characters on it
+        """
+        length = len(self)
+        if pos < length:
+            pos += 1
+            while pos < length and not char_width(self[pos]):
+                pos += 1
+        return pos
+
+    def row_starts(self):
+        """
+        Returns the offsets the rows of a multi-line text start at. The
+        index is built once for each revision of the text, and not at all
+        while the text has no newlines.
+        """
+        if not self._newlines:
+            return [0]
+        if self._rows_revision != self._revision:
+            text = str(self)
+            starts = [0]
+            pos = text.find("\n")
+            while pos >= 0:
+                starts.append(pos + 1)
+                pos = text.find("\n", pos + 1)
+            self._row_starts = starts
+            self._rows_revision = self._revision
+        return self._row_starts
+
+    def row_of(self, pos):
+        """
+        Returns the row holding pos and the column of pos in it
+        """
+        starts = self.row_starts()
+        row = bisect.bisect_right(starts, pos) - 1
+        return row, pos - starts[row]
+
+    def row_span(self, row):
+        """
+        Returns the start and the end offsets of the row, the end is at its
+        newline or at the end of the text
+        """
+        starts = self.row_starts()
+        end = starts[row + 1] - 1 if row + 1 < len(starts) else len(self)
+        return starts[row], end
+
+    def _changed(self):
+        self._text = None
+        self._revision += 1
+
+    def _move_gap(self, pos):
+        gap = len(self._before)
+        if pos < gap:
+            moved = self._before[pos:]
+            del self._before[pos:]
+            moved.reverse()
+            self._after.extend(moved)
+        elif pos > gap:
+            count = pos - gap
+            moved = self._after[-count:]
+            del self._after[-count:]
+            moved.reverse()
+            self._before.extend(moved)
+
+    def reset(self, text=""):
+        """
+        Sets the text without recording it, starting a new line for undo
+        """
+        self._before = list(text)
+        self._after = []
+        self._newlines = text.count("\n")
+        self._changed()
+        self._text = text
+        if self._log is not None:
+            self._log.clear()
+
+    def set(self, text):
+        old = str(self)
+        self._before = list(text)
+        self._after = []
+        self._newlines = text.count("\n")
+        self._changed()
+        self._text = text
+        if self._log is not None and (old or text):
+            self._log.record(0, old, text)
+
+    def clear(self):
+        self.set("")
+
+    def insert(self, pos, text):
+        """
+        Inserts text at pos, 0 <= pos <= len(self)
+        """
+        if text:
+            self._insert(pos, text)
+            if self._log is not None:
+                self._log.record(pos, "", text)
+
+    def delete(self, pos, count=1):
+        """
+        Deletes up to count characters from pos and returns them
+        """
+        deleted = self._delete(pos, count)
+        if deleted and self._log is not None:
+            self._log.record(pos, deleted, "")
+        return deleted
+
+    def replace(self, pos, text):
+        """
+        Overwrites the characters from pos with text, extending the line
+        when it runs past the end. Returns the overwritten characters.
+        """
+        replaced = self._delete(pos, len(text))
+        self._insert(pos, text)
+        if self._log is not None and (replaced or text):
+            self._log.record(pos, replaced, text)
+        return replaced
+
+    def undo(self):
+        """
+        Reverts the last undo step, returns the caret position after it
+        or None when there is nothing to undo
+        """
+        entry = self._log.pop_undo() if self._log is not None else None
+        if entry is None:
+            return None
+        for pos, deleted, inserted in reversed(entry):
+            self._delete(pos, len(inserted))
+            self._insert(pos, deleted)
+        pos, deleted, inserted = entry[0]
+        return pos + len(deleted)
+
+    def redo(self):
+        """
+        Makes the last undone step again, returns the caret position after
+        it or None when there is nothing to redo
+        """
+        entry = self._log.pop_redo() if self._log is not None else None
+        if entry is None:
+            return None
+        for pos, deleted, inserted in entry:
+            self._delete(pos, len(deleted))
+            self._insert(pos, inserted)
+        pos, deleted, inserted = entry[-1]
+        return pos + len(inserted)
+
+    def _insert(self, pos, text):
+        if text:
+            self._move_gap(pos)
+            if len(text) == 1:
+                self._before.append(text)
+            else:
+                self._before.extend(text)
+            if "\n" in text:
+                self._newlines += text.count("\n")
+            self._changed()
+
+    def _delete(self, pos, count):
+        count = min(count, len(self) - pos)
+        if count <= 0:
+            return ""
+        self._move_gap(pos)
+        if count == 1:
+            deleted = self._after.pop()
+        else:
+            removed = self._after[-count:]
+            del self._after[-count:]
+            removed.reverse()
+            deleted = "".join(removed)
+        if "\n" in deleted:
+            self._newlines -= deleted.count("\n")
+        self._changed()
+        return deleted
@@ -7,9 +7,16 @@
 
 import sys
 import time
+import atexit
+import codecs
+import threading
+import collections
 
 import nessaid_readline.key as key
 
+from nessaid_readline.decoder import KeyDecoder, ESCAPE_TIMEOUT, decode
+from nessaid_readline.capabilities import detect_capabilities
+
 
 class PlatformNotSupported(Exception):
     pass
@@ -19,10 +26,23 @@ class ReadKeyError(Exception):
     pass
 
 
+# Maximum number of keys held for the next input call
+TYPEAHEAD_SIZE = 65536
+
+# Typeahead flush policies
+# flush: typeahead is discarded by flush()
+# error: typeahead is discarded by flush() and when an input call fails
+# never: typeahead is never discarded
+TYPEAHEAD_FLUSH = "flush"
+TYPEAHEAD_FLUSH_ON_ERROR = "error"
+TYPEAHEAD_FLUSH_NEVER = "never"
+
+
 if sys.platform.startswith("linux") or sys.platform == "darwin":
 
     import os
     import tty # noqa
+    import signal
     import select # noqa
     import termios # pylint: disable=import-error
     import fcntl # pylint: disable=import-error
@@ -44,117 +64,341 @@ if sys.platform.startswith("linux") or sys.platform == "darwin":
         except Exception:
             pass
 
-    def _sequence_from_input_data(chars, single_char=False):
-        sequence = []
-        while chars:
-            if single_char is True and sequence:
-                return sequence
-
-            c1 = chars[0]
-            chars = chars[1:]
-            if ord(c1) != 0x1B:
-                sequence.append(c1)
-                continue
-
-            if not chars:
-                sequence.append(c1)
-                break
-
-            c2 = chars[0]
-            chars = chars[1:]
-            if c2:
-                if ord(c2) not in [0x5B, 0x4f]:
-                    sequence.append(c1 + c2)
-                    continue
-            else:
-                sequence.append(c1)
-                break
-
-            if not chars:
-                break
-
-            c3 = chars[0]
-            chars = chars[1:]
-            if c3:
-                if ord(c3) not in [0x31, 0x32, 0x33, 0x34, 0x35, 0x36]:
-                    sequence.append(c1 + c2 + c3)
-                    continue
-            else:
-                sequence.append(c1 + c2)
-                break
+    # Size of the reusable input buffer of a terminal session
+    READ_SIZE = 16384
 
-            if not chars:
-                break
+    if hasattr(os, "readv"):
 
-            c4 = chars[0]
-            chars = chars[1:]
-            if c4:
-                sequence.append(c1 + c2 + c3 + c4)
-                continue
-            else:
-                sequence.append(c1 + c2 + c3)
-                break
-        return sequence
+        def _readinto(fd, buffer):
+            return os.readv(fd, [buffer])
+
+    else:
+
+        def _readinto(fd, buffer):
+            data = os.read(fd, len(buffer))
+            buffer[:len(data)] = data
+            return len(data)
+
+    def _sequence_from_input_data(chars, single_char=False):
+        sequence = decode(chars)
+        return sequence[:1] if single_char else sequence
 
 
     try:
         select.epoll # noqa
     except AttributeError:
 
-        def _read_sequence(stdin, single_char=False):
+        def _create_poller(fds):
+            return list(fds)
 
-            try:
-                old_settings = _setup_tty(stdin)
-                fd = stdin.fileno()
-                fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-                fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK) # pylint: disable=maybe-no-member
+        def _poll(poller, timeout=None):
+            inputready, _, exceptready = select.select(poller, [], poller, timeout)
+            if exceptready:
+                raise ReadKeyError("Exception in stdin FD")
+            return inputready
+
+        def _close_poller(poller):
+            pass
 
-                inputready, _, exceptready = select.select([fd], [], [])
+    else:
 
-                if fd in exceptready:
-                    raise ReadKeyError("Exception in stdin FD")
+        def _create_poller(fds):
+            epoll = select.epoll() # pylint: disable=maybe-no-member
+            for fd in fds:
+                epoll.register(fd, select.EPOLLIN) # pylint: disable=maybe-no-member
+            return epoll
 
-                if fd in inputready:
-                    chars = stdin.read()
-                    if chars:
-                        return _sequence_from_input_data(chars, single_char=single_char)
+        def _poll(poller, timeout=None):
+            events = poller.poll(-1 if timeout is None else timeout)
+            return [fd for fd, _ in events]
 
-                raise ReadKeyError("Select call returned without data")
+        def _close_poller(poller):
+            poller.close()
 
-            except Exception as e:
-                raise e
-            finally:
-                fcntl.fcntl(fd, fcntl.F_SETFL, fl)
-                _restore_tty(stdin, old_settings)
 
-    else:
+    # Counts the SIGWINCH signals, the sessions query the terminal size
+    # again only after it changed
+    _resize_count = 0
+    _resize_handler_installed = False
+    _previous_resize_handler = None
+    # Sessions using the SIGWINCH handler, the handler it replaced is put
+    # back when the last one exits
+    _resize_users = 0
+
 
-        def _read_sequence(stdin, single_char=False):
+    def _on_resize(signum, frame):
+        global _resize_count
+        _resize_count += 1
+        if callable(_previous_resize_handler):
+            _previous_resize_handler(signum, frame)
 
+
+    def _install_resize_handler():
+        global _resize_count, _resize_handler_installed, _previous_resize_handler, _resize_users
+        if not _resize_handler_installed:
             try:
-                old_settings = _setup_tty(stdin)
-                fd = stdin.fileno()
-                fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-                fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK) # pylint: disable=maybe-no-member
-                epoll = select.epoll() # pylint: disable=maybe-no-member
-                epoll.register(fd, select.EPOLLIN) # pylint: disable=maybe-no-member
+                _previous_resize_handler = signal.signal(signal.SIGWINCH, _on_resize)
+            except (ValueError, OSError):
+                # Signal handlers can be set only from the main thread
+                return False
+            _resize_handler_installed = True
+            # The resizes while no handler was set went uncounted
+            _resize_count += 1
+        _resize_users += 1
+        return True
+
+
+    def _remove_resize_handler():
+        global _resize_handler_installed, _previous_resize_handler, _resize_users
+        _resize_users -= 1
+        if _resize_users or not _resize_handler_installed:
+            return
+        try:
+            # A handler the application set over this one is left in place
+            if signal.getsignal(signal.SIGWINCH) is _on_resize:
+                previous = _previous_resize_handler
+                signal.signal(signal.SIGWINCH, signal.SIG_DFL if previous is None else previous)
+        except (ValueError, OSError):
+            # Not the main thread, the handler is kept for the next session
+            return
+        _resize_handler_installed = False
+        _previous_resize_handler = None
+
+
+    class TerminalSession():
+        """
+        Keeps the terminal in raw, non blocking mode with a single poller
+        registered for the input FD, so that reads done inside the session
+        do not pay for the tty/fcntl/poller setup on every key.
+        Sessions nest, only the outermost enter/exit touch the terminal.
+        """
+
+        def __init__(self, stdin=None):
+            self._stdin = stdin or sys.stdin
+            self._depth = 0
+            self._fd = None
+            self._old_settings = None
+            self._old_flags = None
+            self._poller = None
+            self._raw = True
+            self._wakeup_fds = None
+            self._woken = False
+            self._decoder = KeyDecoder()
+            self._capabilities = None
+            self._size = None
+            self._size_count = None
+            self._resize_handler = False
+            self._keys = []
+            self._buffer = bytearray(READ_SIZE)
+            self._more_input = False
+            self._view = memoryview(self._buffer)
+            self._utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        @property
+        def active(self):
+            return self._depth > 0
+
+        @property
+        def decoder(self):
+            return self._decoder
+
+        @property
+        def capabilities(self):
+            """
+            The terminal capabilities, detected once per process
+            """
+            return self._capabilities or detect_capabilities()
+
+        def set_capabilities(self, capabilities):
+            self._capabilities = capabilities
+
+        @property
+        def size(self):
+            """
+            The (columns, rows) of the terminal or None if not known. The
+            size is cached and queried again after a SIGWINCH.
+            """
+            if self._size_count != _resize_count:
+                self._size_count = _resize_count
+                try:
+                    self._size = tuple(os.get_terminal_size(self._stdin.fileno()))
+                except Exception:
+                    self._size = None
+            return self._size
 
-                while True:
-                    events = epoll.poll(10)
-                    if (fd, select.EPOLLIN) in events: # pylint: disable=maybe-no-member
-                        chars = stdin.read()
-                        if not chars:
-                            raise ReadKeyError("Epoll returned empty")
+        def enter(self):
+            self._depth += 1
+            if self._depth > 1:
+                return self
 
-                        return _sequence_from_input_data(chars, single_char=single_char)
+            self._resize_handler = _install_resize_handler()
+            if not self._resize_handler:
+                # No resize signal, the size is queried once per session
+                self._size_count = None
 
+            try:
+                self._fd = self._stdin.fileno()
+                self._old_settings = _setup_tty(self._stdin)
+                self._old_flags = fcntl.fcntl(self._fd, fcntl.F_GETFL)
+                fcntl.fcntl(self._fd, fcntl.F_SETFL, self._old_flags | os.O_NONBLOCK) # pylint: disable=maybe-no-member
+                self._wakeup_fds = os.pipe()
+                os.set_blocking(self._wakeup_fds[0], False)
+                os.set_blocking(self._wakeup_fds[1], False)
+                self._poller = _create_poller([self._fd, self._wakeup_fds[0]])
+                self._raw = True
             except Exception as e:
+                self._depth = 1
+                self.exit()
                 raise e
-            finally:
-                epoll.unregister(fd)
-                epoll.close()
-                fcntl.fcntl(fd, fcntl.F_SETFL, fl)
-                _restore_tty(stdin, old_settings)
+            return self
+
+        def exit(self):
+            if self._depth <= 0:
+                return
+            self._depth -= 1
+            if self._depth:
+                return
+
+            try:
+                if self._poller is not None:
+                    _close_poller(self._poller)
+            except Exception:
+                pass
+            if self._wakeup_fds:
+                for wakeup_fd in self._wakeup_fds:
+                    os.close(wakeup_fd)
+            try:
+                if self._old_flags is not None:
+                    fcntl.fcntl(self._fd, fcntl.F_SETFL, self._old_flags)
+            except Exception:
+                pass
+            _restore_tty(self._stdin, self._old_settings)
+            if self._resize_handler:
+                _remove_resize_handler()
+                self._resize_handler = False
+            self._poller = None
+            self._wakeup_fds = None
+            self._old_flags = None
+            self._old_settings = None
+
+        def __enter__(self):
+            return self.enter()
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.exit()
+
+        def fileno(self):
+            return self._fd
+
+        def set_raw(self, raw=True):
+            """
+            Switches the active session between raw mode and cbreak mode.
+            In cbreak mode keys are still read without echo, but signal
+            keys and output processing work as in the normal mode.
+            Pending input is kept. Returns the previous mode.
+            """
+            previous = self._raw
+            if self.active and self._old_settings and raw != self._raw:
+                termios.tcsetattr(self._fd, termios.TCSANOW, self._old_settings)
+                if raw:
+                    tty.setraw(self._fd, termios.TCSANOW)
+                else:
+                    tty.setcbreak(self._fd, termios.TCSANOW)
+            self._raw = raw
+            return previous
+
+        def wakeup(self):
+            """
+            Makes a read blocked in another thread return an empty sequence
+            """
+            try:
+                os.write(self._wakeup_fds[1], b"\0")
+            except Exception:
+                pass
+
+        def wait(self, timeout=None):
+            ready = _poll(self._poller, timeout)
+            readable = self._fd in ready
+            if self._wakeup_fds[0] in ready:
+                try:
+                    while os.read(self._wakeup_fds[0], 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                # Input ready along with the wakeup ends the read anyway,
+                # the wakeup is reported only without it
+                self._woken = not readable
+            return readable
+
+        def read_available(self):
+            """
+            Reads and decodes the input available now, without blocking.
+            Used by event loop readers once the FD is readable.
+            """
+            chars = self._read_input()
+            return self._decoder.feed(chars) if chars else []
+
+        def flush_pending(self):
+            return self._decoder.flush()
+
+        def read(self, single_char=False, timeout=None):
+            """
+            Reads the available input as a key sequence. Returns an empty
+            list if timeout expires before any data is available.
+            """
+            if not self._keys:
+                if not self.active:
+                    with self:
+                        self._keys = self._read_keys(timeout)
+                else:
+                    self._keys = self._read_keys(timeout)
+
+            if single_char:
+                sequence = self._keys[:1]
+                del self._keys[:1]
+            else:
+                sequence = self._keys
+                self._keys = []
+            return sequence
+
+        def _read_keys(self, timeout=None):
+            while True:
+                # Input is read again without a wait only when the last read
+                # filled the buffer, a key costs one poll and one read
+                if not self._more_input:
+                    if self._decoder.pending:
+                        if not self.wait(ESCAPE_TIMEOUT):
+                            return self._decoder.flush()
+                    elif not self.wait(timeout):
+                        if timeout is not None or self._woken:
+                            self._woken = False
+                            return []
+                        continue
+
+                chars = self._read_input()
+                if chars:
+                    sequence = self._decoder.feed(chars)
+                    if sequence:
+                        return sequence
+
+        def _read_input(self):
+            # Reads the available bytes with one syscall, returns None if
+            # there is nothing to read. A multibyte character split across
+            # reads is completed by the incremental decoder.
+            try:
+                count = _readinto(self._fd, self._buffer)
+            except BlockingIOError:
+                self._more_input = False
+                return None
+            if not count:
+                raise ReadKeyError("End of input")
+            self._more_input = count == len(self._buffer)
+            return self._utf8.decode(self._view[:count])
+
+
+    def _read_sequence(stdin, single_char=False):
+        with TerminalSession(stdin) as session:
+            return session.read(single_char=single_char)
 
 
     def readkey(stdin=None):
@@ -176,6 +420,7 @@ if sys.platform.startswith("linux") or sys.platform == "darwin":
 
 elif sys.platform in ("win32", "cygwin"):
 
+    import os
     import msvcrt # noqa
 
     xlate_dict = {
@@ -223,5 +468,201 @@ elif sys.platform in ("win32", "cygwin"):
             sequence.append(readkey(stdin=stdin))
         return sequence
 
+
+    class TerminalSession():
+        """
+        The console does not need any mode switching on Windows, the session
+        only keeps the interface common with the posix implementation.
+        """
+
+        def __init__(self, stdin=None):
+            self._stdin = stdin or sys.stdin
+            self._depth = 0
+            self._woken = False
+            self._decoder = KeyDecoder()
+            self._capabilities = None
+            self._size = None
+
+        @property
+        def active(self):
+            return self._depth > 0
+
+        @property
+        def decoder(self):
+            return self._decoder
+
+        @property
+        def capabilities(self):
+            """
+            The terminal capabilities, detected once per process
+            """
+            return self._capabilities or detect_capabilities()
+
+        def set_capabilities(self, capabilities):
+            self._capabilities = capabilities
+
+        @property
+        def size(self):
+            """
+            The (columns, rows) of the console or None if not known. The
+            size is queried when the session is entered.
+            """
+            if self._size is None:
+                try:
+                    self._size = tuple(os.get_terminal_size())
+                except Exception:
+                    self._size = ()
+            return self._size or None
+
+        def enter(self):
+            self._depth += 1
+            if self._depth == 1:
+                self._size = None
+            return self
+
+        def exit(self):
+            if self._depth > 0:
+                self._depth -= 1
+
+        def __enter__(self):
+            return self.enter()
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.exit()
+
+        def set_raw(self, raw=True):
+            return True
+
+        def wakeup(self):
+            self._woken = True
+
+        def wait(self, timeout=None):
+            start = time.time()
+            while not msvcrt.kbhit():
+                if self._woken:
+                    self._woken = False
+                    return False
+                if timeout is not None and time.time() - start >= timeout:
+                    return False
+                time.sleep(.001)
+            # A key ends the read anyway, a wakeup along with it is spent
+            self._woken = False
+            return True
+
+        def read(self, single_char=False, timeout=None):
+            if not self.wait(timeout):
+                return []
+            if single_char:
+                return [readkey(stdin=self._stdin)]
+            return readkeys(stdin=self._stdin)
+
 else:
     raise PlatformNotSupported(sys.platform)
+
+
+def extend_typeahead(buffer, keys, size):
+    """
+    Adds the keys to a typeahead buffer holding up to size keys. Once it
+    is full the keys arriving are dropped rather than the oldest ones,
+    the keys typed first make the start of the line.
+    """
+    room = size - len(buffer)
+    if room > 0:
+        buffer.extend(keys[:room])
+
+
+class TypeaheadCollector():
+    """
+    Reads keys in a background thread into a buffer of up to size keys,
+    so that keys typed between the input calls are neither echoed nor
+    line buffered by the terminal. The terminal session is kept in cbreak
+    mode while collecting, the input calls switch it to raw mode.
+    """
+
+    def __init__(self, session, size=TYPEAHEAD_SIZE):
+        self._session = session
+        self._size = size
+        self._keys = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._woken = False
+        self._error = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread:
+            return
+        self._session.enter()
+        self._session.set_raw(False)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="nessaid-readline-typeahead", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if not self._thread:
+            return
+        atexit.unregister(self.stop)
+        self._running = False
+        self._session.wakeup()
+        self._thread.join()
+        self._thread = None
+        self._session.exit()
+
+    def _run(self):
+        while self._running:
+            try:
+                keys = self._session.read()
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            if keys:
+                with self._cond:
+                    extend_typeahead(self._keys, keys, self._size)
+                    self._cond.notify_all()
+
+    def wakeup(self):
+        """
+        Makes a get() waiting in another thread return an empty list
+        """
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Returns the collected keys, waits for keys if there are none.
+        Returns an empty list if no key arrived within the timeout or
+        when woken up.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._keys:
+                if self._woken:
+                    self._woken = False
+                    return []
+                if self._error:
+                    error, self._error = self._error, None
+                    raise error
+                if not self._thread or not self._thread.is_alive():
+                    raise ReadKeyError("Typeahead collector is not running")
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return []
+                    self._cond.wait(remaining)
+            keys = list(self._keys)
+            self._keys.clear()
+            return keys
+
+    def clear(self):
+        with self._cond:
+            self._keys.clear()
@@ -8,11 +8,23 @@
 import re
 import sys
 import time
-import string
+import threading
+import collections
 
 import nessaid_readline.key as key
 import nessaid_readline.readkey as readkey
 
+from nessaid_readline.render import OutputFrame, MultiLineRenderer, layout_columns, page_capacity
+from nessaid_readline.capabilities import (
+    MODE_BRACKETED_PASTE, MODE_SYNCHRONIZED_OUTPUT, mode_query, parse_mode_report, apply_mode_reports
+)
+from nessaid_readline.decoder import PasteEvent, sanitize_paste
+from nessaid_readline.linebuffer import LineBuffer, UndoLog, KillRing, BLANK_WORD_PATTERN
+from nessaid_readline.charwidth import text_width, is_printable
+from nessaid_readline.history import (
+    History, HistoryWriter, HISTORY_DURABILITY_BATCHED, HISTORY_FLUSH_INTERVAL, HISTORY_FLUSH_SIZE
+)
+
 
 class NessaidReadlineEOF(Exception):
     pass
@@ -24,16 +36,54 @@ class NessaidReadlineKeyboadInterrupt(Exception):
 
 SPECIAL_KEY_MAP = key.KEY_NAME_MAP
 
+PASTE_MODE_ON = "\x1b[?2004h"
+PASTE_MODE_OFF = "\x1b[?2004l"
+
+# Completion listings longer than this are shown only after a confirmation
+COMPLETION_QUERY_ITEMS = 100
+
+# Time to wait for the terminal to answer probe_terminal
+PROBE_TIMEOUT = 0.2
+
+# Terminal size assumed when it is not known
+DEFAULT_TERMINAL_SIZE = (80, 24)
+
+# Prompt of the rows following the first one in multi-line input
+CONTINUATION_PROMPT = "... "
+
+# Commands whose kills are joined when they follow one another
+KILL_COMMANDS = ("kill-word", "backward-kill-word", "unix-word-rubout", "kill-line", "backward-kill-line")
+
 
 class NessaidReadline():
 
     def __init__(self, stdin=None, stdout=None, stderr=None, history_size=100):
-        self._readbuf = []
+        self._readbuf = collections.deque()
         self._stdin = stdin or sys.stdin
         self._stdout = stdout or sys.stdout
+        self._output = OutputFrame(self._stdout)
+        self._renderer = MultiLineRenderer(self._output)
+        self._prompt_width = 0
+        self._horizontal_scroll = True
+        self._is_complete = None
+        self._continuation_prompt = CONTINUATION_PROMPT
+        self._frame_interval = 0
+        self._last_frame_time = 0
+        self._print_lock = threading.Lock()
+        self._print_queue = []
+        self._prompt_active = False
+        self._hold_print = False
+        self._hold_render = False
+        self._in_lookup = False
+        self._completion_query_items = COMPLETION_QUERY_ITEMS
+        self._completion_pager = True
+        self._completion_index = 0
         self._stderr = stderr or sys.stderr
         self._completer = None
-        self._line_buffer = ""
+        self._line = LineBuffer(undo_log=UndoLog())
+        self._kill_ring = KillRing()
+        self._last_command = None
+        self._yank_span = None
         self._complete_char = key.TAB
         self._caret_pos = 0
         self._replace_mode = False
@@ -44,12 +94,13 @@ class NessaidReadline():
         self._completing = False
         self._enable_history = True
         self._input_history = False
-        self._history = []
+        self._history = History(history_size)
         self._history_index = None
         self._input_backup = None
 
         self._normal_key_bindings = {}
         self._lookup_key_bindings = {}
+        self._key_name_map = dict(SPECIAL_KEY_MAP)
 
         self._op_bindings = {
             "carriage-return": self._handle_cr,
@@ -68,11 +119,22 @@ class NessaidReadline():
             "goto-line-start": self._handle_line_start,
             "goto-line-end": self._handle_line_end,
             "line-clear": self._handle_line_clear,
+            "backward-word": self._handle_backward_word,
+            "forward-word": self._handle_forward_word,
+            "kill-word": self._handle_kill_word,
+            "backward-kill-word": self._handle_backward_kill_word,
+            "unix-word-rubout": self._handle_unix_word_rubout,
+            "kill-line": self._handle_kill_line,
+            "backward-kill-line": self._handle_backward_kill_line,
+            "yank": self._handle_yank,
+            "yank-pop": self._handle_yank_pop,
             "lookup-back": self._handle_history_lookup_back,
             "lookup-forward": self._handle_history_lookup_forward,
             "line-cancel": self._handle_keyboard_interrupt,
             "line-eof": self._handle_line_eof,
             "toggle-bell": self._handle_toggle_bell,
+            "undo": self._handle_undo,
+            "redo": self._handle_redo,
             "open-reverse-lookup": self._handle_reverse_lookup,
             "forward-lookup-result": self._handle_lookup_result,
             "cancel-lookup-result": self._handle_cancel_lookup_result,
@@ -91,18 +153,45 @@ class NessaidReadline():
         self._last_completion_linebuf = None
         self._init_lookup_state()
         self._keyboard_interrupted = False
+        self._terminal = readkey.TerminalSession(self._stdin)
+        self._set_capabilities(self._terminal.capabilities)
+        self._bracketed_paste = False
+        self._typeahead = None
+        self._typeahead_flush_policy = readkey.TYPEAHEAD_FLUSH
+        self._batch_mode = None
 
     def write(self, s):
         try:
             op = "*" * len(s) if self._mask_input else s
-            self._stdout.write(op)
-            self._stdout.flush()
+            self._output.write(op)
         except:
             pass
 
+    def get_output_stats(self):
+        """
+        Returns the terminal output counters, the number of keys read and
+        the writes, flushes and bytes sent for them
+        """
+        return self._output.stats()
+
+    def reset_output_stats(self):
+        self._output.reset_stats()
+
     def handle_external_keyboard_interrupt(self):
         pass
 
+    def session(self):
+        """
+        Returns the terminal session as a context manager. The terminal stays
+        in raw mode for the whole block, so that the readline calls made
+        inside it skip the per call terminal setup.
+
+            with readline.session():
+                while True:
+                    line = readline.readline("# ")
+        """
+        return self._terminal
+
     def load_default_bindings(self):
         self._normal_key_bindings.clear()
 
@@ -122,12 +211,24 @@ class NessaidReadline():
             key.CTRL_A: "goto-line-start",
             key.CTRL_E: "goto-line-end",
             key.CTRL_L: "line-clear",
+            key.ALT_B: "backward-word",
+            key.ALT_F: "forward-word",
+            key.CTRL_LEFT: "backward-word",
+            key.CTRL_RIGHT: "forward-word",
+            key.ALT_D: "kill-word",
+            key.ALT_BACKSPACE: "backward-kill-word",
+            key.CTRL_W: "unix-word-rubout",
+            key.CTRL_K: "kill-line",
+            key.CTRL_U: "backward-kill-line",
+            key.CTRL_Y: "yank",
+            key.ALT_Y: "yank-pop",
             key.CTRL_C: "line-cancel",
             key.CTRL_D: "line-eof",
             key.LF: "newline",
             key.CR: "carriage-return",
             key.CTRL_B: "toggle-bell",
             key.CTRL_R: "open-reverse-lookup",
+            key.CTRL_UNDERSCORE: "undo",
         })
 
         self._lookup_key_bindings.clear()
@@ -160,51 +261,47 @@ class NessaidReadline():
         return self._handle_newline(ch)
 
     def _handle_newline(self, ch, **kwargs): # noqa
-        self._stdout.write("\r\n")
-        self._stdout.flush()
-        return True, self._line_buffer
+        if self._is_multiline() and not self._is_complete(str(self._line)):
+            self._line.insert(self._caret_pos, "\n")
+            self._caret_pos += 1
+            return False, None
+        self._refresh_line()
+        self._renderer.goto_end()
+        self._output.write("\r\n")
+        return True, str(self._line)
 
     def _handle_delete(self, ch, **kwargs): # noqa
-        if self._caret_pos < len(self._line_buffer):
-            self.clear_trailing_string()
-            if self._caret_pos < len(self._line_buffer) - 1:
-                trailing_part = self._line_buffer[self._caret_pos + 1:]
-            else:
-                trailing_part = ""
-            self.write(trailing_part)
-            self._stdout.write(" ")
-            self._stdout.write("\b" * (len(trailing_part) + 1))
-            self._stdout.flush()
-            self._line_buffer = self._line_buffer[:self._caret_pos - len(self._line_buffer)] + trailing_part
+        if self._caret_pos < len(self._line):
+            # The marks on the character go with it
+            end = self._line.cluster_end(self._caret_pos)
+            self._line.delete(self._caret_pos, end - self._caret_pos)
         else:
             self.play_bell()
         return False, None
 
     def _handle_backspace(self, ch, **kwargs): # noqa
         if self._caret_pos:
-            trailing_buf = self._line_buffer[self._caret_pos:]
-            if trailing_buf:
-                self.clear_trailing_string()
-            self._stdout.write("\b \b")
-            self.write(trailing_buf)
-            self._stdout.write("\b" * len(trailing_buf))
-            self._stdout.flush()
-            self._caret_pos -= 1
-            self._line_buffer = self._line_buffer[:-len(trailing_buf) - 1] + trailing_buf
+            start = self._line.cluster_start(self._caret_pos)
+            self._line.delete(start, self._caret_pos - start)
+            self._caret_pos = start
         else:
             self.play_bell()
 
         return False, None
 
     def _handle_history_previous(self, ch, **kwargs): # noqa
+        if self._move_row(-1):
+            return False, None
+
         if not self._bare_input:
 
             if self._history_index is None or self._history_index < 0:
                 self._history_index = len(self._history)
 
             if self._input_backup is None:
-                self._input_backup = self._line_buffer
+                self._input_backup = str(self._line)
 
+            self._history_index = self._older_history_index(self._history_index)
             if self._history_index:
                 self._history_index -= 1
                 if len(self._history) > self._history_index:
@@ -225,12 +322,130 @@ class NessaidReadline():
 
             if self._enable_bell and (self._last_bell_time + self._bell_silence_time) < time.time():
                 self._last_bell_time = time.time()
-                self._stdout.write("\a")
-                self._stdout.flush()
+                self._output.write("\a")
 
     def enable_bell(self, enable=True):
         self._enable_bell = False if enable is False else True
 
+    def enable_typeahead(self, enable=True, size=None):
+        """
+        Starts collecting the keys typed between the input calls in a
+        background thread, the terminal stays in no echo mode between the
+        calls and the collected keys are replayed to the next input call.
+        """
+        if enable is not False:
+            if not self._typeahead:
+                self._typeahead = readkey.TypeaheadCollector(self._terminal, size or readkey.TYPEAHEAD_SIZE)
+                self._typeahead.start()
+        elif self._typeahead:
+            self._typeahead.stop()
+            self._typeahead = None
+
+    def set_typeahead_flush_policy(self, policy):
+        if policy in [readkey.TYPEAHEAD_FLUSH, readkey.TYPEAHEAD_FLUSH_ON_ERROR, readkey.TYPEAHEAD_FLUSH_NEVER]:
+            self._typeahead_flush_policy = policy
+
+    def set_max_frame_rate(self, rate=None):
+        """
+        Limits the line redraws to rate per second, keys arriving faster
+        are applied to the line and drawn with the next frame. None or 0
+        redraws as soon as the pending keys are processed.
+        """
+        try:
+            rate = float(rate or 0)
+        except (TypeError, ValueError):
+            rate = 0
+        self._frame_interval = 1.0 / rate if rate > 0 else 0
+
+    def _set_capabilities(self, capabilities):
+        self._renderer.set_capabilities(capabilities)
+        self._output.set_synchronized(capabilities.synchronized_output)
+
+    def get_terminal_capabilities(self):
+        return self._renderer.capabilities
+
+    def probe_terminal(self, timeout=PROBE_TIMEOUT):
+        """
+        Asks the terminal whether it supports synchronized output and
+        bracketed paste, which terminfo often does not tell, and updates
+        the capabilities. Keys typed meanwhile are kept for the next input.
+        Terminals not answering within the timeout keep the detected
+        capabilities, dumb terminals are not probed.
+        """
+        if self._is_batch_input() or not self._renderer.capabilities.cursor_movement:
+            return self._renderer.capabilities
+        try:
+            self._terminal.enter()
+        except Exception:
+            return self._renderer.capabilities
+
+        raw = self._terminal.set_raw(True)
+        reports = {}
+        try:
+            self._output.write(mode_query(MODE_SYNCHRONIZED_OUTPUT) + mode_query(MODE_BRACKETED_PASTE))
+            self._flush_output()
+            deadline = time.monotonic() + timeout
+            while len(reports) < 2:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for ch in self._read_keys(timeout=remaining):
+                    report = parse_mode_report(ch)
+                    if report:
+                        reports[report[0]] = report[1]
+                    else:
+                        self._readbuf.append(ch)
+        finally:
+            self._terminal.set_raw(raw)
+            self._terminal.exit()
+
+        capabilities = apply_mode_reports(self._terminal.capabilities, reports)
+        self._terminal.set_capabilities(capabilities)
+        self._set_capabilities(capabilities)
+        return capabilities
+
+    def enable_horizontal_scroll(self, enable=True):
+        """
+        Lines wider than the terminal are scrolled horizontally, showing
+        the part around the cursor with markers at the edges. Turning it
+        off lets long lines wrap.
+        """
+        self._horizontal_scroll = False if enable is False else True
+
+    def set_multiline(self, is_complete, continuation_prompt=CONTINUATION_PROMPT):
+        """
+        Turns on multi-line editing for readline. Enter submits the input
+        when is_complete(text) returns True, otherwise it starts a new row
+        shown after the continuation prompt. UP and DOWN move between the
+        rows and go through the history from the first and the last row.
+        None turns multi-line editing off.
+        """
+        self._is_complete = is_complete if callable(is_complete) else None
+        self._continuation_prompt = continuation_prompt or ""
+
+    def _is_multiline(self):
+        return self._is_complete is not None and not self._bare_input and not self._mask_input
+
+    def _move_row(self, delta):
+        # Moves the caret to the row above or below, keeping the column
+        if not self._is_multiline():
+            return False
+        row, column = self._line.row_of(self._caret_pos)
+        row += delta
+        if row < 0 or row >= len(self._line.row_starts()):
+            return False
+        start, end = self._line.row_span(row)
+        self._caret_pos = min(start + column, end)
+        return True
+
+    def enable_bracketed_paste(self, enable=True):
+        """
+        Turns on the terminal bracketed paste mode while reading input.
+        Pasted text is then inserted to the line in one go, instead of
+        being processed as typed keys.
+        """
+        self._bracketed_paste = False if enable is False else True
+
     def set_bell_silence_time(self, t):
         try:
             t = float(t)
@@ -241,11 +456,14 @@ class NessaidReadline():
         self._bell_silence_time = t
 
     def _handle_history_next(self, ch, **kwargs): # noqa
+        if self._move_row(1):
+            return False, None
+
         if not self._bare_input:
             if self._history_index is None:
                 self._history_index = len(self._history)
             if self._input_backup is None:
-                self._input_backup = self._line_buffer
+                self._input_backup = str(self._line)
             if self._history_index < len(self._history):
                 self._history_index += 1
             if self._history_index < len(self._history):
@@ -254,7 +472,7 @@ class NessaidReadline():
                 self._handle_line_clear("")
                 self.insert_text(history_line)
                 self._suppress_bell = False
-            elif self._input_backup == self._line_buffer:
+            elif self._input_backup == str(self._line):
                 self.play_bell()
             elif self._input_backup is not None:
                 self._suppress_bell = True
@@ -266,63 +484,122 @@ class NessaidReadline():
         return False, None
 
     def _handle_line_left(self, ch, **kwargs): # noqa
-        if self._line_buffer and self._caret_pos:
-            self._stdout.write("\b")
-            self._stdout.flush()
-            self._caret_pos -= 1
+        if self._line and self._caret_pos:
+            self._caret_pos = self._line.cluster_start(self._caret_pos)
         else:
             self.play_bell()
         return False, None
 
     def _handle_line_right(self, ch, **kwargs): # noqa
-        if self._line_buffer and self._caret_pos < len(self._line_buffer):
-            self.write(self._line_buffer[self._caret_pos])
-            self._caret_pos += 1
+        if self._line and self._caret_pos < len(self._line):
+            self._caret_pos = self._line.cluster_end(self._caret_pos)
         else:
             self.play_bell()
         return False, None
 
     def _handle_line_start(self, ch, **kwargs): # noqa
-        if not self._line_buffer or not self._caret_pos:
+        if not self._line or not self._caret_pos:
             self.play_bell()
             return False, None
-        self._stdout.write("\b" * self._caret_pos)
-        self._stdout.flush()
         self._caret_pos = 0
         return False, None
 
     def _handle_line_end(self, ch, **kwargs): # noqa
-        if not self._line_buffer or self._caret_pos == len(self._line_buffer):
+        if not self._line or self._caret_pos == len(self._line):
             self.play_bell()
             return False, None
-        if self._caret_pos < len(self._line_buffer):
-            trailing_buf = self._line_buffer[self._caret_pos:]
-            self.write(trailing_buf)
-            self._caret_pos = len(self._line_buffer)
+        self._caret_pos = len(self._line)
         return False, None
 
     def _handle_line_clear(self, ch, **kwargs): # noqa
-        if self._line_buffer:
-            if self._caret_pos < len(self._line_buffer):
-                trailing_buf = self._line_buffer[self._caret_pos:]
-                self._stdout.write(" " * len(trailing_buf) + "\b" * len(trailing_buf))
-                self._line_buffer = self._line_buffer[:-len(trailing_buf)]
-            self._stdout.write("\b" * len(self._line_buffer) + " " * len(self._line_buffer) + "\b" * len(self._line_buffer))
-            self._stdout.flush()
-            self._line_buffer = ""
+        if self._line:
+            self._line.clear()
             self._caret_pos = 0
         else:
             self.play_bell()
         return False, None
 
+    def _handle_backward_word(self, ch, **kwargs): # noqa
+        pos = self._line.word_start(self._caret_pos)
+        if pos == self._caret_pos:
+            self.play_bell()
+        self._caret_pos = pos
+        return False, None
+
+    def _handle_forward_word(self, ch, **kwargs): # noqa
+        pos = self._line.word_end(self._caret_pos)
+        if pos == self._caret_pos:
+            self.play_bell()
+        self._caret_pos = pos
+        return False, None
+
+    def _handle_kill_word(self, ch, **kwargs): # noqa
+        self._kill(self._caret_pos, self._line.word_end(self._caret_pos))
+        return False, None
+
+    def _handle_backward_kill_word(self, ch, **kwargs): # noqa
+        self._kill(self._line.word_start(self._caret_pos), self._caret_pos, backward=True)
+        return False, None
+
+    def _handle_unix_word_rubout(self, ch, **kwargs): # noqa
+        self._kill(self._line.word_start(self._caret_pos, BLANK_WORD_PATTERN), self._caret_pos, backward=True)
+        return False, None
+
+    def _handle_kill_line(self, ch, **kwargs): # noqa
+        self._kill(self._caret_pos, len(self._line))
+        return False, None
+
+    def _handle_backward_kill_line(self, ch, **kwargs): # noqa
+        self._kill(0, self._caret_pos, backward=True)
+        return False, None
+
+    def _kill(self, start, end, backward=False):
+        if start >= end:
+            self.play_bell()
+            return
+        # Kills following one another are joined for the yank
+        append = self._last_command in KILL_COMMANDS
+        self._kill_ring.add(self._line.delete(start, end - start), append=append, before=backward)
+        self._caret_pos = start
+
+    def _handle_yank(self, ch, **kwargs): # noqa
+        text = self._kill_ring.yank()
+        if not text:
+            self.play_bell()
+            return False, None
+        start = self._caret_pos
+        self._line.insert(start, text)
+        self._caret_pos = start + len(text)
+        self._yank_span = (start, self._caret_pos, self._line.revision)
+        return False, None
+
+    def _handle_yank_pop(self, ch, **kwargs): # noqa
+        # Replaces the text just yanked with the older kill
+        span = self._yank_span
+        if (
+            self._last_command not in ("yank", "yank-pop") or not span or
+            span[2] != self._line.revision or len(self._kill_ring) < 2
+        ):
+            self.play_bell()
+            return False, None
+        start, end, revision = span
+        text = self._kill_ring.rotate()
+        self._line.delete(start, end - start)
+        self._line.insert(start, text)
+        self._caret_pos = start + len(text)
+        self._yank_span = (start, self._caret_pos, self._line.revision)
+        return False, None
+
     def _handle_keyboard_interrupt(self, ch, **kwargs): # noqa
-        self._stdout.write("\r\n")
-        self._stdout.flush()
+        self._refresh_line()
+        self._renderer.goto_end()
+        self._output.write("\r\n")
         raise NessaidReadlineKeyboadInterrupt()
 
     def _handle_line_eof(self, ch, **kwargs): # noqa
-        self._stdout.write("\r\n")
-        self._stdout.flush()
+        self._refresh_line()
+        self._renderer.goto_end()
+        self._output.write("\r\n")
         raise NessaidReadlineEOF()
 
     def _handle_complete(self, ch, **kwargs): # noqa
@@ -331,33 +608,36 @@ class NessaidReadline():
 
         self._completing = True
         if self._completer:
-            index = 0
-            completer_options = []
-            pre_complete_linebuf = self._line_buffer
+            pre_complete_linebuf = str(self._line)
+            self._refresh_line()
+            self._renderer.goto_end()
+            self._flush_output()
 
-            while True:
-                c = self._completer(self._line_buffer, index)
-                index += 1
-                if c is None:
-                    break
-                completer_options.append(c)
+            # Only the options that get listed are taken from the completer
+            self._completion_index = 0
+            completer_options = self._get_completions(self._completion_query_items + 1)
 
             if completer_options:
-                self._stdout.write("\r\n\r\n")
-                for c in completer_options:
-                    self._stdout.write(c + "\r\n")
-                self._stdout.write("\r\n")
+                # The answers to the listing's queries are read without
+                # drawing the line over the listing
+                self._hold_print = True
+                self._hold_render = True
+                try:
+                    self._list_completions(list(completer_options))
+                finally:
+                    self._hold_print = False
+                    self._hold_render = False
                 self.print_prompt(self._input_prompt)
-                self._stdout.write(self._line_buffer)
-                self._stdout.flush()
-                self._caret_pos = len(self._line_buffer)
+                self._renderer.reset()
+                self._caret_pos = len(self._line)
+                self._refresh_line()
 
-                if set(completer_options) == self._last_completion and self._last_completion_linebuf == self._line_buffer:
-                    if pre_complete_linebuf == self._line_buffer:
+                if set(completer_options) == self._last_completion and self._last_completion_linebuf == str(self._line):
+                    if pre_complete_linebuf == str(self._line):
                         self.play_bell()
 
                 self._last_completion = set(completer_options)
-                self._last_completion_linebuf = self._line_buffer
+                self._last_completion_linebuf = str(self._line)
             else:
                 if not self._last_completion:
                     self.play_bell()
@@ -365,15 +645,82 @@ class NessaidReadline():
         self._completing = False
         return False, None
 
+    def _get_completions(self, count=None):
+        # Returns up to count next options from the completer, fewer when
+        # the completer has no more
+        options = []
+        while self._completion_index is not None and (count is None or len(options) < count):
+            option = self._completer(str(self._line), self._completion_index)
+            if option is None:
+                self._completion_index = None
+                break
+            self._completion_index += 1
+            options.append(option)
+        return options
+
+    def _list_completions(self, options):
+        columns, rows = self._terminal.size or DEFAULT_TERMINAL_SIZE
+        self._output.write("\r\n\r\n")
+        if len(options) > self._completion_query_items:
+            # The completer can't tell the count without generating all
+            self._output.write("Display all possibilities? (more than {}, y or n)".format(self._completion_query_items))
+            answer = self.readchar()
+            self._output.write("\r\n")
+            if answer not in ("y", "Y", " "):
+                return
+
+        page_rows = max(1, rows - 1) if self._completion_pager else None
+        while True:
+            # Takes just enough options from the completer to fill the page
+            while self._completion_index is not None:
+                capacity = page_capacity(options, columns, page_rows) if page_rows else None
+                if capacity is not None and len(options) >= capacity:
+                    break
+                options.extend(self._get_completions(None if capacity is None else capacity - len(options)))
+
+            lines, count = layout_columns(options, columns, page_rows)
+            for line in lines:
+                self._output.write(line + "\r\n")
+            options = options[count:]
+            if not options and self._completion_index is None:
+                break
+
+            self._output.write("--More--")
+            answer = self.readchar()
+            self._output.write("\r        \r")
+            if answer not in (" ", "y", "Y", key.CR, key.LF):
+                break
+        self._output.write("\r\n")
+
+    def set_completion_query_items(self, count):
+        """
+        Sets the number of completion options above which the listing is
+        shown only after a confirmation
+        """
+        try:
+            self._completion_query_items = max(0, int(count))
+        except (TypeError, ValueError):
+            pass
+
+    def enable_completion_pager(self, enable=True):
+        """
+        Completion listings longer than the terminal are shown a screen at
+        a time, the next screen is shown on space or enter
+        """
+        self._completion_pager = False if enable is False else True
+
     def _handle_escape(self, ch, **kwargs): # noqa
         self.play_bell()
         return False, None
 
     def _handle_history_start(self, ch, **kwargs): # noqa
         if not self._bare_input:
+            loaded = self._history.load_older(None)
+            if loaded and self._history_index is not None:
+                self._history_index += loaded
             if self._history:
                 if self._input_backup is None:
-                    self._input_backup = self._line_buffer
+                    self._input_backup = str(self._line)
                 if self._history_index == 0:
                     self.play_bell()
                 else:
@@ -391,7 +738,7 @@ class NessaidReadline():
         if not self._bare_input:
             if self._history:
                 if self._input_backup is None:
-                    self._input_backup = self._line_buffer
+                    self._input_backup = str(self._line)
                 if self._history_index == len(self._history):
                     self.play_bell()
                 else:
@@ -409,12 +756,37 @@ class NessaidReadline():
         self._replace_mode = not self._replace_mode
         return False, None
 
+    def _handle_undo(self, ch, **kwargs): # noqa
+        caret = self._line.undo()
+        if caret is None:
+            self.play_bell()
+        else:
+            self._caret_pos = caret
+        return False, None
+
+    def _handle_redo(self, ch, **kwargs): # noqa
+        caret = self._line.redo()
+        if caret is None:
+            self.play_bell()
+        else:
+            self._caret_pos = caret
+        return False, None
+
+    def set_undo_limit(self, limit):
+        """
+        Sets the size the undo records of a line are kept within, in
+        characters of the edited text, the oldest edits are dropped first
+        """
+        try:
+            self._line.undo_log.set_limit(int(limit))
+        except (TypeError, ValueError):
+            pass
+
     def _handle_toggle_bell(self, ch, **kwargs): # noqa
         self._enable_bell = not self._enable_bell
-        self._stdout.write("\a")
+        self._output.write("\a")
         if self._enable_bell:
-            self._stdout.write("\a")
-        self._stdout.flush()
+            self._output.write("\a")
         return False, None
 
     def _init_lookup_state(self):
@@ -434,17 +806,20 @@ class NessaidReadline():
             return False, None
 
         self._init_lookup_state()
+        self._hold_print = True
+        self._in_lookup = True
 
-        if self._line_buffer:
-            self._lookup_string = self._line_buffer
+        if self._line:
+            self._lookup_string = str(self._line)
 
-        self._input_backup = self._line_buffer
+        self._input_backup = str(self._line)
 
-        line_len = len(self._input_prompt) + len(self._line_buffer)
+        # The search prompt replaces the row of the prompt and the line
+        self._renderer.erase_row(self._prompt_width)
 
         while True:
 
-            if not self._line_buffer:
+            if not self._line:
                 self._lookup_failed = False
 
             if self._lookup_string:
@@ -461,7 +836,7 @@ class NessaidReadline():
                             self._current_match_index -= 1
                         else:
                             self._current_lookup_match = None
-                            self._lookup_index -= 1
+                            self._lookup_index = self._older_history_index(self._lookup_index) - 1
                 else:
                     if self._lookup_direction == "forward":
                         if self._lookup_index < len(self._history):
@@ -470,7 +845,7 @@ class NessaidReadline():
                             self._lookup_failed = True
                     else:
                         if self._lookup_index >= 0:
-                            self._lookup_index -= 1
+                            self._lookup_index = self._older_history_index(self._lookup_index) - 1
                         else:
                             self._lookup_failed = True
 
@@ -492,32 +867,15 @@ class NessaidReadline():
                     else:
                         self._lookup_failed = True
 
-            lookup_prompt = "({failed}reverse-i-search`{lookup_str}'): {previous_match}".format(
-                failed = "failed " if self._lookup_failed else "",
-                lookup_str=self._lookup_string,
-                previous_match=self._previous_lookup_match
-            )
-
             self._suppress_bell = True
-            self._handle_line_end("")
-            self._stdout.write("\b" * line_len)
-            self._stdout.write(" " * line_len)
-            self._stdout.write("\b" * line_len)
-            self._stdout.write(lookup_prompt)
-            line_len = len(lookup_prompt)
-            try:
-                if self._current_lookup_indices:
-                    caret_position = len(self._previous_lookup_match) - self._current_lookup_indices[self._current_match_index]
-                else:
-                    caret_position = len(self._previous_lookup_match)
-                self._stdout.write("\b" * caret_position)
-            except:
-                pass
-            self._stdout.flush()
+            self._render_lookup()
 
             while True:
                 ch = self.readchar()
-                if ch in self._lookup_key_bindings:
+                if isinstance(ch, PasteEvent):
+                    self._lookup_putchar(sanitize_paste(ch))
+                    break
+                elif ch in self._lookup_key_bindings:
                     key_binding = self._lookup_key_bindings[ch]
                     key_handler = self._op_bindings[key_binding]
                     status, ret_status, ret = key_handler(ch)
@@ -533,27 +891,36 @@ class NessaidReadline():
 
         return False, None
 
-    def _handle_lookup_result(self, ch, **kwargs): # noqa
-
+    def _render_lookup(self):
+        # The search prompt is drawn through the line renderer, so only the
+        # changed parts of the search string and the match are written
         lookup_prompt = "({failed}reverse-i-search`{lookup_str}'): {previous_match}".format(
             failed = "failed " if self._lookup_failed else "",
             lookup_str=self._lookup_string,
             previous_match=self._previous_lookup_match
-        )
+        ).replace("\n", " ")
+        caret = len(lookup_prompt)
+        if self._current_lookup_indices:
+            try:
+                caret += self._current_lookup_indices[self._current_match_index] - len(self._previous_lookup_match)
+            except IndexError:
+                pass
 
-        try:
-            caret_position = len(self._previous_lookup_match) - self._current_lookup_indices[self._current_match_index]
-        except:
-            caret_position = 0
-        prompt_len = len(lookup_prompt)
+        width = self._line_width()
+        if width is not None:
+            width += self._prompt_width
+        self._renderer.set_width(width)
+        self._renderer.update(lookup_prompt, caret)
 
-        self._stdout.write("\b" * (prompt_len - caret_position))
-        self._stdout.write(" " * prompt_len)
-        self._stdout.write("\b" * prompt_len)
+    def _handle_lookup_result(self, ch, **kwargs): # noqa
 
+        self._hold_print = False
+        self._in_lookup = False
+        self._renderer.erase_row()
         self.print_prompt(self._input_prompt)
+        self._renderer.reset()
         self._caret_pos = 0
-        self._line_buffer = ""
+        self._line.clear()
         if not self._previous_lookup_match:
             self.insert_text(self._lookup_string)
         else:
@@ -570,25 +937,13 @@ class NessaidReadline():
 
     def _handle_cancel_lookup_result(self, ch, **kwargs): # noqa
 
-        lookup_prompt = "({failed}reverse-i-search`{lookup_str}'): {previous_match}".format(
-            failed = "failed " if self._lookup_failed else "",
-            lookup_str=self._lookup_string,
-            previous_match=self._previous_lookup_match
-        )
-
-        try:
-            caret_position = len(self._previous_lookup_match) - self._current_lookup_indices[self._current_match_index]
-        except:
-            caret_position = 0
-        prompt_len = len(lookup_prompt)
-
-        self._stdout.write("\b" * (prompt_len - caret_position))
-        self._stdout.write(" " * prompt_len)
-        self._stdout.write("\b" * prompt_len)
-
+        self._hold_print = False
+        self._in_lookup = False
+        self._renderer.erase_row()
         self.print_prompt(self._input_prompt)
+        self._renderer.reset()
         self._caret_pos = 0
-        self._line_buffer = ""
+        self._line.clear()
         self.insert_text(self._input_backup)
         self._input_backup = None
         self._lookup_index = len(self._history)
@@ -626,19 +981,41 @@ class NessaidReadline():
         except:
             op = None
 
-        if key and op and key in SPECIAL_KEY_MAP and op in self._op_bindings:
-            self._normal_key_bindings[SPECIAL_KEY_MAP[key]] = op
+        if key and op and key in self._key_name_map and op in self._op_bindings:
+            self._normal_key_bindings[self._key_name_map[key]] = op
+
+    def register_key_sequence(self, name, sequence):
+        """
+        Makes the escape sequence recognised as a single key, which can then
+        be bound with parse_and_bind using the name. If name is an existing
+        key name, the sequence is recognised as that key.
+        """
+        try:
+            name = name.strip().lower()
+            value = self._key_name_map.get(name, sequence)
+            self._terminal.decoder.register_sequence(sequence, value)
+            self._key_name_map[name] = value
+        except Exception:
+            pass
 
     def insert_text(self, text):
         self._suppress_bell = True
         self._handle_line_end("")
-        self.send(text)
+        # The newlines are not sent as enter, they start rows in multi-line
+        # mode and become spaces otherwise, like those of a paste
+        newline = "\n" if self._is_multiline() else " "
+        for index, part in enumerate(text.split("\n")):
+            if index:
+                self._line.insert(self._caret_pos, newline)
+                self._caret_pos += 1
+            self.send(part)
         self._suppress_bell = False
 
     def send(self, text):
         for ch in text:
             if ch in self._normal_key_bindings:
-                key_handler = self._op_bindings[self._normal_key_bindings[ch]]
+                command = self._normal_key_bindings[ch]
+                key_handler = self._op_bindings[command]
                 try:
                     key_handler(ch)
                 except Exception as e:
@@ -646,45 +1023,61 @@ class NessaidReadline():
                         continue
                     self.play_bell()
                     raise e
+                finally:
+                    self._last_command = command
             elif self.is_printable(ch):
+                self._last_command = None
                 self._putchar(ch)
 
     def get_line_buffer(self):
-        return self._line_buffer
+        return str(self._line)
 
     def is_printable(self, ch):
-        return ch in string.printable
+        return is_printable(ch)
 
     def clear_trailing_string(self):
-        trailing_buf = self._line_buffer[self._caret_pos:] if self._caret_pos else ""
+        trailing_buf = self._line[self._caret_pos:] if self._caret_pos else ""
         if trailing_buf:
-            self._stdout.write(" " * len(trailing_buf))
-            self._stdout.write("\b" * len(trailing_buf))
-            self._stdout.flush()
+            self._output.write(" " * len(trailing_buf))
+            self._output.write("\b" * len(trailing_buf))
 
     def _putchar(self, ch, **kwargs): # noqa
-        trailing_buf = self._line_buffer[self._caret_pos:] if self._caret_pos < len(self._line_buffer) else ""
         if self._replace_mode:
-            if trailing_buf:
-                self._line_buffer = self._line_buffer[:-len(trailing_buf)] + ch + trailing_buf[1:]
-            else:
-                self._line_buffer += ch
-            self.write(ch)
+            self._line.replace(self._caret_pos, ch)
         else:
-            if trailing_buf:
-                self.clear_trailing_string()
-            if self._line_buffer:
-                if trailing_buf:
-                    self._line_buffer = self._line_buffer[:-len(trailing_buf)] + ch + trailing_buf
-                else:
-                    self._line_buffer += ch
-            else:
-                self._line_buffer = ch
-            self.write(ch + trailing_buf)
-            self._stdout.write("\b" * len(trailing_buf))
-        self._stdout.flush()
+            self._line.insert(self._caret_pos, ch)
         self._caret_pos += 1
 
+    def _refresh_line(self):
+        """
+        Brings the line on the terminal to the line buffer and caret
+        state, writing only what changed since the last refresh
+        """
+        # The renderer takes just the visible part from the gap buffer
+        line = "*" * len(self._line) if self._mask_input else self._line
+        self._renderer.set_width(self._line_width())
+        self._renderer.update(line, self._caret_pos)
+
+    def _line_width(self):
+        if self._horizontal_scroll:
+            size = self._terminal.size
+            if size:
+                # The last column is left free, so that the cursor
+                # never wraps to the next row
+                return size[0] - self._prompt_width - 1
+        return None
+
+    def _paste_text(self, text):
+        text = "".join(ch for ch in sanitize_paste(text, self._is_multiline()) if ch == "\n" or self.is_printable(ch))
+        if not text:
+            return
+
+        if self._replace_mode:
+            self._line.replace(self._caret_pos, text)
+        else:
+            self._line.insert(self._caret_pos, text)
+        self._caret_pos += len(text)
+
     def print_prompt(self, prompt):
         if prompt:
             prompt.replace("\r", "\n")
@@ -695,9 +1088,8 @@ class NessaidReadline():
                 trail_str = prompt
         else:
             return 0
-        self._stdout.write(prompt)
-        self._stdout.flush()
-        return len(trail_str)
+        self._output.write(prompt)
+        return text_width(trail_str)
 
     def prepare_history_entry(self, entry):
         return entry
@@ -707,33 +1099,208 @@ class NessaidReadline():
 
     def set_history_size(self, hsize):
         self._history_size = hsize
+        self._history.resize(hsize)
+
+    def set_history_file(self, path, durability=HISTORY_DURABILITY_BATCHED,
+                         flush_interval=HISTORY_FLUSH_INTERVAL, flush_size=HISTORY_FLUSH_SIZE):
+        """
+        Loads the history from the file at path and appends the accepted
+        lines to it, None stops using the file. Only the latest entries
+        are read at first, the older ones when the history navigation or
+        the search reaches them.
+
+        The lines are written in the background, in batches flushed every
+        flush_interval seconds, at flush_size lines and at exit. With
+        durability "batched" each batch is synced to the disk, with
+        "entry" each line is written and synced before it is returned, in
+        the input call, and with "none" syncing is left to the system.
+        """
+        if path is None:
+            self._history.close()
+            self._history.set_writer(None)
+        else:
+            writer = HistoryWriter(
+                self._history, durability=durability, interval=flush_interval, size=flush_size
+            )
+            self._history.open(path)
+            self._history.set_writer(writer)
+
+    def flush_history(self):
+        """
+        Writes the history lines pending to the history file
+        """
+        self._history.flush()
+
+    def _older_history_index(self, index):
+        # At the oldest entry loaded, the older ones are loaded from the
+        # history file, shifting the index past them
+        if index == 0:
+            index += self._history.load_older()
+        return index
 
     def _add_to_history(self, line):
         if line and self._input_history:
             entry = self._prepare_history_entry(line)
             if not self._history or self._history[-1] != entry:
                 self._history.append(entry)
-                while len(self._history) > self._history_size:
-                    self._history.pop(0)
 
     def readchar(self):
-        if self._readbuf:
-            return self._readbuf.pop(0)
+        # The line is drawn only when all the keys read are applied, a
+        # burst of keys costs one redraw
+        while not self._readbuf:
+            wait = self._frame_wait()
+            if wait > 0:
+                self._readbuf.extend(self._read_keys(timeout=wait))
+                continue
+            self._print_pending()
+            self._render_frame()
+            self._readbuf.extend(self._read_keys())
+        self._output.keys += 1
+        return self._readbuf.popleft()
+
+    def _read_keys(self, timeout=None):
+        if self._typeahead:
+            return self._typeahead.get(timeout=timeout)
+        return self._terminal.read(timeout=timeout)
+
+    def print_above_prompt(self, text):
+        """
+        Prints the text above the prompt while an input call is reading
+        the line, the line being edited is redrawn below it. Can be called
+        from other threads. The text queued until the input loop
+        gets to it is printed in one batch, with one redraw of the line.
+        Without an input in progress, the text is printed right away.
+        """
+        text = text.replace("\r\n", "\n")
+        if not text.endswith("\n"):
+            text += "\n"
+        with self._print_lock:
+            if not self._prompt_active:
+                self._stdout.write(text)
+                self._stdout.flush()
+                return
+            self._print_queue.append(text.replace("\n", "\r\n"))
+        if self._typeahead:
+            self._typeahead.wakeup()
         else:
-            self._readbuf = readkey.readkeys(self._stdin)
-            return self._readbuf.pop(0)
+            self._terminal.wakeup()
+
+    def _set_prompt_active(self, active):
+        with self._print_lock:
+            self._prompt_active = active
+            if not active and self._print_queue:
+                # Text queued after the last redraw goes below the line
+                self._output.write("".join(self._print_queue))
+                self._print_queue = []
+
+    def _print_pending(self):
+        if self._hold_print:
+            return
+        with self._print_lock:
+            if not self._print_queue:
+                return
+            text = "".join(self._print_queue)
+            self._print_queue = []
+
+        self._renderer.erase_row(self._prompt_width)
+        self._output.write(text)
+        if self._input_prompt:
+            self._output.write(self._input_prompt.rsplit("\n", 1)[-1])
+        self._refresh_line()
+
+    def _frame_wait(self):
+        if not self._frame_interval:
+            return 0
+        return self._last_frame_time + self._frame_interval - time.monotonic()
+
+    def _render_frame(self):
+        if self._hold_render:
+            # A completion listing is waiting on a key below the line
+            pass
+        elif self._in_lookup:
+            self._render_lookup()
+        else:
+            self._refresh_line()
+        if self._frame_interval:
+            self._last_frame_time = time.monotonic()
+        self._flush_output()
+
+    def _flush_output(self):
+        """
+        Sends the output of the processed keys to the terminal
+        """
+        try:
+            self._output.flush()
+        except Exception:
+            self._output.discard()
 
     def flush(self):
         """"
         Flushes the cached input data
         """
-        self._readbuf = []
+        if self._typeahead_flush_policy != readkey.TYPEAHEAD_FLUSH_NEVER:
+            self._readbuf.clear()
+            if self._typeahead:
+                self._typeahead.clear()
+
+    def _flush_on_error(self):
+        if self._typeahead_flush_policy == readkey.TYPEAHEAD_FLUSH_ON_ERROR:
+            self.flush()
+
+    def set_batch_mode(self, batch_mode=None):
+        """
+        Batch mode reads whole lines from stdin, without echo or key
+        handling. By default (None) it is used when stdin is not a tty.
+        """
+        self._batch_mode = batch_mode
+
+    def _is_batch_input(self):
+        if self._batch_mode is None:
+            try:
+                self._batch_mode = not self._stdin.isatty()
+            except Exception:
+                self._batch_mode = False
+        return self._batch_mode
+
+    def _batch_input(self, line, mask_input=False, bare_input=False):
+        if not line:
+            raise NessaidReadlineEOF()
+        if line.endswith("\n"):
+            line = line[:-2] if line.endswith("\r\n") else line[:-1]
+        if not (bare_input or mask_input) and self._enable_history:
+            self._input_history = True
+            try:
+                self._add_to_history(line)
+            finally:
+                self._input_history = False
+        return line
 
     def _input(self, prompt, mask_input=False, bare_input=False):
+        if self._is_batch_input():
+            return self._batch_input(self._stdin.readline(), mask_input=mask_input, bare_input=bare_input)
+
+        try:
+            self._terminal.enter()
+        except Exception:
+            return self._session_input(prompt, mask_input=mask_input, bare_input=bare_input)
+
+        raw = self._terminal.set_raw(True)
+        try:
+            return self._session_input(prompt, mask_input=mask_input, bare_input=bare_input)
+        finally:
+            self._terminal.set_raw(raw)
+            self._terminal.exit()
+
+    def _session_input(self, prompt, mask_input=False, bare_input=False):
 
-        self.print_prompt(prompt)
+        paste_mode = self._bracketed_paste and self._renderer.capabilities.bracketed_paste
+        if paste_mode:
+            self._output.write(PASTE_MODE_ON)
+        self._prompt_width = self.print_prompt(prompt)
+        self._renderer.reset()
         self._caret_pos = 0
-        self._line_buffer = ""
+        self._line.reset()
+        undo_log = self._line.undo_log
         if bare_input or mask_input:
             self._input_history = False
         else:
@@ -743,31 +1310,57 @@ class NessaidReadline():
             self._mask_input = mask_input
             self._input_prompt = prompt
             self._bare_input = bare_input
+            self._renderer.set_prompts(
+                prompt.rsplit("\n", 1)[-1], self._continuation_prompt if self._is_multiline() else ""
+            )
+            self._set_prompt_active(True)
 
             while True:
                 try:
                     ch = self.readchar()
                 except Exception as e: # noqa
-                    self._add_to_history(self._line_buffer)
-                    return self._line_buffer
-
-                if ch in self._normal_key_bindings:
-                    key_handler = self._op_bindings[self._normal_key_bindings[ch]]
+                    self._flush_on_error()
+                    line = str(self._line)
+                    self._add_to_history(line)
+                    return line
+
+                if isinstance(ch, PasteEvent):
+                    self._last_completion = None
+                    self._last_command = None
+                    self._paste_text(ch)
+                elif ch in self._normal_key_bindings:
+                    command = self._normal_key_bindings[ch]
+                    key_handler = self._op_bindings[command]
                     if key_handler != self._handle_complete:
                         self._last_completion = None
-                    res, ret = key_handler(ch)
+                    # The edits made for a key are undone together
+                    undo_log.begin_group()
+                    try:
+                        res, ret = key_handler(ch)
+                    finally:
+                        undo_log.end_group()
+                        self._last_command = command
                     self._add_to_history(ret)
                     if res is True:
                         return ret
                 elif self.is_printable(ch):
+                    self._last_command = None
                     self._putchar(ch)
         except Exception as e:
+            self._flush_on_error()
             if type(e) in [NessaidReadlineKeyboadInterrupt, NessaidReadlineEOF]:
                 raise e
             self.play_bell()
             self._stderr.write("Exception in input: " + str(type(e)) + " " + str(e))
             return ""
         finally:
+            if paste_mode:
+                self._output.write(PASTE_MODE_OFF)
+            self._set_prompt_active(False)
+            self._flush_output()
+            self._hold_print = False
+            self._hold_render = False
+            self._in_lookup = False
             self._history_index = None
             self._completing = False
             self._mask_input = False
@@ -777,6 +1370,7 @@ class NessaidReadline():
             self._bare_input = False
             self._last_completion = None
             self._last_completion_linebuf = None
+            self._last_command = None
 
     def input(self, prompt=None, mask_input=False):
         return self._input(prompt or "", mask_input=mask_input, bare_input=True)
@@ -0,0 +1,606 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import bisect
+
+from nessaid_readline.charwidth import char_width, text_width
+from nessaid_readline.capabilities import (
+    CSI, SYNC_START, SYNC_END, TerminalCapabilities, ANSI_CAPABILITIES, DUMB_CAPABILITIES, detect_capabilities # noqa
+)
+
+# Markers shown when the line is scrolled past the left or right edge
+SCROLL_LEFT_MARKER = "<"
+SCROLL_RIGHT_MARKER = ">"
+
+# Smallest viewport the line is scrolled in
+MIN_VIEWPORT_WIDTH = 8
+
+
+# Frames larger than this are sent as synchronized updates, when the
+# terminal supports it, so they are not painted half drawn
+SYNC_FRAME_SIZE = 256
+
+
+# Spaces between the columns of the completion listing
+COLUMN_GAP = 2
+
+
+def _column_layout(items, width):
+    column_width = max(text_width(item) for item in items) + COLUMN_GAP
+    # The last column is left free, so that the rows don't wrap
+    return column_width, max(1, (width - 1 + COLUMN_GAP) // column_width)
+
+
+def page_capacity(items, width, rows):
+    """
+    Returns how many items a page of the given rows holds, with the
+    column width fitting the widest of the items
+    """
+    if not items:
+        return rows
+    return _column_layout(items, width)[1] * rows
+
+
+def layout_columns(items, width, max_rows=None):
+    """
+    Lays the items out in columns, sorted down and then across like the
+    readline completion listing. Returns the rows of the layout and the
+    number of items placed, which is less than the items when they don't
+    fit in max_rows.
+    """
+    if not items:
+        return [], 0
+    column_width, columns = _column_layout(items, width)
+    count = len(items) if max_rows is None else min(len(items), columns * max_rows)
+    rows = -(-count // columns)
+    lines = []
+    for row in range(rows):
+        cells = items[row:count:rows]
+        lines.append("".join(cell + " " * (column_width - text_width(cell)) for cell in cells[:-1]) + cells[-1])
+    return lines, count
+
+
+def _common_prefix(a, b):
+    # Binary search with slice compares, the compares run at C speed
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    lo, hi = 0, n
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _common_suffix(a, b, limit):
+    la, lb = len(a), len(b)
+    if limit <= 0:
+        return 0
+    if a[la - limit:] == b[lb - limit:]:
+        return limit
+    lo, hi = 0, limit
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+class LineRenderer():
+    """
+    Keeps the line as last rendered after the prompt and brings the
+    terminal to a new line state with the minimal update: the changed
+    segment is written, using insert/delete character and erase in line
+    sequences when the terminal supports them, and the cursor is moved
+    with CSI cursor movement.
+
+    With a width set, a line longer than the width is scrolled
+    horizontally: only the window around the cursor is drawn, with
+    markers at the edges where the line continues, so the redraw cost is
+    bounded by the width and not by the line length.
+    """
+
+    def __init__(self, output, capabilities=None):
+        self._output = output
+        self._caps = capabilities or detect_capabilities()
+        self._text = ""
+        self._cursor = 0
+        self._width = None
+        self._offset = 0
+
+    @property
+    def capabilities(self):
+        return self._caps
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def width(self):
+        return self._width
+
+    def set_width(self, width):
+        """
+        Sets the columns available to the line, None turns off scrolling
+        """
+        if width is not None:
+            width = max(width, MIN_VIEWPORT_WIDTH)
+        self._width = width
+
+    def set_capabilities(self, capabilities):
+        self._caps = capabilities
+
+    def set_cursor(self, cursor):
+        """
+        Sets the cursor position, after the cursor was moved by other means
+        """
+        self._cursor = cursor
+
+    def reset(self, text="", cursor=None):
+        """
+        Sets the state to what is on the screen, after the prompt was
+        printed or the line was redrawn by other means.
+        """
+        self._text = text
+        self._cursor = len(text) if cursor is None else cursor
+        self._offset = 0
+
+    def erase_row(self, prompt_width=0):
+        """
+        Erases the row of the line along with the prompt and leaves the
+        cursor at the first column
+        """
+        if self._caps.erase_line:
+            self._output.write("\r" + CSI + "K")
+        else:
+            count = prompt_width + text_width(self._text)
+            self._output.write("\r" + " " * count + "\r")
+        self.reset()
+
+    def update(self, text, cursor):
+        """
+        Brings the line on the terminal to text with the cursor at the
+        given position. The text can be a str or a LineBuffer, from which
+        only the visible window is taken when scrolling.
+        """
+        if self._width is not None:
+            text, cursor = self._viewport(text, cursor)
+        else:
+            text = str(text)
+        if text != self._text:
+            self._redraw(text, cursor)
+        self._move(cursor)
+
+    def _viewport(self, text, cursor):
+        width = self._width
+        if len(text) < width:
+            line = str(text)
+            if text_width(line) < width:
+                self._offset = 0
+                return line, cursor
+
+        view = self._view(text, self._offset, cursor) if self._offset <= cursor else None
+        if view is None:
+            # Jump to bring the cursor to the middle, as readline does,
+            # so that typing on does not scroll the line on every key
+            view = self._view(text, self._back(text, cursor, width // 2), cursor)
+        if view is None:
+            view = self._view(text, cursor, cursor) or (text[cursor:cursor + width], 0)
+        return view
+
+    def _back(self, text, cursor, columns):
+        # Returns the position the given columns back from the cursor
+        segment = text[max(0, cursor - columns):cursor]
+        if segment.isascii():
+            return cursor - len(segment)
+        start = cursor
+        for ch in reversed(segment):
+            columns -= char_width(ch)
+            if columns < 0:
+                break
+            start -= 1
+        return start
+
+    def _view(self, text, start, cursor):
+        # Returns the window of the width from start with the markers, and
+        # the cursor position in it, None when the cursor falls outside
+        width = self._width
+        chars = text[start:start + width]
+        if not chars.isascii():
+            columns = count = 0
+            for ch in chars:
+                columns += char_width(ch)
+                if columns > width:
+                    break
+                count += 1
+            chars = chars[:count]
+        end = len(chars)
+        right_marker = start + end < len(text)
+
+        # The markers take the first and the last column, in place of the
+        # characters there, a wide character is replaced with the marker
+        # and a space
+        left = right = ""
+        first = 0
+        if start:
+            columns = 0
+            while columns < 1 and first < end:
+                columns += char_width(chars[first])
+                first += 1
+            if not columns:
+                return None
+            left = SCROLL_LEFT_MARKER + " " * (columns - 1)
+        last = end
+        if right_marker:
+            columns = 0
+            while columns < 1 and last > first:
+                last -= 1
+                columns += char_width(chars[last])
+            right = " " * (columns - 1) + SCROLL_RIGHT_MARKER
+
+        if cursor < start + first or cursor > start + last or (right_marker and cursor == start + last):
+            return None
+        window = left + chars[first:last] + right
+        position = len(left) + cursor - start - first
+        if not right_marker and text_width(window[:position]) >= width:
+            return None
+        self._offset = start
+        return window, position
+
+    def _move_cost(self, count):
+        count = abs(count)
+        if self._caps.cursor_movement and count > 4:
+            return len(str(count)) + 3
+        return count
+
+    def _redraw(self, new, cursor):
+        old = self._text
+        start = _common_prefix(old, new)
+        len_old, len_new = len(old), len(new)
+        # A combining character is drawn again with the character it is on
+        while start and (
+            (start < len_new and not char_width(new[start])) or (start < len_old and not char_width(old[start]))
+        ):
+            start -= 1
+        suffix = _common_suffix(old, new, min(len_old, len_new) - start)
+        while suffix and not char_width(new[len_new - suffix]):
+            suffix -= 1
+        old_mid = len_old - suffix - start
+        new_mid = len_new - suffix - start
+
+        self._move(start)
+        self._text = new
+        caps = self._caps
+        out = self._output
+        old_columns = text_width(old[start:start + old_mid])
+        new_columns = text_width(new[start:start + new_mid])
+
+        # Rewriting the rest of the line is compared with inserting or
+        # deleting the difference in place, by the bytes each one takes
+        # including the cursor move that follows
+        insert_delete = False
+        if old_columns != new_columns and caps.insert_delete:
+            difference = abs(new_columns - old_columns)
+            shrink = text_width(old[start:]) - text_width(new[start:])
+            rewrite_cost = len_new - start + self._move_cost(_span_width(new, cursor, len_new))
+            if shrink > 1 and caps.erase_line:
+                rewrite_cost += 3
+            elif shrink > 0:
+                rewrite_cost += 2 * shrink
+            insert_delete_cost = (
+                new_mid + len(str(difference)) + 3 + self._move_cost(_span_width(new, cursor, start + new_mid))
+            )
+            insert_delete = insert_delete_cost < rewrite_cost
+
+        if old_columns == new_columns:
+            out.write(new[start:start + new_mid])
+            self._cursor = start + new_mid
+        elif insert_delete:
+            if new_columns > old_columns:
+                out.write(CSI + "{}@".format(new_columns - old_columns))
+                out.write(new[start:start + new_mid])
+            else:
+                out.write(new[start:start + new_mid])
+                out.write(CSI + "{}P".format(old_columns - new_columns))
+            self._cursor = start + new_mid
+        else:
+            out.write(new[start:])
+            self._cursor = len_new
+            count = text_width(old[start:]) - text_width(new[start:])
+            if count > 1 and caps.erase_line:
+                out.write(CSI + "K")
+            elif count > 0:
+                out.write(" " * count + "\b" * count)
+
+    def _move(self, cursor):
+        if cursor < self._cursor:
+            count = text_width(self._text[cursor:self._cursor])
+            if self._caps.cursor_movement and count > 4:
+                self._output.write(CSI + "{}D".format(count))
+            else:
+                self._output.write("\b" * count)
+        elif cursor > self._cursor:
+            text = self._text
+            count = text_width(text[self._cursor:cursor])
+            if self._caps.cursor_movement and count > 4:
+                self._output.write(CSI + "{}C".format(count))
+            else:
+                # The write neither starts nor ends among the marks on a
+                # character, the marks before the cursor are on the screen
+                # already and the ones after the end take no column
+                start, end = self._cursor, cursor
+                while start < end and not char_width(text[start]):
+                    start += 1
+                while end < len(text) and not char_width(text[end]):
+                    end += 1
+                self._output.write(text[start:end])
+        self._cursor = cursor
+
+
+def _span_width(text, a, b):
+    return text_width(text[a:b] if a < b else text[b:a])
+
+
+def _row_starts(text):
+    if "\n" not in text:
+        return [0]
+    starts = [0]
+    pos = text.find("\n")
+    while pos >= 0:
+        starts.append(pos + 1)
+        pos = text.find("\n", pos + 1)
+    return starts
+
+
+class MultiLineRenderer():
+    """
+    Renders a line holding newlines in rows, the first one after the
+    prompt and the rest after the continuation prompt. Each row is kept
+    by a LineRenderer of its own, an update rewrites only the rows that
+    changed and moves between the rows with cursor up and down.
+
+    A line without newlines is passed on to the LineRenderer of the first
+    row as it is. Each row is taken to fit in one terminal row, which the
+    horizontal scrolling of the rows makes sure when a width is set.
+    Terminals without cursor movement get the rows drawn again below,
+    when a row above the cursor changes.
+    """
+
+    def __init__(self, output, capabilities=None):
+        self._output = output
+        self._caps = capabilities or detect_capabilities()
+        self._prompt = ""
+        self._continuation = ""
+        self._width = None
+        self._rows = [LineRenderer(output, self._caps)]
+        self._row_texts = [""]
+        self._row = 0
+
+    @property
+    def capabilities(self):
+        return self._caps
+
+    @property
+    def text(self):
+        return "\n".join(self._row_texts) if len(self._rows) > 1 else self._rows[0].text
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def row_count(self):
+        return len(self._rows)
+
+    def set_capabilities(self, capabilities):
+        self._caps = capabilities
+        for row in self._rows:
+            row.set_capabilities(capabilities)
+
+    def set_prompts(self, prompt, continuation=""):
+        """
+        Sets the prompt of the first row, its last line, and the prompt of
+        the rows following it
+        """
+        self._prompt = prompt
+        self._continuation = continuation
+
+    def set_width(self, width):
+        """
+        Sets the columns available to the first row, the continuation rows
+        get the columns left after the continuation prompt
+        """
+        self._width = width
+        self._rows[0].set_width(width)
+        for row in self._rows[1:]:
+            row.set_width(self._row_width())
+
+    def _row_width(self):
+        if self._width is None:
+            return None
+        return self._width + text_width(self._prompt) - text_width(self._continuation)
+
+    def reset(self, text="", cursor=None):
+        self._rows = self._rows[:1]
+        self._rows[0].reset(text, cursor)
+        self._row_texts = [text]
+        self._row = 0
+
+    def erase_row(self, prompt_width=0):
+        """
+        Erases the rows of the line along with the prompt and leaves the
+        cursor at the first column of the first row
+        """
+        if len(self._rows) == 1:
+            self._rows[0].erase_row(prompt_width)
+        elif self._caps.cursor_movement and self._caps.erase_line:
+            if self._row:
+                self._output.write(CSI + "{}A".format(self._row))
+            self._output.write("\r" + CSI + "J")
+        else:
+            self._output.write("\r\n")
+        self.reset()
+
+    def goto_end(self):
+        """
+        Moves the cursor to the end of the last row, so that the output
+        following the line goes below all of its rows
+        """
+        if len(self._rows) > 1:
+            last = len(self._rows) - 1
+            self._goto(last)
+            row = self._rows[last]
+            row.update(self._row_texts[last], len(self._row_texts[last]))
+
+    def update(self, text, cursor):
+        """
+        Brings the rows on the terminal to text, a str or a LineBuffer, with
+        the cursor at the given position
+        """
+        starts = _row_starts(text) if isinstance(text, str) else text.row_starts()
+        if len(starts) == 1 and len(self._rows) == 1:
+            self._rows[0].update(text, cursor)
+            self._row_texts[0] = None
+            return
+
+        count = len(starts)
+        length = len(text)
+        texts = [text[starts[index]:starts[index + 1] - 1] for index in range(count - 1)]
+        texts.append(text[starts[-1]:length])
+
+        cursor_row = bisect.bisect_right(starts, cursor) - 1
+        changed = [
+            index for index in range(count)
+            if index >= len(self._rows) or texts[index] != self._row_texts[index]
+        ]
+
+        if not self._caps.cursor_movement and (
+            min(changed + [cursor_row]) < self._row or len(self._rows) > count
+        ):
+            # The rows above can't be reached, they are drawn again below
+            self._goto(len(self._rows) - 1)
+            self._output.write("\r\n" + self._prompt)
+            self.reset()
+            changed = list(range(count))
+
+        for index in changed:
+            if index != cursor_row:
+                self._draw_row(index, texts[index], 0)
+
+        if len(self._rows) > count:
+            self._erase_rows(count)
+
+        self._draw_row(cursor_row, texts[cursor_row], cursor - starts[cursor_row])
+
+    def _draw_row(self, index, text, cursor):
+        if index < len(self._rows):
+            self._goto(index)
+        else:
+            self._goto(len(self._rows) - 1)
+            while len(self._rows) <= index:
+                # New rows are started with a line feed, which scrolls the
+                # screen when the rows reach the bottom
+                self._output.write("\r\n" + self._continuation)
+                row = LineRenderer(self._output, self._caps)
+                row.set_width(self._row_width())
+                self._rows.append(row)
+                self._row_texts.append("")
+                self._row += 1
+        self._rows[index].update(text, cursor)
+        self._row_texts[index] = text
+
+    def _erase_rows(self, count):
+        self._goto(count - 1)
+        if self._caps.erase_line:
+            self._output.write(CSI + "1B\r" + CSI + "J" + CSI + "1A")
+        else:
+            for text in self._row_texts[count:]:
+                self._output.write("\n\r" + " " * text_width(self._continuation + text))
+            self._output.write(CSI + "{}A".format(len(self._rows) - count))
+        self._output.write("\r" + (self._prompt if count == 1 else self._continuation))
+        self._rows[count - 1].set_cursor(0)
+        del self._rows[count:]
+        del self._row_texts[count:]
+
+    def _goto(self, index):
+        delta = index - self._row
+        if not delta:
+            return
+        if delta < 0:
+            self._output.write(CSI + "{}A".format(-delta))
+        elif self._caps.cursor_movement:
+            self._output.write(CSI + "{}B".format(delta))
+        else:
+            self._output.write("\n" * delta)
+        # The row is written over from its prompt, to start at a known column
+        self._output.write("\r" + (self._prompt if index == 0 else self._continuation))
+        self._rows[index].set_cursor(0)
+        self._row = index
+
+
+class OutputFrame():
+    """
+    Collects the output of the key handlers, so that the input loop can
+    send it to the terminal with one write and one flush after each
+    batch of keys.
+    """
+
+    def __init__(self, stdout):
+        self._stdout = stdout
+        self._parts = []
+        self._synchronized = False
+        self.keys = 0
+        self.writes = 0
+        self.flushes = 0
+        self.bytes = 0
+
+    def write(self, s):
+        if s:
+            self._parts.append(s)
+
+    def pending(self):
+        return bool(self._parts)
+
+    def set_synchronized(self, synchronized=True):
+        self._synchronized = synchronized
+
+    def flush(self):
+        if self._parts:
+            data = "".join(self._parts)
+            self._parts = []
+            if self._synchronized and len(data) > SYNC_FRAME_SIZE:
+                data = SYNC_START + data + SYNC_END
+            self._stdout.write(data)
+            self._stdout.flush()
+            self.writes += 1
+            self.flushes += 1
+            self.bytes += len(data)
+
+    def discard(self):
+        self._parts = []
+
+    def stats(self):
+        return {
+            "keys": self.keys,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "bytes": self.bytes,
+            "flushes_per_key": (self.flushes / self.keys) if self.keys else 0.0,
+            "bytes_per_key": (self.bytes / self.keys) if self.keys else 0.0,
+        }
+
+    def reset_stats(self):
+        self.keys = 0
+        self.writes = 0
+        self.flushes = 0
+        self.bytes = 0
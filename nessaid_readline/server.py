@@ -0,0 +1,394 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import os
+import codecs
+import asyncio
+
+from nessaid_readline.decoder import KeyDecoder, ESCAPE_TIMEOUT
+from nessaid_readline.capabilities import ANSI_CAPABILITIES
+from nessaid_readline.async_readline import NessaidAsyncReadline, NessaidReadlineEOF
+
+
+READ_SIZE = 4096
+
+# Telnet protocol, RFC 854, RFC 857, RFC 858, RFC 1073
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+OPT_ECHO = 1
+OPT_SGA = 3
+OPT_NAWS = 31
+
+_IAC_BYTE = bytes([IAC])
+
+TELNET_NEGOTIATION = bytes([
+    IAC, WILL, OPT_ECHO,
+    IAC, WILL, OPT_SGA,
+    IAC, DO, OPT_SGA,
+    IAC, DO, OPT_NAWS,
+])
+
+_DATA = 0
+_IAC = 1
+_OPTION = 2
+_SUBNEG = 3
+_SUBNEG_IAC = 4
+_CR = 5
+
+
+class TelnetFilter():
+    """
+    Strips the telnet commands from the client data. The window size
+    reported with NAWS is passed to on_resize(columns, rows).
+    The state is kept across feeds, so commands split across reads
+    are handled.
+    """
+
+    def __init__(self, on_resize=None):
+        self._on_resize = on_resize
+        self._state = _DATA
+        self._subneg = bytearray()
+
+    def feed(self, data):
+        out = bytearray()
+        state = self._state
+        i = 0
+        length = len(data)
+
+        while i < length:
+            if state == _DATA:
+                j = data.find(_IAC_BYTE, i)
+                k = data.find(b"\r", i, j if j >= 0 else length)
+                if k >= 0:
+                    j = k
+                if j < 0:
+                    out += data[i:]
+                    break
+                out += data[i:j]
+                state = _IAC if data[j] == IAC else _CR
+                if state == _CR:
+                    out.append(0x0D)
+                i = j + 1
+                continue
+
+            byte = data[i]
+            i += 1
+
+            if state == _CR:
+                # Telnet clients send CR NUL or CR LF for enter
+                state = _DATA
+                if byte not in (0x00, 0x0A):
+                    i -= 1
+            elif state == _IAC:
+                if byte == IAC:
+                    out.append(IAC)
+                    state = _DATA
+                elif byte in (DO, DONT, WILL, WONT):
+                    state = _OPTION
+                elif byte == SB:
+                    self._subneg.clear()
+                    state = _SUBNEG
+                else:
+                    state = _DATA
+            elif state == _OPTION:
+                state = _DATA
+            elif state == _SUBNEG:
+                if byte == IAC:
+                    state = _SUBNEG_IAC
+                else:
+                    self._subneg.append(byte)
+            elif state == _SUBNEG_IAC:
+                if byte == SE:
+                    self._handle_subnegotiation(bytes(self._subneg))
+                    state = _DATA
+                else:
+                    self._subneg.append(byte)
+                    state = _SUBNEG
+
+        self._state = state
+        return bytes(out)
+
+    def _handle_subnegotiation(self, data):
+        if len(data) == 5 and data[0] == OPT_NAWS and self._on_resize:
+            columns = (data[1] << 8) | data[2]
+            rows = (data[3] << 8) | data[4]
+            if columns and rows:
+                self._on_resize(columns, rows)
+
+
+class StreamOutput():
+    """
+    File like output over an asyncio StreamWriter. The readline awaits
+    drain before it reads the keys, so a client not taking the output
+    stops the session instead of growing the write buffer.
+    """
+
+    def __init__(self, writer, encoding="utf-8"):
+        self._writer = writer
+        self._encoding = encoding
+        self._buffer = []
+
+    def write(self, s):
+        self._buffer.append(s)
+        return len(s)
+
+    def flush(self):
+        if self._buffer:
+            data = "".join(self._buffer).encode(self._encoding, errors="replace")
+            self._buffer = []
+            if not self._writer.is_closing():
+                self._writer.write(data)
+
+    async def drain(self):
+        if self._writer.is_closing():
+            return
+        try:
+            await self._writer.drain()
+        except ConnectionError:
+            # The closed connection is reported by the reads
+            pass
+
+    def isatty(self):
+        return True
+
+
+class StreamKeyReader():
+    """
+    Key reader of NessaidAsyncReadline reading from an asyncio StreamReader
+    """
+
+    def __init__(self, terminal):
+        self._terminal = terminal
+
+    @property
+    def started(self):
+        return True
+
+    def set_size(self, size):
+        # The keys are read from the stream as they are asked for
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def clear(self):
+        pass
+
+    async def read(self):
+        return await self._terminal.read_keys()
+
+
+class StreamTerminal():
+    """
+    Terminal session of a readline running over an asyncio stream pair.
+    With telnet enabled, the telnet commands are stripped from the input
+    and the window size is taken from the NAWS reports.
+    """
+
+    def __init__(self, reader, writer, telnet=True, encoding="utf-8"):
+        self._reader = reader
+        self._writer = writer
+        self._depth = 0
+        self._decoder = KeyDecoder()
+        self._text_decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._telnet = TelnetFilter(on_resize=self._on_resize) if telnet else None
+        self._size = None
+        # Telnet and pty clients are taken to be ANSI terminals
+        self._capabilities = ANSI_CAPABILITIES
+
+    @property
+    def active(self):
+        return self._depth > 0
+
+    @property
+    def decoder(self):
+        return self._decoder
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def capabilities(self):
+        return self._capabilities
+
+    def set_capabilities(self, capabilities):
+        self._capabilities = capabilities
+
+    def _on_resize(self, columns, rows):
+        self._size = (columns, rows)
+
+    def negotiate(self):
+        if self._telnet:
+            self._writer.write(TELNET_NEGOTIATION)
+
+    def enter(self):
+        self._depth += 1
+        return self
+
+    def set_raw(self, raw=True):
+        return True
+
+    def exit(self):
+        if self._depth > 0:
+            self._depth -= 1
+
+    def __enter__(self):
+        return self.enter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.exit()
+
+    def create_key_reader(self, loop):
+        return StreamKeyReader(self)
+
+    async def read_keys(self):
+        while True:
+            if self._decoder.pending:
+                try:
+                    data = await asyncio.wait_for(self._reader.read(READ_SIZE), ESCAPE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    return self._decoder.flush()
+            else:
+                data = await self._reader.read(READ_SIZE)
+
+            if not data:
+                raise EOFError("Connection closed")
+
+            if self._telnet:
+                data = self._telnet.feed(data)
+            chars = self._text_decoder.decode(data)
+            if chars:
+                keys = self._decoder.feed(chars)
+                if keys:
+                    return keys
+
+
+class ReadlineSession():
+    """
+    A NessaidAsyncReadline running over a stream pair, like a client
+    connection or a pty master. Any number of sessions can run on one
+    event loop, they don't use any threads.
+    """
+
+    def __init__(self, reader, writer, telnet=True, loop=None, history_size=100):
+        self._writer = writer
+        self.terminal = StreamTerminal(reader, writer, telnet=telnet)
+        self.stdout = StreamOutput(writer)
+        self.readline = NessaidAsyncReadline(
+            loop=loop, stdin=reader, stdout=self.stdout, stderr=self.stdout,
+            history_size=history_size, terminal=self.terminal
+        )
+
+    @classmethod
+    async def from_pty(cls, master_fd, loop=None, history_size=100):
+        """
+        Creates a session over a pty master. The client attached to the
+        slave side, like a terminal program or a serial console bridge,
+        talks to the session.
+        """
+        loop = loop or asyncio.get_event_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(master_fd, "rb", 0))
+        # The protocol of a stream reader never fed gives the writer its
+        # flow control
+        write_transport, write_protocol = await loop.connect_write_pipe(
+            lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()), os.fdopen(os.dup(master_fd), "wb", 0)
+        )
+        writer = asyncio.StreamWriter(write_transport, write_protocol, None, loop)
+        return cls(reader, writer, telnet=False, loop=loop, history_size=history_size)
+
+    @property
+    def size(self):
+        return self.terminal.size
+
+    def start(self):
+        self.terminal.negotiate()
+
+    def write(self, s):
+        self.stdout.write(s.replace("\n", "\r\n"))
+        self.stdout.flush()
+
+    async def drain(self):
+        await self._writer.drain()
+
+    def close(self):
+        self.stdout.flush()
+        if not self._writer.is_closing():
+            self._writer.close()
+
+
+class NessaidReadlineServer():
+    """
+    Serves readline sessions over TCP or Unix sockets. The handler
+    coroutine is called with a ReadlineSession for each connection and
+    the connection is closed when it returns.
+
+        async def handler(session):
+            while True:
+                line = await session.readline.readline("# ")
+                session.write("Read: " + line + "\\n")
+
+        server = NessaidReadlineServer(handler)
+        await server.start_tcp("127.0.0.1", 2323)
+    """
+
+    def __init__(self, handler, telnet=True, loop=None, history_size=100):
+        self._handler = handler
+        self._telnet = telnet
+        self._loop = loop
+        self._history_size = history_size
+        self._servers = []
+        self._sessions = set()
+
+    @property
+    def sessions(self):
+        return set(self._sessions)
+
+    async def start_tcp(self, host=None, port=0, **kwargs):
+        server = await asyncio.start_server(self._on_connection, host, port, **kwargs)
+        self._servers.append(server)
+        return server
+
+    async def start_unix(self, path, **kwargs):
+        server = await asyncio.start_unix_server(self._on_connection, path, **kwargs)
+        self._servers.append(server)
+        return server
+
+    async def _on_connection(self, reader, writer):
+        session = ReadlineSession(
+            reader, writer, telnet=self._telnet,
+            loop=self._loop or asyncio.get_event_loop(), history_size=self._history_size
+        )
+        self._sessions.add(session)
+        try:
+            session.start()
+            await self._handler(session)
+        except (NessaidReadlineEOF, EOFError, ConnectionError):
+            pass
+        finally:
+            self._sessions.discard(session)
+            session.close()
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        for session in list(self._sessions):
+            session.close()
+
+    async def wait_closed(self):
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
@@ -13,7 +13,7 @@ from nessaid_readline.readline import NessaidReadline
 def main():
     print("Readkey test. Press 'q' to stop")
 
-    key_map = {getattr(key, item): item for item in dir(key) if not item.startswith("_") and item not in ['KEY_NAME_MAP']}
+    key_map = {getattr(key, item): item for item in dir(key) if not item.startswith("_") and item not in ['KEY_NAME_MAP', 'KEY_SEQUENCE_ALIASES']}
 
     while True:
         ch = readkey()
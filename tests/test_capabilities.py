@@ -0,0 +1,127 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import io
+
+import pytest
+
+from nessaid_readline import capabilities
+from nessaid_readline.capabilities import (
+    ANSI_CAPABILITIES, DUMB_CAPABILITIES, MODE_BRACKETED_PASTE, MODE_SYNCHRONIZED_OUTPUT,
+    detect_capabilities, mode_query, parse_mode_report, apply_mode_reports
+)
+from nessaid_readline.decoder import decode
+from nessaid_readline.readline import NessaidReadline
+
+
+class Terminfo():
+    """
+    Terminfo entry of the string capabilities in entry, noting the
+    terminals looked up
+    """
+
+    def __init__(self):
+        self.entry = {}
+        self.terms = []
+
+    def load(self, term):
+        self.terms.append(term)
+        return self.entry.get
+
+
+@pytest.fixture
+def terminfo(monkeypatch):
+    terminfo = Terminfo()
+    monkeypatch.setattr(capabilities, "_capabilities_cache", {})
+    monkeypatch.setattr(capabilities, "_load_terminfo", terminfo.load)
+    return terminfo
+
+
+@pytest.mark.parametrize("term", ["", "dumb", "unknown"])
+def test_dumb_terminals(terminfo, term):
+    assert detect_capabilities(term) is DUMB_CAPABILITIES
+
+
+def test_detection_runs_once_per_terminal(terminfo, monkeypatch):
+    monkeypatch.setenv("TERM", "vt100")
+    first = detect_capabilities()
+    assert detect_capabilities("vt100") is first
+    assert detect_capabilities("vt220") is not first
+    assert terminfo.terms == ["vt100", "vt220"]
+
+
+def test_terminfo_entry_decides(terminfo):
+    terminfo.entry.update({"cub": b"\x1b[D", "cuf": b"\x1b[C", "el": b"\x1b[K"})
+    detected = detect_capabilities("xterm-mono")
+    assert (detected.cursor_movement, detected.erase_line, detected.insert_delete) == (True, True, False)
+    # Bracketed paste is taken from the terminal family when terminfo
+    # doesn't list it
+    assert detected.bracketed_paste and not detected.synchronized_output
+    assert not detect_capabilities("vt100").bracketed_paste
+    assert detected.name == "xterm-mono"
+
+
+def test_no_terminfo_is_taken_as_ansi(terminfo, monkeypatch):
+    monkeypatch.setattr(capabilities, "_load_terminfo", lambda term: None)
+    detected = detect_capabilities("xterm")
+    assert vars(detected) == vars(ANSI_CAPABILITIES.copy(name="xterm"))
+
+
+def test_mode_report_parsing():
+    assert mode_query(MODE_BRACKETED_PASTE) == "\x1b[?2004$p"
+    assert parse_mode_report("\x1b[?2026;2$y") == (MODE_SYNCHRONIZED_OUTPUT, 2)
+    assert parse_mode_report("\x1b[?2026;2$yx") is None
+    assert parse_mode_report("\x1b[2026;2$y") is None
+    assert parse_mode_report(None) is None
+
+
+@pytest.mark.parametrize("status, supported", [(0, False), (1, True), (2, True), (3, True), (4, False)])
+def test_mode_reports_update_the_capabilities(status, supported):
+    updated = apply_mode_reports(DUMB_CAPABILITIES, {MODE_SYNCHRONIZED_OUTPUT: status, MODE_BRACKETED_PASTE: status})
+    assert updated.synchronized_output is supported
+    assert updated.bracketed_paste is supported
+    assert not updated.cursor_movement
+    assert apply_mode_reports(DUMB_CAPABILITIES, {}) is DUMB_CAPABILITIES
+
+
+class ProbedTerminal():
+    """
+    Terminal answering the probe with the replies, a key typed before
+    the replies arrive
+    """
+
+    def __init__(self, replies):
+        self._input = decode(replies)
+        self.capabilities = ANSI_CAPABILITIES.copy(bracketed_paste=False)
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def set_raw(self, raw=True):
+        return True
+
+    def set_capabilities(self, capabilities):
+        self.capabilities = capabilities
+
+    def read(self, single_char=False, timeout=None):
+        keys, self._input = self._input[:1], self._input[1:]
+        return keys
+
+
+def test_probe_takes_the_replies_and_keeps_the_keys():
+    output = io.StringIO()
+    readline = NessaidReadline(stdout=output)
+    readline.set_batch_mode(False)
+    readline._terminal = ProbedTerminal("a\x1b[?2026;1$y\x1b[?2004;2$y")
+    probed = readline.probe_terminal(timeout=1)
+    assert probed.synchronized_output and probed.bracketed_paste
+    assert readline.get_terminal_capabilities() is probed
+    assert output.getvalue() == mode_query(MODE_SYNCHRONIZED_OUTPUT) + mode_query(MODE_BRACKETED_PASTE)
+    assert list(readline._readbuf) == ["a"]
@@ -0,0 +1,44 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import unicodedata
+
+import pytest
+
+import nessaid_readline.key as key
+from nessaid_readline.charwidth import char_width, text_width, is_printable
+
+
+@pytest.mark.parametrize("ch, width", [
+    ("a", 1), ("~", 1), ("\u00e9", 1), ("\u0416", 1),
+    ("\u0301", 0), ("\u200d", 0), ("\ufe0f", 0), ("\u1160", 0),
+    ("\u4e2d", 2), ("\uac00", 2), ("\uff21", 2), ("\U0001f600", 2), ("\U00020000", 2),
+])
+def test_char_width(ch, width):
+    assert char_width(ch) == width
+
+
+def test_combining_marks_take_no_column():
+    marks = [chr(code) for code in range(0x300, 0x370)]
+    assert all(unicodedata.category(mark) == "Mn" for mark in marks)
+    assert text_width("".join(marks)) == 0
+
+
+def test_text_width():
+    assert text_width("") == 0
+    assert text_width("abc") == 3
+    assert text_width("cafe\u0301 \u4e2d\u6587") == 9
+
+
+@pytest.mark.parametrize("ch", ["a", " ", "\u00e9", "\u4e2d", "\u0301", "\u200d", "\U0001f600"])
+def test_printable(ch):
+    assert is_printable(ch)
+
+
+@pytest.mark.parametrize("ch", ["\x00", "\t", "\x1b", "\x7f", "\x85", "\u202e", "\ue000", "\ud800", key.UP, "ab"])
+def test_not_printable(ch):
+    assert not is_printable(ch)
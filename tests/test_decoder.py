@@ -0,0 +1,112 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import pytest
+
+import nessaid_readline.key as key
+from nessaid_readline.decoder import KeyDecoder, PasteEvent, MAX_SEQUENCE_LENGTH, decode
+
+
+def feed_all(decoder, chunks):
+    keys = []
+    for chunk in chunks:
+        keys.extend(decoder.feed(chunk))
+    return keys
+
+
+STREAM = "ab" + key.UP + "c" + key.ALT_B + key.CTRL_HOME + "\x1b[1;2;3X" + key.F1 + "d"
+STREAM_KEYS = ["a", "b", key.UP, "c", key.ALT_B, key.CTRL_HOME, "\x1b[1;2;3X", key.F1, "d"]
+
+
+@pytest.mark.parametrize("split", range(1, len(STREAM)))
+def test_split_reads_give_the_same_keys(split):
+    decoder = KeyDecoder()
+    assert feed_all(decoder, [STREAM[:split], STREAM[split:]]) == STREAM_KEYS
+    assert not decoder.pending
+
+
+def test_stream_fed_a_character_at_a_time():
+    decoder = KeyDecoder()
+    assert feed_all(decoder, STREAM) == STREAM_KEYS
+
+
+def test_lone_escape_is_reported_on_flush():
+    decoder = KeyDecoder()
+    assert decoder.feed("a\x1b") == ["a"]
+    assert decoder.pending
+    assert decoder.flush() == [key.ESC]
+    assert not decoder.pending
+
+
+def test_escape_completed_by_the_next_feed():
+    decoder = KeyDecoder()
+    assert decoder.feed(key.ESC) == []
+    assert decoder.feed("b") == [key.ALT_B]
+
+
+@pytest.mark.parametrize("sequence, value", [
+    ("\x1bOA", key.UP),
+    ("\x1b[1~", key.HOME),
+    ("\x1b[[C", key.F3),
+    ("\x1b[1;5P", key.F1),
+    ("\x1b\x1b[D", key.ALT_LEFT),
+    (key.CTRL_DELETE, key.CTRL_DELETE),
+])
+def test_known_sequences(sequence, value):
+    assert decode(sequence) == [value]
+
+
+def test_unknown_sequence_is_one_key():
+    assert decode("\x1b[1;2;3X" + "\x1bO5Z") == ["\x1b[1;2;3X", "\x1bO5Z"]
+
+
+def test_sequence_ends_at_a_character_outside_the_grammar():
+    assert decode("\x1b[1\x01x") == ["\x1b[1", "\x01", "x"]
+
+
+def test_overlong_sequence_is_cut():
+    data = "\x1b[" + "1" * 2 * MAX_SEQUENCE_LENGTH + "A"
+    keys = decode(data)
+    assert keys[0] == data[:MAX_SEQUENCE_LENGTH]
+    assert "".join(keys) == data
+
+
+def test_registered_sequence_is_decoder_local():
+    decoder = KeyDecoder()
+    decoder.register_sequence("\x1b[99~", "my-key")
+    assert decoder.feed("\x1b[99~" + key.UP) == ["my-key", key.UP]
+    assert KeyDecoder().feed("\x1b[99~") == ["\x1b[99~"]
+
+
+@pytest.mark.parametrize("sequence", ["", "a", "\x1b"])
+def test_register_needs_an_escape_sequence(sequence):
+    with pytest.raises(ValueError):
+        KeyDecoder().register_sequence(sequence)
+
+
+@pytest.mark.parametrize("split", range(len(key.PASTE_END) + 1))
+def test_paste_end_split_at_every_offset(split):
+    data = key.PASTE_START + "a\x1b" + key.PASTE_END + "z"
+    cut = data.index(key.PASTE_END) + split
+    decoder = KeyDecoder()
+    keys = feed_all(decoder, [data[:cut], data[cut:]])
+    assert keys == ["a\x1b", "z"]
+    assert isinstance(keys[0], PasteEvent)
+    assert not decoder.pasting
+
+
+def test_paste_end_after_escape_in_window():
+    decoder = KeyDecoder()
+    assert decoder.feed("\x1b[200~a\x1b\x1b[2") == []
+    assert decoder.feed("01~z") == ["a\x1b", "z"]
+
+
+def test_partial_paste_end_kept_on_flush():
+    decoder = KeyDecoder()
+    assert decoder.feed(key.PASTE_START + "ab\x1b[20") == []
+    assert decoder.flush() == ["ab\x1b[20"]
+    assert not decoder.pasting
@@ -0,0 +1,455 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import io
+import os
+import time
+import random
+import asyncio
+import threading
+
+import pytest
+
+import nessaid_readline.key as key
+from nessaid_readline import history as history_module
+from nessaid_readline.history import (
+    History, HistoryRing, HistoryFile, HistoryWriter, AsyncHistoryWriter, encode_record, decode_record,
+    HISTORY_DURABILITY_NONE, HISTORY_DURABILITY_BATCHED, HISTORY_DURABILITY_ENTRY
+)
+from nessaid_readline.readline import NessaidReadline
+
+
+def test_ring_matches_a_bounded_list():
+    rand = random.Random(23)
+    ring = HistoryRing(5)
+    model = []
+    for step in range(500):
+        if rand.random() < 0.05:
+            capacity = rand.randint(0, 8)
+            ring.resize(capacity)
+            model = model[len(model) - min(len(model), capacity):]
+        else:
+            ring.append(step)
+            model = (model + [step])[-ring.capacity:] if ring.capacity else []
+        assert len(ring) == len(model)
+        assert list(ring) == model
+        assert [ring[index] for index in range(-len(model), len(model))] == model + model
+
+
+def test_ring_index_out_of_range():
+    ring = HistoryRing(2)
+    for entry in "abc":
+        ring.append(entry)
+    with pytest.raises(IndexError):
+        ring[2]
+    with pytest.raises(IndexError):
+        ring[-3]
+    ring.clear()
+    assert list(ring) == [] and ring.capacity == 2
+
+
+def test_history_up_goes_back_through_the_kept_entries():
+    readline = NessaidReadline(stdout=io.StringIO(), history_size=3)
+    for entry in "abcde":
+        readline._history.append(entry)
+    readline._readbuf.extend([key.UP] * 5 + [key.CR])
+    assert readline._session_input("# ") == "c"
+
+
+@pytest.mark.parametrize("entry", ["plain", "two\nrows", "back\\slash\\n", "\\", "\u4e2d\u6587", ""])
+def test_record_round_trip(entry):
+    record = encode_record(entry)
+    assert record.endswith(b"\n") and record.count(b"\n") == 1
+    assert decode_record(record[:-1]) == entry
+
+
+def test_bad_bytes_in_a_record_are_replaced():
+    assert decode_record(b"a\xffb") == "a\ufffdb"
+
+
+def write_file(path, data):
+    with open(path, "wb") as history_file:
+        history_file.write(data)
+
+
+def read_file(path):
+    with open(path, "rb") as history_file:
+        return history_file.read()
+
+
+def test_file_is_indexed_a_step_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_module, "HISTORY_INDEX_STEP", 3)
+    path = str(tmp_path / "history")
+    write_file(path, b"".join(encode_record(str(n)) for n in range(10)))
+    history = History(8)
+    history.open(path)
+    assert list(history) == ["7", "8", "9"]
+    assert not history.file.exhausted
+    # Loading the older entries shifts the indices by the count loaded
+    assert history.load_older(2) == 2
+    assert history[0] == "5"
+    assert history.load_older(None) == 3
+    assert list(history) == [str(n) for n in range(2, 10)]
+    assert history.load_older(None) == 0
+    history.close()
+
+
+def test_record_cut_short_is_left_out(tmp_path):
+    path = str(tmp_path / "history")
+    write_file(path, b"a\nb\ncut")
+    history = History(10)
+    history.open(path)
+    assert list(history) == ["a", "b"]
+    history.append("c")
+    assert list(history) == ["a", "b", "c"]
+    history.close()
+    assert read_file(path) == b"a\nb\ncut\nc\n"
+
+
+def test_entries_added_are_appended(tmp_path):
+    path = str(tmp_path / "history")
+    history = History(10)
+    history.open(path)
+    history.append("one")
+    history.append("two\nrows")
+    history.close()
+    assert read_file(path) == b"one\ntwo\\nrows\n"
+    history.open(path)
+    assert list(history) == ["one", "two\nrows"]
+    history.close()
+
+
+def test_entries_held_are_kept_by_open(tmp_path):
+    path = str(tmp_path / "history")
+    write_file(path, b"a\n")
+    history = History(10)
+    history.append("b")
+    history.append("c")
+    history.open(path)
+    assert list(history) == ["a", "b", "c"]
+    history.append("d")
+    history.close()
+    assert read_file(path) == b"a\nb\nc\nd\n"
+
+
+def test_lines_read_before_the_history_file_are_kept(tmp_path):
+    path = str(tmp_path / "history")
+    write_file(path, b"old\n")
+    readline = NessaidReadline(stdin=io.StringIO("one\ntwo\n"), stdout=io.StringIO())
+    assert readline.readline("# ") == "one"
+    readline.set_history_file(path)
+    assert list(readline._history) == ["old", "one"]
+    assert readline.readline("# ") == "two"
+    readline.set_history_file(None)
+    assert read_file(path) == b"old\none\ntwo\n"
+
+
+def test_growing_the_history_loads_the_file_again(tmp_path):
+    path = str(tmp_path / "history")
+    write_file(path, b"a\nb\nc\n")
+    history = History(2)
+    history.open(path)
+    history.set_writer(HistoryWriter(history, interval=60))
+    history.append("d")
+    assert list(history) == ["c", "d"]
+    history.resize(5)
+    assert list(history) == ["a", "b", "c", "d"]
+    history.close()
+    assert read_file(path) == b"a\nb\nc\nd\n"
+
+
+def test_compaction_keeps_the_latest_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_module, "HISTORY_COMPACT_SIZE", 0)
+    path = str(tmp_path / "history")
+    write_file(path, b"".join(encode_record(str(n)) for n in range(10)))
+    history_file = HistoryFile(path)
+    history_file.index(5)
+    assert history_file.compaction_due(3)
+    history_file.compact(3, threading.Lock())
+    assert read_file(path) == b"7\n8\n9\n"
+    # The index follows the records kept
+    assert history_file.indexed == 3
+    assert [history_file.entry(index) for index in range(3)] == ["9", "8", "7"]
+    assert history_file.exhausted
+    assert not history_file.compaction_due(3)
+    history_file.close()
+
+
+def test_no_compaction_under_the_navigation(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_module, "HISTORY_COMPACT_SIZE", 0)
+    path = str(tmp_path / "history")
+    write_file(path, b"".join(encode_record(str(n)) for n in range(10)))
+    history = History(3)
+    history.open(path)
+    # The file is compacted as it is opened
+    assert read_file(path) == b"7\n8\n9\n"
+    history.set_writer(HistoryWriter(history, interval=60))
+    history.append("x")
+    assert list(history) == ["8", "9", "x"]
+
+    # Another session appends to the file while this one navigates
+    with open(path, "ab") as other:
+        other.write(b"p\nq\nr\n")
+    history.flush()
+    assert list(history) == ["8", "9", "x"]
+
+    history.close()
+    assert read_file(path) == b"7\n8\n9\np\nq\nr\nx\n"
+
+
+def test_readline_history_file(tmp_path):
+    path = str(tmp_path / "history")
+    readline = NessaidReadline(stdin=io.StringIO("one\ntwo\n"), stdout=io.StringIO())
+    readline.set_history_file(path)
+    assert [readline.readline("# "), readline.readline("# ")] == ["one", "two"]
+    readline.set_history_file(None)
+    assert read_file(path) == b"one\ntwo\n"
+
+    readline = NessaidReadline(stdout=io.StringIO())
+    readline.set_history_file(path)
+    readline._readbuf.extend([key.UP, key.UP, key.CR])
+    assert readline._session_input("# ") == "one"
+    readline.set_history_file(None)
+
+
+@pytest.fixture
+def slow_fsync(monkeypatch):
+    """
+    Makes os.fsync wait for the test to read the history, noting whether
+    the read got through while the sync was going on
+    """
+    syncing = threading.Event()
+    read = threading.Event()
+    read_in_sync = []
+    sync = os.fsync
+
+    def fsync(fd):
+        syncing.set()
+        read_in_sync.append(read.wait(2))
+        sync(fd)
+
+    monkeypatch.setattr(history_module.os, "fsync", fsync)
+    return syncing, read, read_in_sync
+
+
+def read_while_syncing(history, write, syncing, read, read_in_sync):
+    writer = threading.Thread(target=write)
+    writer.start()
+    assert syncing.wait(5)
+    entries = list(history)
+    read.set()
+    writer.join(5)
+    assert not writer.is_alive()
+    assert read_in_sync and all(read_in_sync)
+    return entries
+
+
+def test_read_does_not_wait_on_sync(tmp_path, slow_fsync):
+    history = History(10)
+    history.open(str(tmp_path / "history"))
+    history.append("one")
+
+    entries = read_while_syncing(
+        history, lambda: history.write([], sync=True), *slow_fsync)
+    assert entries == ["one"]
+    history.close()
+
+
+def test_read_does_not_wait_on_compaction(tmp_path, slow_fsync, monkeypatch):
+    monkeypatch.setattr(history_module, "HISTORY_COMPACT_SIZE", 0)
+    path = str(tmp_path / "history")
+    history = History(2)
+    history.open(path)
+    for entry in ("a", "b", "c", "d"):
+        history._ring.append(entry)
+    history.write(["a", "b", "c", "d"])
+
+    # The file is compacted as it is closed
+    entries = read_while_syncing(history, history.close, *slow_fsync)
+    assert entries == ["c", "d"]
+
+    with open(path, "rb") as history_file:
+        assert history_file.read().count(b"\n") == 2
+    history.open(path)
+    assert list(history) == ["c", "d"]
+    history.close()
+
+
+@pytest.fixture
+def synced(monkeypatch):
+    """
+    Counts the fsync calls
+    """
+    calls = []
+    sync = os.fsync
+
+    def fsync(fd):
+        calls.append(fd)
+        sync(fd)
+
+    monkeypatch.setattr(history_module.os, "fsync", fsync)
+    return calls
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def open_history(path, writer_class=HistoryWriter, **kwargs):
+    history = History(100)
+    history.open(path)
+    writer = writer_class(history, **kwargs)
+    history.set_writer(writer)
+    return history, writer
+
+
+def test_writer_writes_a_batch_at_the_size(tmp_path, synced):
+    path = str(tmp_path / "history")
+    history, writer = open_history(path, interval=60, size=3)
+    history.append("a")
+    history.append("b")
+    time.sleep(0.05)
+    assert read_file(path) == b""
+    history.append("c")
+    wait_for(lambda: read_file(path) == b"a\nb\nc\n")
+    assert len(synced) == 1
+    history.close()
+
+
+def test_writer_writes_a_batch_after_the_interval(tmp_path, synced):
+    path = str(tmp_path / "history")
+    history, writer = open_history(path, durability=HISTORY_DURABILITY_NONE, interval=0.05)
+    history.append("a")
+    history.append("b")
+    wait_for(lambda: read_file(path) == b"a\nb\n")
+    assert synced == []
+    history.close()
+
+
+def test_entry_durability_syncs_each_entry(tmp_path, synced):
+    path = str(tmp_path / "history")
+    history, writer = open_history(path, durability=HISTORY_DURABILITY_ENTRY, interval=60)
+    assert writer.durability == HISTORY_DURABILITY_ENTRY
+    for count, entry in enumerate("abc", 1):
+        history.append(entry)
+        # Written and synced before the append returns
+        assert read_file(path).count(b"\n") == count
+        assert len(synced) == count
+    history.close()
+
+
+def test_close_writes_the_entries_pending(tmp_path):
+    path = str(tmp_path / "history")
+    history, writer = open_history(path, durability=HISTORY_DURABILITY_BATCHED, interval=60)
+    history.append("a")
+    history.close()
+    assert read_file(path) == b"a\n"
+
+
+def test_unknown_durability():
+    with pytest.raises(ValueError):
+        HistoryWriter(History(10), durability="sometimes")
+
+
+def test_write_error_is_kept(tmp_path, monkeypatch):
+    path = str(tmp_path / "history")
+    history, writer = open_history(path, interval=0)
+
+    def fail(fd, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(history_module.os, "write", fail)
+    history.append("a")
+    wait_for(lambda: writer.error is not None)
+    assert str(writer.error) == "disk full"
+    monkeypatch.undo()
+    history.close()
+
+
+def test_async_writer_writes_on_the_loop(tmp_path, synced):
+    path = str(tmp_path / "history")
+
+    async def main():
+        history, writer = open_history(path, AsyncHistoryWriter, loop=asyncio.get_running_loop(), interval=60, size=2)
+        history.append("a")
+        history.append("b")
+        while read_file(path) != b"a\nb\n":
+            await asyncio.sleep(0.01)
+        history.append("c")
+        await asyncio.sleep(0.05)
+        assert read_file(path) == b"a\nb\n"
+        # The entry pending is written when the writer is closed
+        history.close()
+        return read_file(path)
+
+    assert asyncio.run(asyncio.wait_for(main(), 5)) == b"a\nb\nc\n"
+    assert len(synced) == 2
+
+
+def test_async_writer_flushes_when_the_loop_ends(tmp_path):
+    path = str(tmp_path / "history")
+
+    async def main():
+        history, writer = open_history(path, AsyncHistoryWriter, loop=asyncio.get_running_loop(), interval=60)
+        history.append("a")
+        await asyncio.sleep(0)
+        return history
+
+    history = asyncio.run(main())
+    assert read_file(path) == b"a\n"
+    history.close()
+
+
+@pytest.fixture
+def write_threads(monkeypatch):
+    """
+    Notes the threads the history file is written from
+    """
+    threads = []
+    write = History.write
+
+    def record_write(self, entries, sync=False):
+        threads.append(threading.current_thread())
+        write(self, entries, sync)
+
+    monkeypatch.setattr(History, "write", record_write)
+    return threads
+
+
+def test_async_writer_close_does_not_write_on_the_loop(tmp_path, write_threads):
+    path = str(tmp_path / "history")
+
+    async def main():
+        history, writer = open_history(path, AsyncHistoryWriter, loop=asyncio.get_running_loop(), interval=60)
+        history.append("a")
+        writer.close()
+        while read_file(path) != b"a\n":
+            await asyncio.sleep(0.01)
+        return history
+
+    history = asyncio.run(asyncio.wait_for(main(), 5))
+    assert write_threads and threading.main_thread() not in write_threads
+    history.close()
+
+
+def test_async_writer_aclose_waits_for_the_entries(tmp_path, write_threads):
+    path = str(tmp_path / "history")
+
+    async def main():
+        history, writer = open_history(path, AsyncHistoryWriter, loop=asyncio.get_running_loop(), interval=60)
+        history.append("a")
+        history.append("b")
+        await writer.aclose()
+        return history, read_file(path)
+
+    history, data = asyncio.run(main())
+    assert data == b"a\nb\n"
+    assert threading.main_thread() not in write_threads
+    history.close()
@@ -0,0 +1,191 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import random
+
+import pytest
+
+from nessaid_readline.linebuffer import LineBuffer, UndoLog, KillRing, RECORD_SIZE, BLANK_WORD_PATTERN
+
+
+def test_edits_match_a_string_model():
+    rand = random.Random(18)
+    line = LineBuffer("start")
+    model = "start"
+    for _ in range(2000):
+        pos = rand.randint(0, len(model))
+        edit = rand.random()
+        revision = line.revision
+        if edit < 0.4:
+            text = "".join(rand.choice("ab\u4e2d ") for _ in range(rand.randint(1, 3)))
+            line.insert(pos, text)
+            model = model[:pos] + text + model[pos:]
+        elif edit < 0.7:
+            count = rand.randint(1, 3)
+            assert line.delete(pos, count) == model[pos:pos + count]
+            model = model[:pos] + model[pos + count:]
+        elif edit < 0.8:
+            text = rand.choice(["x", "yz"])
+            assert line.replace(pos, text) == model[pos:pos + len(text)]
+            model = model[:pos] + text + model[pos + len(text):]
+        else:
+            # Reads leave the gap and the revision where they are
+            start, stop = sorted((rand.randint(0, len(model)), rand.randint(0, len(model))))
+            assert line[start:stop] == model[start:stop]
+            if model:
+                assert line[pos - 1] == model[pos - 1]
+            assert line.revision == revision
+            continue
+        assert len(line) == len(model)
+        if pos < len(model):
+            assert line[pos] == model[pos]
+        if rand.random() < 0.1:
+            assert str(line) == model
+    assert str(line) == model
+    assert line[:] == model
+    assert line[::2] == model[::2]
+
+
+def test_index_out_of_range():
+    line = LineBuffer("ab")
+    line.insert(1, "x")
+    with pytest.raises(IndexError):
+        line[3]
+    assert line[-3] == "a"
+
+
+def test_reset_and_set():
+    line = LineBuffer("abc")
+    line.delete(0)
+    line.set("xyz")
+    assert (str(line), len(line)) == ("xyz", 3)
+    line.reset("new")
+    assert repr(line) == "LineBuffer('new')"
+    line.clear()
+    assert not line
+
+
+def type_text(line, text):
+    for ch in text:
+        line.insert(len(line), ch)
+
+
+def undo_all(line):
+    states = []
+    while line.undo() is not None:
+        states.append(str(line))
+    return states
+
+
+def test_typing_is_undone_a_word_at_a_time():
+    line = LineBuffer(undo_log=UndoLog())
+    type_text(line, "ab  cd e")
+    assert undo_all(line) == ["ab  cd", "ab", ""]
+
+
+def test_typing_in_a_group_is_undone_at_once():
+    log = UndoLog()
+    line = LineBuffer(undo_log=log)
+    log.begin_group()
+    type_text(line, "ab cd")
+    log.begin_group()
+    line.delete(0)
+    log.end_group()
+    log.end_group()
+    type_text(line, "x")
+    assert undo_all(line) == ["b cd", ""]
+
+
+def test_undo_and_redo_return_the_caret():
+    line = LineBuffer("abc", undo_log=UndoLog())
+    line.replace(1, "XY")
+    line.delete(0)
+    assert (line.undo(), str(line)) == (1, "aXY")
+    assert (line.undo(), str(line)) == (3, "abc")
+    assert line.undo() is None
+    assert (line.redo(), str(line)) == (3, "aXY")
+    assert (line.redo(), str(line)) == (0, "XY")
+    assert line.redo() is None
+
+
+def test_edit_after_undo_drops_the_redo():
+    log = UndoLog()
+    line = LineBuffer(undo_log=log)
+    type_text(line, "ab")
+    line.undo()
+    assert log.can_redo()
+    type_text(line, "c")
+    assert not log.can_redo()
+    assert line.redo() is None
+
+
+def test_oldest_edits_are_dropped_at_the_limit():
+    log = UndoLog(limit=3 * (RECORD_SIZE + 2))
+    line = LineBuffer(undo_log=log)
+    for n in range(5):
+        line.insert(len(line), "{}{}".format(n, n))
+    # The three latest edits fit in the limit
+    assert undo_all(line) == ["00112233", "001122", "0011"]
+    log.set_limit(0)
+    assert not log.can_undo() and not log.can_redo()
+
+
+def test_reset_starts_a_new_line_for_undo():
+    log = UndoLog()
+    line = LineBuffer(undo_log=log)
+    type_text(line, "ab")
+    line.reset("new")
+    assert not log.can_undo()
+    assert line.undo() is None
+    assert LineBuffer("x").undo() is None
+
+
+def test_word_bounds():
+    line = LineBuffer("foo.bar  baz-1")
+    assert line.word_bounds() == ([0, 4, 9, 13], [3, 7, 12, 14])
+    assert line.word_bounds(BLANK_WORD_PATTERN) == ([0, 9], [7, 14])
+    assert [line.word_start(pos) for pos in (0, 1, 4, 5, 9, 14)] == [0, 0, 0, 4, 4, 13]
+    assert [line.word_end(pos) for pos in (0, 3, 7, 12, 14)] == [3, 7, 12, 14, 14]
+
+
+def test_word_bounds_are_found_once_per_revision():
+    line = LineBuffer("one two")
+    bounds = line.word_bounds()
+    assert line.word_bounds() is bounds
+    line.insert(3, "x")
+    assert line.word_bounds() is not bounds
+    assert line.word_end(0) == 4
+
+
+def test_kill_ring_joins_and_rotates():
+    ring = KillRing(size=3)
+    assert ring.yank() is None and ring.rotate() is None
+    ring.add("two")
+    ring.add(" three", append=True)
+    ring.add("one ", append=True, before=True)
+    assert ring.yank() == "one two three"
+    for text in ("a", "b", "c"):
+        ring.add(text)
+    assert len(ring) == 3
+    assert [ring.yank(), ring.rotate(), ring.rotate(), ring.rotate()] == ["c", "b", "a", "c"]
+    # A new kill puts the rotation back on top
+    ring.rotate()
+    ring.add("d")
+    assert ring.rotate() == "c"
+
+
+def test_rows_of_a_multiline_text():
+    line = LineBuffer("one")
+    assert line.row_starts() == [0]
+    line.insert(3, "\ntwo\n")
+    assert line.row_starts() == [0, 4, 8]
+    assert [line.row_of(pos) for pos in (0, 3, 4, 8)] == [(0, 0), (0, 3), (1, 0), (2, 0)]
+    assert [line.row_span(row) for row in range(3)] == [(0, 3), (4, 7), (8, 8)]
+    line.delete(3)
+    assert line.row_starts() == [0, 7]
+    line.delete(6)
+    assert line.row_starts() == [0]
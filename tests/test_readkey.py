@@ -0,0 +1,269 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import os
+import select
+import signal
+import sys
+import asyncio
+import threading
+
+import pytest
+
+import nessaid_readline.key as key
+import nessaid_readline.readkey as readkey
+from nessaid_readline.readkey import TerminalSession, TypeaheadCollector
+from nessaid_readline.async_readline import AsyncKeyReader
+
+termios = pytest.importorskip("termios")
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs a pty")
+
+
+@pytest.fixture
+def pty_session():
+    import pty
+    master, slave = pty.openpty()
+    stdin = os.fdopen(slave, "rb", 0)
+    session = TerminalSession(stdin)
+    session.enter()
+    yield session, master
+    session.exit()
+    stdin.close()
+    os.close(master)
+
+
+def test_session_keeps_the_terminal_raw_until_the_outermost_exit():
+    import pty
+    master, slave = pty.openpty()
+    stdin = os.fdopen(slave, "rb", 0)
+    settings = termios.tcgetattr(slave)
+    try:
+        session = TerminalSession(stdin)
+        with session:
+            assert session.active
+            assert not termios.tcgetattr(slave)[3] & termios.ICANON
+            assert not os.get_blocking(slave)
+            with session:
+                pass
+            # Only the outermost exit touches the terminal
+            assert session.active
+            assert not termios.tcgetattr(slave)[3] & termios.ICANON
+            os.write(master, b"ab")
+            assert select.select([slave], [], [], 1)[0]
+            assert session.read() == ["a", "b"]
+        assert not session.active
+        assert termios.tcgetattr(slave) == settings
+        assert os.get_blocking(slave)
+    finally:
+        stdin.close()
+        os.close(master)
+
+
+def test_set_raw_switches_to_cbreak(pty_session):
+    session, master = pty_session
+    fd = session.fileno()
+    assert not termios.tcgetattr(fd)[3] & termios.ISIG
+    assert session.set_raw(False) is True
+    lflag = termios.tcgetattr(fd)[3]
+    assert lflag & termios.ISIG and not lflag & (termios.ICANON | termios.ECHO)
+    assert session.set_raw(True) is False
+    assert not termios.tcgetattr(fd)[3] & termios.ISIG
+
+
+def test_read_times_out_empty(pty_session):
+    session, master = pty_session
+    assert session.read(timeout=0.05) == []
+
+
+def test_wakeup_with_input_is_not_reported_later(pty_session):
+    session, master = pty_session
+    os.write(master, b"a")
+    # The pty passes the input on in its own time
+    assert select.select([session._fd], [], [], 1)[0]
+    session.wakeup()
+    assert session.wait(1) is True
+    # The input ends the read the wakeup was for, it is spent
+    assert session._woken is False
+    assert session.read() == ["a"]
+    # Nothing is pending, the spent wakeup doesn't end the next read early
+    assert session.read(timeout=0.05) == []
+    assert session.wait(0.05) is False
+    os.write(master, b"b")
+    assert session.read(timeout=1) == ["b"]
+
+
+def test_wakeup_ends_wait(pty_session):
+    session, master = pty_session
+    session.wakeup()
+    session.wakeup()
+    assert session.wait(1) is False
+    assert session.wait(0.05) is False
+
+
+def test_character_split_across_reads(pty_session):
+    session, master = pty_session
+    data = "é€".encode("utf-8")
+    os.write(master, data[:3])
+    assert session.read(timeout=1) == ["é"]
+    assert session.read(timeout=0.05) == []
+    os.write(master, data[3:])
+    assert session.read(timeout=1) == ["€"]
+
+
+def test_invalid_input_is_replaced(pty_session):
+    session, master = pty_session
+    os.write(master, b"a\xffb")
+    assert session.read(timeout=1) == ["a", "\ufffd", "b"]
+
+
+@pytest.fixture
+def syscalls(monkeypatch):
+    """
+    Counts the polls and the reads of the sessions
+    """
+    calls = []
+    poll = readkey._poll
+    readinto = readkey._readinto
+
+    def counted_poll(poller, timeout=None):
+        calls.append("poll")
+        return poll(poller, timeout)
+
+    def counted_readinto(fd, buffer):
+        calls.append("read")
+        return readinto(fd, buffer)
+
+    monkeypatch.setattr(readkey, "_poll", counted_poll)
+    monkeypatch.setattr(readkey, "_readinto", counted_readinto)
+    return calls
+
+
+def test_key_costs_a_poll_and_a_read(pty_session, syscalls):
+    session, master = pty_session
+    for data in (b"a", key.UP.encode()):
+        # The key arrives while the session waits for it
+        timer = threading.Timer(0.05, os.write, (master, data))
+        timer.start()
+        del syscalls[:]
+        assert session.read(timeout=1) == [data.decode()]
+        timer.join()
+        assert syscalls == ["poll", "read"]
+
+
+def test_full_read_is_followed_by_a_read(pty_session, syscalls):
+    session, master = pty_session
+    session._buffer = bytearray(4)
+    session._view = memoryview(session._buffer)
+    os.write(master, b"abcdef")
+    assert select.select([session.fileno()], [], [], 1)[0]
+    del syscalls[:]
+    assert session.read() == list("abcd")
+    # The read filling the buffer left input behind, it is read at once
+    assert session.read() == list("ef")
+    assert syscalls == ["poll", "read", "read"]
+
+
+def test_resize_handler_of_the_application_is_kept():
+    import pty
+    resizes = []
+
+    def on_resize(signum, frame):
+        resizes.append(signum)
+
+    previous = signal.signal(signal.SIGWINCH, on_resize)
+    master, slave = pty.openpty()
+    stdin = os.fdopen(slave, "rb", 0)
+    try:
+        session = TerminalSession(stdin)
+        with session:
+            with TerminalSession(stdin):
+                pass
+            assert signal.getsignal(signal.SIGWINCH) is not on_resize
+            # Called on from the handler of the sessions
+            os.kill(os.getpid(), signal.SIGWINCH)
+            assert resizes == [signal.SIGWINCH]
+        # Put back as the last session exits
+        assert signal.getsignal(signal.SIGWINCH) is on_resize
+    finally:
+        signal.signal(signal.SIGWINCH, previous)
+        stdin.close()
+        os.close(master)
+
+
+def read_on_loop(session, master, steps, size=None):
+    """
+    Runs the steps, a write to do and the keys to read after it, through
+    an AsyncKeyReader of the session
+    """
+    async def main():
+        reader = AsyncKeyReader(asyncio.get_running_loop(), session)
+        if size:
+            reader.set_size(size)
+        reader.start()
+        try:
+            keys = []
+            for data in steps:
+                os.write(master, data)
+                keys.append(await asyncio.wait_for(reader.read(), 1))
+            return keys
+        finally:
+            reader.stop()
+            assert not reader.started
+    return asyncio.run(main())
+
+
+def test_async_reader_reads_on_the_loop(pty_session):
+    session, master = pty_session
+    assert read_on_loop(session, master, [b"ab", key.UP.encode()]) == [["a", "b"], [key.UP]]
+
+
+def test_async_reader_reports_lone_escape_after_timeout(pty_session):
+    session, master = pty_session
+    assert read_on_loop(session, master, [b"\x1b"]) == [[key.ESC]]
+
+
+@pytest.fixture
+def typeahead(pty_session):
+    session, master = pty_session
+    collector = TypeaheadCollector(session, size=3)
+    collector.start()
+    yield collector, session, master
+    collector.stop()
+
+
+def test_typeahead_collects_in_cbreak_mode(typeahead):
+    collector, session, master = typeahead
+    assert collector.running
+    assert termios.tcgetattr(session.fileno())[3] & termios.ISIG
+    os.write(master, b"ab")
+    keys = collector.get(timeout=1)
+    while len(keys) < 2:
+        keys += collector.get(timeout=1)
+    assert keys == ["a", "b"]
+    assert collector.get(timeout=0.05) == []
+
+
+def test_typeahead_keeps_the_first_keys(typeahead):
+    collector, session, master = typeahead
+    os.write(master, b"abcdef")
+    assert collector.get(timeout=1) == ["a", "b", "c"]
+
+
+def test_async_reader_keeps_the_first_keys(pty_session):
+    session, master = pty_session
+    assert read_on_loop(session, master, [b"abcdef", b"gh"], size=3) == [["a", "b", "c"], ["g", "h"]]
+
+
+def test_typeahead_wakeup_ends_get(typeahead):
+    collector, session, master = typeahead
+    collector.wakeup()
+    assert collector.get() == []
+    collector.stop()
+    assert not collector.running
+    assert session.active
@@ -0,0 +1,380 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import io
+import os
+import sys
+import asyncio
+import inspect
+import threading
+import subprocess
+
+import pytest
+
+import nessaid_readline.key as key
+import nessaid_readline.readkey as readkey
+from nessaid_readline.readline import NessaidReadline, NessaidReadlineEOF
+from nessaid_readline.async_readline import NessaidAsyncReadline
+from nessaid_readline.decoder import PasteEvent
+from nessaid_readline.render import ANSI_CAPABILITIES
+
+
+def run_sync(keys, setup=None):
+    output = io.StringIO()
+    readline = NessaidReadline(stdout=output, stderr=output)
+    if setup:
+        setup(readline)
+    readline._readbuf.extend(list(keys) + [key.CR])
+    return readline._session_input("# ")
+
+
+def run_async(keys, setup=None):
+    async def main():
+        output = io.StringIO()
+        readline = NessaidAsyncReadline(stdout=output, stderr=output)
+        if setup:
+            setup(readline)
+        readline._readbuf.extend(list(keys) + [key.CR])
+        return await readline._session_input("# ")
+    return asyncio.run(main())
+
+
+@pytest.fixture(params=[run_sync, run_async], ids=["sync", "async"])
+def run(request):
+    """
+    Runs the keys through the input loop of a readline and returns the
+    line entered, a CR ending the keys
+    """
+    return request.param
+
+
+def test_paste_is_inserted_as_text(run):
+    # Line breaks and tabs become spaces, the other controls are dropped
+    keys = ["x"] + [PasteEvent("a\tb\r\nc\x07\rd"), "y"]
+    assert run(keys) == "xa b c dy"
+
+
+def test_paste_is_undone_at_once(run):
+    assert run(["x", PasteEvent("hello world"), key.CTRL_UNDERSCORE]) == "x"
+
+
+def test_paste_replaces_in_replace_mode(run):
+    keys = list("abcd") + [key.CTRL_A, key.INSERT, PasteEvent("XY")]
+    assert run(keys) == "XYcd"
+
+
+def test_flush_policy_keeps_typeahead_with_never():
+    readline = NessaidReadline(stdout=io.StringIO())
+    readline._readbuf.extend("ab")
+    readline.set_typeahead_flush_policy(readkey.TYPEAHEAD_FLUSH_NEVER)
+    readline.flush()
+    assert list(readline._readbuf) == ["a", "b"]
+    readline.set_typeahead_flush_policy(readkey.TYPEAHEAD_FLUSH)
+    readline.flush()
+    assert not readline._readbuf
+
+
+def test_typeahead_is_enabled_alike():
+    assert inspect.signature(NessaidReadline.enable_typeahead) == inspect.signature(
+        NessaidAsyncReadline.enable_typeahead)
+
+
+def test_keys_beyond_the_typeahead_size_are_kept_by_the_input():
+    line = "x" * (readkey.TYPEAHEAD_SIZE + 10)
+    assert run_sync(line) == line
+
+
+class ScriptTerminal():
+    """
+    Terminal reading the keys of a script, a callable in it is run in
+    another thread in place of a read
+    """
+
+    def __init__(self, script):
+        self._script = list(script)
+        self.capabilities = ANSI_CAPABILITIES
+        self.size = None
+        self.wakeups = 0
+
+    def read(self, single_char=False, timeout=None):
+        step = self._script.pop(0)
+        if callable(step):
+            thread = threading.Thread(target=step)
+            thread.start()
+            thread.join()
+            return []
+        return [step]
+
+    def wakeup(self):
+        self.wakeups += 1
+
+
+class BlockingTerminal(ScriptTerminal):
+    """
+    Terminal whose reads wait until it is released
+    """
+
+    def __init__(self, script):
+        ScriptTerminal.__init__(self, script)
+        self.released = threading.Event()
+
+    def read(self, single_char=False, timeout=None):
+        self.released.wait(5)
+        return ScriptTerminal.read(self, single_char, timeout)
+
+
+def test_keys_of_a_cancelled_executor_read_are_kept():
+    async def main():
+        output = io.StringIO()
+        readline = NessaidAsyncReadline(stdout=output, stderr=output)
+        readline._terminal = BlockingTerminal(["a", "b", key.CR])
+        readline._key_reader = None
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(readline._session_input("# "), 0.05)
+        readline._terminal.released.set()
+        return await asyncio.wait_for(readline._session_input("# "), 1)
+
+    assert asyncio.run(main()) == "ab"
+
+
+def run_script(script):
+    output = io.StringIO()
+    readline = NessaidReadline(stdout=output, stderr=output)
+    readline._terminal = ScriptTerminal([step(readline) if callable(step) else step for step in script])
+    return readline._session_input("# "), output.getvalue(), readline
+
+
+def test_print_above_prompt_redraws_the_line_below():
+    def print_text(readline):
+        return lambda: readline.print_above_prompt("hello\nworld")
+    line, output, readline = run_script(["a", "b", print_text, "c", key.CR])
+    assert line == "abc"
+    assert output == "# ab\r\x1b[Khello\r\nworld\r\n# abc\r\n"
+    assert readline._terminal.wakeups == 1
+
+
+def test_texts_printed_together_cost_one_redraw():
+    def print_texts(readline):
+        return lambda: [readline.print_above_prompt(text) for text in ("one", "two\n")]
+    line, output, readline = run_script(["a", print_texts, key.CR])
+    assert output == "# a\r\x1b[Kone\r\ntwo\r\n# a\r\n"
+
+
+def test_print_without_input_goes_out_at_once():
+    output = io.StringIO()
+    NessaidReadline(stdout=output).print_above_prompt("text")
+    assert output.getvalue() == "text\n"
+
+
+def test_completion_pager_takes_only_the_options_shown():
+    asked = []
+
+    def completer(text, index):
+        asked.append(index)
+        return "option{:04d}".format(index)
+
+    output = io.StringIO()
+    readline = NessaidReadline(stdout=output, stderr=output)
+    readline.set_completer(completer)
+    readline.set_completion_query_items(10)
+    readline._terminal = ScriptTerminal([key.TAB, "y", " ", "q", key.CR])
+    readline._terminal.size = (40, 4)
+    assert readline._session_input("# ") == ""
+    # Three columns of three rows a page, two pages listed
+    assert len(asked) == 18
+    assert output.getvalue().count("--More--") == 2
+    assert "option0000  option0003  option0006\r\n" in output.getvalue()
+    assert "option0017" in output.getvalue()
+    assert "option0018" not in output.getvalue()
+
+
+def list_in_rows(readline_class):
+    output = io.StringIO()
+
+    def input_line():
+        readline = readline_class(stdout=output, stderr=output)
+        readline.set_multiline(lambda text: text.endswith(";"))
+        readline.set_completer(lambda text, index: "option{:04d}".format(index) if index < 12 else None)
+        readline.set_completion_query_items(100)
+        readline._terminal = ScriptTerminal(["a", key.CR, "b", key.UP, key.TAB, " ", ";", key.CR])
+        readline._terminal.size = (40, 4)
+        readline._key_reader = None
+        return readline._session_input("# ")
+
+    async def main():
+        return await input_line()
+
+    line = asyncio.run(main()) if readline_class is NessaidAsyncReadline else input_line()
+    return line, output.getvalue()
+
+
+@pytest.mark.parametrize("readline_class", [NessaidReadline, NessaidAsyncReadline], ids=["sync", "async"])
+def test_completion_pager_is_not_drawn_over(readline_class):
+    line, output = list_in_rows(readline_class)
+    assert line == "a\nb;"
+    assert output.count("--More--") == 1
+    # Nothing is drawn between the pager prompt and its erase
+    assert "--More--\r        \r" in output
+    # The line is drawn again only below the listing
+    listing = output.index("\r\n\r\n")
+    assert "\x1b[" not in output[listing:output.rindex("option")]
+
+
+def add_history(*entries):
+    def setup(readline):
+        for entry in entries:
+            readline._history.append(entry)
+    return setup
+
+
+def test_reverse_search_finds_the_newest_match(run):
+    setup = add_history("git status", "ls", "git commit")
+    assert run([key.CTRL_R] + list("git") + [key.CR], setup) == "git commit"
+    assert run([key.CTRL_R] + list("git") + [key.CTRL_R, key.CR], setup) == "git status"
+    assert run([key.CTRL_R] + list("gi") + [key.BACKSPACE, key.BACKSPACE, "l", key.CR], setup) == "ls"
+
+
+def test_cancelled_search_restores_the_line(run):
+    assert run(list("xy") + [key.CTRL_R, "l", key.ESC], add_history("ls")) == "xy"
+
+
+def test_search_prompt_is_redrawn_by_its_changes():
+    output = io.StringIO()
+    readline = NessaidReadline(stdout=output, stderr=output)
+    add_history("git status", "ls", "git commit")(readline)
+    readline._readbuf.extend([key.CTRL_R] + list("git") + [key.CTRL_R, key.CR])
+    assert readline._session_input("# ") == "git status"
+    # The prompt is drawn once, the search string and the match are
+    # updated in place
+    assert output.getvalue().count("reverse-i-search") == 1
+    assert output.getvalue().count("git status") == 2
+
+
+def test_word_kills_and_yank(run):
+    line = list("one two-three")
+    assert run(line + [key.ALT_B, key.ALT_D, key.CTRL_A, key.CTRL_Y]) == "threeone two-"
+    assert run(line + [key.ALT_BACKSPACE, key.ALT_BACKSPACE, key.CTRL_A, key.CTRL_Y]) == "two-threeone "
+    assert run(line + [key.ALT_B, key.ALT_B, key.CTRL_K, key.CTRL_A, key.CTRL_Y]) == "two-threeone "
+    assert run(line + [key.ALT_B, key.CTRL_U, key.CTRL_E, key.CTRL_Y]) == "threeone two-"
+
+
+def multiline(readline):
+    readline.set_multiline(lambda text: text.endswith(";"))
+
+
+def test_enter_starts_a_row_until_the_input_is_complete(run):
+    keys = list("abc") + [key.CR] + list("de") + [key.CR, "f", key.UP, key.UP, "X", key.CTRL_E, ";"]
+    assert run(keys, multiline) == "aXbc\nde\nf;"
+
+
+@pytest.mark.parametrize("multiline_mode, line", [(False, "ab cd"), (True, "ab\ncd")], ids=["single", "multi"])
+@pytest.mark.parametrize("readline_class", [NessaidReadline, NessaidAsyncReadline], ids=["sync", "async"])
+def test_inserted_newlines_follow_the_mode(readline_class, multiline_mode, line):
+    async def main():
+        readline = readline_class(stdout=io.StringIO())
+        if multiline_mode:
+            multiline(readline)
+        result = readline.insert_text("ab\ncd")
+        if asyncio.iscoroutine(result):
+            await result
+        return str(readline._line)
+
+    assert asyncio.run(main()) == line
+
+
+def test_up_and_down_move_between_rows(run):
+    keys = list("abc") + [key.CR] + list("de;") + [key.UP, "X", key.DOWN, key.CTRL_E]
+    assert run(keys, multiline) == "abcX\nde;"
+
+
+def test_up_from_the_first_row_goes_to_the_history(run):
+    def setup(readline):
+        multiline(readline)
+        add_history("old;")(readline)
+    assert run(list("a") + [key.CR, "b", key.UP, key.UP], setup) == "old;"
+
+
+def test_multiline_paste_keeps_the_newlines(run):
+    assert run([PasteEvent("a\r\nb;")], multiline) == "a\nb;"
+
+
+def test_kills_in_a_row_are_joined(run):
+    assert run(list("one two three") + [key.CTRL_W, key.CTRL_W, key.CTRL_Y]) == "one two three"
+
+
+def test_motion_between_kills_starts_a_new_kill(run):
+    keys = list("one two three") + [key.CTRL_W, key.LEFT, key.CTRL_W, key.CTRL_E, key.CTRL_Y]
+    assert run(keys) == "one  two"
+
+
+def test_yank_pop_only_after_yank(run):
+    keys = list("aa bb") + [key.CTRL_W, key.CTRL_W, key.CTRL_Y, key.ALT_Y]
+    assert run(keys) == "aa bb"
+    keys = list("aa bb") + [key.CTRL_W, key.LEFT, key.CTRL_W, key.CTRL_E, key.CTRL_Y, key.ALT_Y]
+    assert run(keys) == " bb"
+    keys = list("aa bb") + [key.CTRL_W, key.LEFT, key.CTRL_W, key.CTRL_E, key.CTRL_Y, key.LEFT, key.ALT_Y]
+    assert run(keys) == " aa"
+
+
+def test_caret_steps_over_marks(run):
+    line = list("cafe\u0301")
+    assert run(line + [key.LEFT, "X"]) == "cafXe\u0301"
+    assert run(line + [key.LEFT, key.LEFT, key.RIGHT, key.RIGHT, "X"]) == "cafe\u0301X"
+
+
+def test_delete_takes_the_marks_along(run):
+    line = list("cafe\u0301\u0302")
+    assert run(line + [key.BACKSPACE]) == "caf"
+    assert run(line + [key.LEFT, key.DELETE]) == "caf"
+
+
+def test_word_motions_take_in_marks(run):
+    line = list("cafe\u0301s x")
+    assert run(line + [key.ALT_B, key.ALT_B, "Y"]) == "Ycafe\u0301s x"
+    assert run(line + [key.CTRL_A, key.ALT_F, "Y"]) == "cafe\u0301sY x"
+
+
+def test_batch_mode_reads_whole_lines():
+    output = io.StringIO()
+    readline = NessaidReadline(stdin=io.StringIO("one\r\ntwo\n\x1b[A\tthree"), stdout=output, stderr=output)
+    assert [readline.readline("# ") for _ in range(3)] == ["one", "two", "\x1b[A\tthree"]
+    with pytest.raises(NessaidReadlineEOF):
+        readline.readline("# ")
+    # No echo, and only the lines read with readline go to the history
+    assert output.getvalue() == ""
+    assert list(readline._history) == ["one", "two", "\x1b[A\tthree"]
+
+
+def test_batch_input_is_kept_out_of_history():
+    readline = NessaidReadline(stdin=io.StringIO("secret\n"), stdout=io.StringIO())
+    assert readline.input("Password: ", mask_input=True) == "secret"
+    assert len(readline._history) == 0
+
+
+BATCH_SCRIPT = """
+import os, sys, asyncio
+from nessaid_readline.async_readline import NessaidAsyncReadline
+
+async def main():
+    readline = NessaidAsyncReadline()
+    lines = [await readline.readline("# ") for _ in range(2)]
+    blocking = os.get_blocking(0)
+    lines.append(await readline.readline("# "))
+    print(lines, blocking, os.get_blocking(0), repr(sys.stdin.read()))
+
+asyncio.run(main())
+"""
+
+
+@pytest.mark.skipif(not hasattr(os, "get_blocking") or sys.platform == "win32", reason="posix pipes")
+def test_async_batch_input_leaves_stdin_blocking():
+    result = subprocess.run(
+        [sys.executable, "-c", BATCH_SCRIPT], input=b"one\ntwo\nthree\n",
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    assert result.stdout.decode().strip() == "['one', 'two', 'three'] True True ''"
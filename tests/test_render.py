@@ -0,0 +1,431 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import io
+import re
+import random
+
+import pytest
+
+import nessaid_readline.key as key
+from nessaid_readline.readline import NessaidReadline
+from nessaid_readline.charwidth import char_width, text_width
+from nessaid_readline.render import (
+    LineRenderer, OutputFrame, ANSI_CAPABILITIES, DUMB_CAPABILITIES, SYNC_FRAME_SIZE, SYNC_START, SYNC_END,
+    SCROLL_LEFT_MARKER, SCROLL_RIGHT_MARKER, MultiLineRenderer, layout_columns, page_capacity
+)
+from nessaid_readline.linebuffer import LineBuffer
+
+
+class CountingOutput(io.StringIO):
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+        self.flushes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+    def flush(self):
+        self.flushes += 1
+
+
+_CONTROL = re.compile(r"\x1b\[(\d*)([A-DJK@P])|[\b\r\n]|[^\x1b\b\r\n]")
+
+
+class Screen():
+    """
+    Terminal screen for the renderer output, knowing the controls the
+    renderers write. A cell holds a character with the marks on it, ""
+    for the right half of a wide character and None when blank.
+    """
+
+    def __init__(self):
+        self.rows = [[]]
+        self.row = 0
+        self.col = 0
+
+    def write(self, data):
+        pos = 0
+        while pos < len(data):
+            match = _CONTROL.match(data, pos)
+            assert match, "unknown output {!r}".format(data[pos:])
+            pos = match.end()
+            token = match.group(0)
+            if match.group(2):
+                self._control(match.group(2), int(match.group(1) or 1))
+            elif token == "\b":
+                assert self.col > 0
+                self.col -= 1
+            elif token == "\r":
+                self.col = 0
+            elif token == "\n":
+                self._control("B", 1)
+            else:
+                self._put(token)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _cells(self):
+        cells = self.rows[self.row]
+        if len(cells) < self.col:
+            cells.extend([None] * (self.col - len(cells)))
+        return cells
+
+    def _put(self, ch):
+        cells = self._cells()
+        width = char_width(ch)
+        if not width:
+            assert self.col and cells[self.col - 1], "mark {!r} on no character".format(ch)
+            cells[self.col - 1] += ch
+            return
+        cells[self.col:self.col + width] = [ch] + [""] * (width - 1)
+        self.col += width
+
+    def _control(self, final, count):
+        if final == "A":
+            assert self.row >= count
+            self.row -= count
+        elif final == "B":
+            self.row += count
+            while len(self.rows) <= self.row:
+                self.rows.append([])
+        elif final == "C":
+            self.col += count
+        elif final == "D":
+            assert self.col >= count
+            self.col -= count
+        elif final == "K":
+            del self._cells()[self.col:]
+        elif final == "J":
+            del self._cells()[self.col:]
+            del self.rows[self.row + 1:]
+        elif final == "@":
+            self._cells()[self.col:self.col] = [None] * count
+        elif final == "P":
+            del self._cells()[self.col:self.col + count]
+
+    def line(self, row=None):
+        # Spaces written out look the same as blank cells, the trailing
+        # ones are left out
+        cells = self.rows[self.row if row is None else row]
+        return "".join(" " if cell is None else cell for cell in cells).rstrip(" ")
+
+
+def make_renderer(text, cursor):
+    output = io.StringIO()
+    renderer = LineRenderer(output, ANSI_CAPABILITIES)
+    renderer.reset(text, cursor)
+    return renderer, output
+
+
+def test_move_forward_does_not_draw_marks_again():
+    renderer, output = make_renderer("e\u0301x", 1)
+    renderer.update("e\u0301x", 3)
+    assert output.getvalue() == "x"
+
+
+def test_move_forward_writes_whole_characters():
+    renderer, output = make_renderer("e\u0301x", 0)
+    renderer.update("e\u0301x", 1)
+    assert output.getvalue() == "e\u0301"
+
+
+@pytest.mark.parametrize("capabilities", [ANSI_CAPABILITIES, DUMB_CAPABILITIES], ids=["ansi", "dumb"])
+def test_random_edits_leave_the_line_on_screen(capabilities):
+    screen = Screen()
+    renderer = LineRenderer(screen, capabilities)
+    rand = random.Random(11)
+    text = ""
+    for _ in range(500):
+        pos = rand.randint(0, len(text))
+        edit = rand.random()
+        if edit < 0.5:
+            text = text[:pos] + "".join(rand.choice("abc xyz") for _ in range(rand.randint(1, 12))) + text[pos:]
+        elif edit < 0.8:
+            text = text[:pos] + text[pos + rand.randint(1, 12):]
+        elif edit < 0.9:
+            text = text[:pos] + text[pos:].upper()
+        cursor = rand.randint(0, len(text))
+        renderer.update(text, cursor)
+        assert screen.line() == text.rstrip(" ")
+        assert screen.col == text_width(text[:cursor])
+
+
+@pytest.mark.parametrize("capabilities", [ANSI_CAPABILITIES, DUMB_CAPABILITIES], ids=["ansi", "dumb"])
+def test_random_edits_of_marked_and_wide_characters(capabilities):
+    screen = Screen()
+    renderer = LineRenderer(screen, capabilities)
+    rand = random.Random(22)
+    clusters = ["a", "b", " ", "e\u0301", "o\u0308\u0301", "\u4e2d", "\uac00"]
+    line = []
+    for _ in range(500):
+        pos = rand.randint(0, len(line))
+        if rand.random() < 0.6:
+            line[pos:pos] = [rand.choice(clusters) for _ in range(rand.randint(1, 6))]
+        else:
+            del line[pos:pos + rand.randint(1, 6)]
+        # The caret is kept on the character bounds, as the readline does
+        cursor = len("".join(line[:rand.randint(0, len(line))]))
+        text = "".join(line)
+        renderer.update(text, cursor)
+        assert screen.line() == text.rstrip(" ")
+        assert screen.col == text_width(text[:cursor])
+
+
+def test_typing_at_the_end_writes_the_character():
+    output = io.StringIO()
+    renderer = LineRenderer(output, ANSI_CAPABILITIES)
+    renderer.update("abc", 3)
+    renderer.update("abcd", 4)
+    assert output.getvalue() == "abcd"
+
+
+def test_insert_before_a_long_tail_shifts_it():
+    text = "a" + "z" * 100
+    output = io.StringIO()
+    renderer = LineRenderer(output, ANSI_CAPABILITIES)
+    renderer.reset(text, 1)
+    renderer.update("ab" + text[1:], 2)
+    assert output.getvalue() == "\x1b[1@b"
+
+
+def test_delete_before_a_long_tail_shifts_it():
+    text = "ab" + "z" * 100
+    output = io.StringIO()
+    renderer = LineRenderer(output, ANSI_CAPABILITIES)
+    renderer.reset(text, 2)
+    renderer.update("a" + text[2:], 1)
+    assert output.getvalue() == "\b\x1b[1P"
+
+
+def test_cursor_moves_with_csi_over_long_distances():
+    text = "z" * 100
+    output = io.StringIO()
+    renderer = LineRenderer(output, ANSI_CAPABILITIES)
+    renderer.reset(text, 100)
+    renderer.update(text, 0)
+    renderer.update(text, 2)
+    assert output.getvalue() == "\x1b[100Dzz"
+
+
+@pytest.mark.parametrize("capabilities", [ANSI_CAPABILITIES, DUMB_CAPABILITIES], ids=["ansi", "dumb"])
+def test_viewport_keeps_the_cursor_in_the_width(capabilities):
+    width = 20
+    screen = Screen()
+    renderer = LineRenderer(screen, capabilities)
+    renderer.set_width(width)
+    rand = random.Random(12)
+    text = ""
+    for _ in range(500):
+        pos = rand.randint(0, len(text))
+        if rand.random() < 0.6:
+            text = text[:pos] + "".join(rand.choice("abcd\u4e2d") for _ in range(rand.randint(1, 8))) + text[pos:]
+        else:
+            text = text[:pos] + text[pos + rand.randint(1, 8):]
+        cursor = rand.randint(0, len(text))
+        renderer.update(text, cursor)
+
+        line = screen.line()
+        assert text_width(line) <= width
+        if text_width(text) < width:
+            assert line == text
+        cells = screen.rows[0]
+        if cursor < len(text):
+            assert cells[screen.col] == text[cursor]
+        else:
+            assert screen.col < width
+        if cursor and cells[screen.col - 1] != "":
+            # At the left edge the character can be under the marker, a
+            # wide one under the marker and a space
+            before = cells[screen.col - 1]
+            assert before == text[cursor - 1] or (
+                screen.col <= 2 and line.startswith(SCROLL_LEFT_MARKER) and before in (SCROLL_LEFT_MARKER, " ")
+            )
+        if line.startswith(SCROLL_LEFT_MARKER) or line.endswith(SCROLL_RIGHT_MARKER):
+            assert text_width(text) >= width
+
+
+def test_viewport_jumps_by_half_the_width():
+    width = 20
+    output = io.StringIO()
+    renderer = LineRenderer(output, ANSI_CAPABILITIES)
+    renderer.set_width(width)
+    text = ""
+    redraws = 0
+    for ch in "x" * 100:
+        text += ch
+        before = len(output.getvalue())
+        renderer.update(text, len(text))
+        if len(output.getvalue()) - before > 1:
+            redraws += 1
+    # Typing on scrolls the line once for each half width typed
+    assert redraws <= 100 // (width // 2) + 1
+
+
+@pytest.mark.parametrize("capabilities", [ANSI_CAPABILITIES, DUMB_CAPABILITIES], ids=["ansi", "dumb"])
+def test_random_edits_leave_the_rows_on_screen(capabilities):
+    screen = Screen()
+    screen.write("# ")
+    renderer = MultiLineRenderer(screen, capabilities)
+    renderer.set_prompts("# ", "> ")
+    renderer.reset()
+    rand = random.Random(21)
+    line = LineBuffer()
+    for _ in range(300):
+        pos = rand.randint(0, len(line))
+        if rand.random() < 0.6:
+            line.insert(pos, "".join(rand.choice("ab \n") for _ in range(rand.randint(1, 4))))
+        else:
+            line.delete(pos, rand.randint(1, 4))
+        cursor = rand.randint(0, len(line))
+        renderer.update(line if rand.random() < 0.5 else str(line), cursor)
+
+        text = str(line)
+        rows = text.split("\n")
+        cursor_row, column = line.row_of(cursor)
+        # Without cursor movement the rows can be drawn again below
+        top = screen.row - cursor_row
+        assert top >= 0
+        expected = ["# " + rows[0]] + ["> " + row for row in rows[1:]]
+        lines = [screen.line(row) for row in range(top, len(screen.rows))]
+        while lines and not lines[-1]:
+            lines.pop()
+        assert lines == [row.rstrip(" ") for row in expected]
+        assert screen.col == 2 + column
+        assert renderer.text == text
+        assert renderer.row_count == len(rows)
+    if capabilities is ANSI_CAPABILITIES:
+        assert top == 0
+
+
+def test_goto_end_leaves_the_cursor_after_the_last_row():
+    screen = Screen()
+    screen.write("# ")
+    renderer = MultiLineRenderer(screen, ANSI_CAPABILITIES)
+    renderer.set_prompts("# ", "> ")
+    renderer.reset()
+    renderer.update("one\ntwo\nthree", 1)
+    renderer.goto_end()
+    assert (screen.row, screen.col) == (2, 7)
+    renderer.erase_row()
+    assert (screen.rows, screen.row, screen.col) == ([[]], 0, 0)
+
+
+class KeyByKeyTerminal():
+    """
+    Terminal handing out the keys one read at a time, as when they are
+    typed faster than the line is drawn
+    """
+
+    def __init__(self, keys):
+        self._keys = list(keys)
+        self.capabilities = ANSI_CAPABILITIES
+        self.size = None
+
+    def read(self, single_char=False, timeout=None):
+        return [self._keys.pop(0)] if self._keys else []
+
+
+def type_keys(keys, rate=None):
+    stdout = CountingOutput()
+    readline = NessaidReadline(stdout=stdout, stderr=stdout)
+    readline._terminal = KeyByKeyTerminal(keys + [key.CR])
+    readline.set_max_frame_rate(rate)
+    line = readline._session_input("# ")
+    screen = Screen()
+    screen.write(stdout.getvalue())
+    return line, stdout.flushes, screen.line(0)
+
+
+def test_each_key_is_drawn_without_a_frame_cap():
+    # The prompt, each key and the line accepted
+    assert type_keys(list("abcdef")) == ("abcdef", 8, "# abcdef")
+
+
+def test_frame_cap_draws_keys_together():
+    # The prompt is drawn at once, the keys typed within the frame
+    # interval are drawn with the line accepted
+    assert type_keys(list("abcdef") + [key.LEFT, "X"], rate=1) == ("abcdeXf", 2, "# abcdeXf")
+
+
+def test_frame_is_sent_with_one_write():
+    stdout = CountingOutput()
+    frame = OutputFrame(stdout)
+    frame.write("a")
+    frame.write("")
+    frame.write("bc")
+    assert frame.pending()
+    assert stdout.writes == 0
+    frame.flush()
+    frame.flush()
+    assert (stdout.getvalue(), stdout.writes, stdout.flushes) == ("abc", 1, 1)
+    assert not frame.pending()
+    frame.keys = 2
+    assert frame.stats() == {
+        "keys": 2, "writes": 1, "flushes": 1, "bytes": 3, "flushes_per_key": 0.5, "bytes_per_key": 1.5
+    }
+
+
+def test_discarded_frame_is_not_sent():
+    stdout = CountingOutput()
+    frame = OutputFrame(stdout)
+    frame.write("abc")
+    frame.discard()
+    frame.flush()
+    assert stdout.writes == 0
+
+
+def test_only_large_frames_are_synchronized():
+    stdout = io.StringIO()
+    frame = OutputFrame(stdout)
+    frame.set_synchronized()
+    frame.write("a")
+    frame.flush()
+    frame.write("b" * (SYNC_FRAME_SIZE + 1))
+    frame.flush()
+    assert stdout.getvalue() == "a" + SYNC_START + "b" * (SYNC_FRAME_SIZE + 1) + SYNC_END
+
+
+def test_key_burst_is_written_once():
+    stdout = CountingOutput()
+    readline = NessaidReadline(stdout=stdout, stderr=stdout)
+    readline._readbuf.extend(list("abc") + [key.LEFT, key.BACKSPACE, key.CR])
+    assert readline._session_input("# ") == "ac"
+    assert (stdout.writes, stdout.flushes) == (1, 1)
+    stats = readline.get_output_stats()
+    assert (stats["keys"], stats["writes"], stats["flushes"]) == (6, 1, 1)
+
+
+def test_columns_are_sorted_down_then_across():
+    assert layout_columns(list("abcdefg"), 10) == (["a  d  g", "b  e", "c  f"], 7)
+
+
+def test_columns_cut_at_max_rows():
+    items = list("abcdefg")
+    assert layout_columns(items, 10, max_rows=2) == (["a  c  e", "b  d  f"], 6)
+    assert page_capacity(items, 10, 2) == 6
+
+
+def test_columns_fit_the_width():
+    items = ["\u4e2d" * (n % 5 + 1) for n in range(50)]
+    lines, count = layout_columns(items, 40)
+    assert count == 50
+    assert all(text_width(line) < 40 for line in lines)
+    assert [item for line in lines for item in line.split()] == [
+        items[row + column * len(lines)] for row in range(len(lines))
+        for column in range(-(-50 // len(lines))) if row + column * len(lines) < 50
+    ]
+
+
+def test_no_items_to_lay_out():
+    assert layout_columns([], 80) == ([], 0)
+    assert page_capacity([], 80, 5) == 5
@@ -0,0 +1,139 @@
+# Copyright 2021 by Saithalavi M, saithalavi@gmail.com
+# All rights reserved.
+# This file is part of the Nessaid readline Framework, nessaid_readline python package
+# and is released under the "MIT License Agreement". Please see the LICENSE
+# file included as part of this package.
+#
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+from nessaid_readline.server import (
+    TelnetFilter, NessaidReadlineServer, ReadlineSession, TELNET_NEGOTIATION, IAC, DO, WILL, SB, SE, OPT_NAWS,
+    OPT_SGA
+)
+
+
+NAWS = bytes([IAC, SB, OPT_NAWS, 0, 132, 0, 43, IAC, SE])
+CLIENT_DATA = bytes([IAC, WILL, OPT_NAWS]) + b"a" + NAWS + b"b\r\0c" + bytes([IAC, IAC]) + b"\r\nd"
+
+
+def filter_all(chunks):
+    sizes = []
+    telnet = TelnetFilter(on_resize=lambda columns, rows: sizes.append((columns, rows)))
+    return b"".join(telnet.feed(chunk) for chunk in chunks), sizes
+
+
+def test_telnet_commands_are_stripped():
+    assert filter_all([CLIENT_DATA]) == (b"ab\rc\xff\rd", [(132, 43)])
+
+
+@pytest.mark.parametrize("split", range(1, len(CLIENT_DATA)))
+def test_telnet_commands_split_across_reads(split):
+    assert filter_all([CLIENT_DATA[:split], CLIENT_DATA[split:]]) == (b"ab\rc\xff\rd", [(132, 43)])
+
+
+def test_zero_window_size_is_ignored():
+    assert filter_all([bytes([IAC, SB, OPT_NAWS, 0, 0, 0, 24, IAC, SE, IAC, DO, OPT_SGA])]) == (b"", [])
+
+
+async def handle(session):
+    while True:
+        line = await session.readline.readline("# ")
+        session.write("got {} {}\n".format(line, session.size))
+        await session.drain()
+
+
+async def talk(port, name):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        negotiation = await reader.readexactly(len(TELNET_NEGOTIATION))
+        writer.write(NAWS + name.encode() + b"\r\0")
+        await writer.drain()
+        return negotiation, await reader.readuntil(b")\r\n")
+    finally:
+        writer.close()
+
+
+def test_server_runs_sessions_side_by_side():
+    async def main():
+        server = NessaidReadlineServer(handle)
+        tcp = await server.start_tcp("127.0.0.1", 0)
+        port = tcp.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.wait_for(asyncio.gather(talk(port, "one"), talk(port, "two")), 5)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    for (negotiation, reply), name in zip(asyncio.run(main()), ("one", "two")):
+        assert negotiation == TELNET_NEGOTIATION
+        assert reply.endswith("got {} (132, 43)\r\n".format(name).encode())
+
+
+class StalledWriter():
+    """
+    Stream writer of a client taking no output until released
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.drains = 0
+        self.released = asyncio.Event()
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        self.drains += 1
+        await self.released.wait()
+
+
+def test_keys_wait_for_the_client_to_take_the_output():
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"ab\r")
+        writer = StalledWriter()
+        session = ReadlineSession(reader, writer, telnet=False)
+        task = asyncio.ensure_future(session.readline.readline("# "))
+        await asyncio.sleep(0.05)
+        stalled = (task.done(), writer.drains, bytes(writer.data))
+        writer.released.set()
+        return stalled, await asyncio.wait_for(task, 1)
+
+    (done, drains, data), line = asyncio.run(main())
+    assert not done and drains == 1
+    # Only the prompt was written before the stall
+    assert data == b"# "
+    assert line == "ab"
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs a pty")
+def test_session_over_a_pty():
+    import pty
+    import tty
+
+    async def main():
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        session = await ReadlineSession.from_pty(master)
+        try:
+            os.write(slave, b"hi\r")
+            line = await asyncio.wait_for(session.readline.readline("# "), 1)
+            session.write("done\n")
+            await session.drain()
+            await asyncio.sleep(0.05)
+            return line, os.read(slave, 1024)
+        finally:
+            session.close()
+            os.close(slave)
+
+    line, output = asyncio.run(main())
+    assert line == "hi"
+    assert output.startswith(b"# hi") and output.endswith(b"done\r\n")